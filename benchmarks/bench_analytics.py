@@ -0,0 +1,52 @@
+"""
+analytics (NumPy) 与 consumption (纯 Python) 计算消耗速度的耗时和结果差异, 以及 analytics 到 1000 万点的扩展性.
+
+在项目根目录运行 (需要 key.toml): `python benchmarks/bench_analytics.py`.
+"""
+
+import time
+
+import numpy as np
+
+from ecnuqueryelectricbill import analytics, consumption
+
+PYTHON_MAX = 1_000_000  # 纯 Python 版本只测到这个规模.
+
+
+def make_series(n: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """不等间隔的记录, 电量缓慢下降, 中间有几次充值."""
+    rng = np.random.default_rng(seed)
+    t = 1.7e9 + np.cumsum(rng.exponential(173, n))
+    d = 100 - np.cumsum(rng.exponential(0.01, n))
+    for i in rng.integers(0, n, 5):
+        d[i:] += 50
+    return t, d
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    print(f"{'points':>10} {'python':>10} {'numpy':>10} {'speedup':>8} {'max rel err':>12}")
+    for n in (10_000, 100_000, 1_000_000, 10_000_000):
+        t, d = make_series(n)
+        (_, fast), numpy_time = timed(analytics.consuming_speed, t, d)
+        if n <= PYTHON_MAX:
+            (_, slow), python_time = timed(consumption.consuming_speed, t.tolist(), d.tolist())
+            slow = np.asarray(slow)
+            err = np.max(np.abs(slow - fast) / np.maximum(np.abs(slow), 1e-12))
+            print(f"{n:>10} {python_time:>9.3f}s {numpy_time:>9.3f}s {python_time / numpy_time:>7.1f}x {err:>12.2e}")
+        else:
+            print(f"{n:>10} {'-':>10} {numpy_time:>9.3f}s {'-':>8} {'-':>12}")
+    t, d = make_series(10_000_000)
+    _, elapsed = timed(analytics.daily, t, d)
+    print(f"daily aggregate of 10M points: {elapsed:.3f}s")
+    _, elapsed = timed(analytics.recharges, t, d)
+    print(f"recharge detection of 10M points: {elapsed:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+上游查询的缓存和合并: rooms 个宿舍名配置的是同一个宿舍 (室友各自上传自己的 token),
+统计服务端实际向 (模拟的) epay 发出的查询数.
+
+1. 所有客户端同时上传 token, 每个宿舍名都会立即查询一次, 相同的查询应当合并为一次.
+2. 所有客户端同时发送 REFRESH, 应当只有一次真正查询上游, 其余被限流.
+
+在项目根目录运行 (需要 key.toml): `python benchmarks/bench_cache.py [宿舍名个数]`.
+"""
+
+import asyncio
+import os
+import subprocess
+import sys
+import tempfile
+
+import toml
+from websockets.asyncio.client import connect
+
+from bench_load import SERVER_CODE, wait_port
+from ecnuqueryelectricbill import SERVER_PORT, DEFAULT_ROOM
+from ecnuqueryelectricbill.client import GuardClient
+from fake_epay import FakeEpay
+
+ROOMS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+LATENCY = 0.2  # 上游响应时间, 查询越慢, 同时进行的相同查询越多.
+SETTLE = 3  # 上传 token 后等待查询完成的秒数.
+
+
+def write_roommates(directory: str, rooms: int):
+    info = {"roomNo": "0", "elcarea": 1, "elcbuis": "b"}
+    config = dict(info, rooms={f"mate{i}": dict(info) for i in range(1, rooms)})
+    with open(os.path.join(directory, "room.toml"), "w") as f:
+        toml.dump(config, f)
+
+
+def room_name(i: int) -> str:
+    return DEFAULT_ROOM if i == 0 else f"mate{i}"
+
+
+async def main():
+    fake = FakeEpay(latency=LATENCY)
+    url = await fake.start()
+    with tempfile.TemporaryDirectory() as directory:
+        write_roommates(directory, ROOMS)
+        server = subprocess.Popen(
+            [sys.executable, "-c", SERVER_CODE, directory, url],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            await wait_port(SERVER_PORT)
+            connections = [await connect(f"ws://127.0.0.1:{SERVER_PORT}/") for _ in range(ROOMS)]
+            clients = [GuardClient(connection, room_name(i)) for i, connection in enumerate(connections)]
+            await asyncio.gather(*(client.post_token(*fake.login()) for client in clients))
+            await asyncio.sleep(SETTLE)
+            degrees = await asyncio.gather(*(client.fetch_degree() for client in clients))
+            print(f"post_token x{ROOMS}: {fake.requests} upstream queries, "
+                  f"{sum(degree >= 0 for degree in degrees)}/{ROOMS} rooms have a degree")
+
+            before = fake.requests
+            results = await asyncio.gather(*(client.refresh_degree() for client in clients), return_exceptions=True)
+            limited = sum(isinstance(result, ValueError) for result in results)
+            print(f"refresh x{ROOMS}: {fake.requests - before} upstream queries, "
+                  f"{ROOMS - limited} refreshed, {limited} rate limited")
+            for connection in connections:
+                await connection.close()
+        finally:
+            server.terminate()
+            server.wait()
+            await fake.stop()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,105 @@
+"""
+消息压缩: 比较 JSON, BINARY 和 BINARY_ZLIB 编码下电量历史消息加密后的字节数和编解码耗时.
+
+历史为模拟的一个月记录: 查询间隔在 1 到 30 分钟之间浮动 (同 AdaptiveInterval 加上抖动),
+电量每次下降 0.01 的整数倍, 低于 5 度时充值.
+
+在项目根目录运行 (需要 key.toml): `python benchmarks/bench_compression.py [天数]`.
+"""
+
+import random
+import sys
+import time
+import zlib
+
+from ecnuqueryelectricbill import codec
+from ecnuqueryelectricbill.encryption import decrypt, encrypt
+from ecnuqueryelectricbill.server import FETCH_DEGREE_LINES, MAX_RANGE_POINTS, STREAM_CHUNK, series
+from ecnuqueryelectricbill.store import RECORD, format_record
+
+DAYS = float(sys.argv[1]) if len(sys.argv) > 1 else 30
+ROUNDS = 20
+
+
+def month_history() -> list[tuple[float, float]]:
+    random.seed(0)
+    records = []
+    t, degree = time.time() - DAYS * 86400, 150.0
+    while t < time.time():
+        t += random.uniform(60, 1800) * random.uniform(0.8, 1.2)
+        degree -= random.choice((0, 0.01, 0.01, 0.02, 0.05))
+        if degree < 5:
+            degree += 200  # 充值.
+        records.append((t, round(degree, 2)))
+    return records
+
+
+def messages(records: list[tuple[float, float]]) -> dict[str, dict]:
+    """服务端实际会发送的几种历史消息, 按 (JSON 时的内容, 二进制编码时的内容) 给出."""
+    tail = records[-FETCH_DEGREE_LINES:]
+    step = max(1, len(records) // MAX_RANGE_POINTS)
+    ranged = records[::step]
+    chunk = b"".join(RECORD.pack(*record) for record in records[:STREAM_CHUNK])
+    return {
+        "fetch_degree_file": (
+            {"retcode": 0, "id": 1, "content": "\n".join(format_record(*record) for record in tail)},
+            {"retcode": 0, "id": 1, "content": series(*zip(*tail))},
+        ),
+        "fetch_degree_range": (
+            None,  # JSON 时同样是 series, 由 codec 转为列表.
+            {"retcode": 0, "id": 2, "content": series(*zip(*ranged))},
+        ),
+        "stream chunk": (
+            None,  # 只能用二进制编码传输.
+            {"retcode": 0, "id": 3, "stream": 0, "offset": 0, "content": chunk},
+        ),
+    }
+
+
+def measure(message, codec_: str) -> tuple[int, float, float]:
+    """返回 (加密后字节数, 编码+加密微秒, 解密+解码微秒)."""
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        data = encrypt(codec.dumps(message, codec_))
+    middle = time.perf_counter()
+    for _ in range(ROUNDS):
+        codec.loads(decrypt(data))
+    end = time.perf_counter()
+    return len(data), (middle - start) / ROUNDS * 1e6, (end - middle) / ROUNDS * 1e6
+
+
+def main():
+    records = month_history()
+    print(f"{len(records)} records over {DAYS:g} days, "
+          f"COMPRESS_LEVEL={codec.COMPRESS_LEVEL}, COMPRESS_MIN={codec.COMPRESS_MIN}")
+    print(f"{'message':>20} {'codec':>6} {'bytes':>9} {'ratio':>6} {'encode us':>10} {'decode us':>10}")
+    for name, (text, binary) in messages(records).items():
+        rows = []
+        if text is not None:
+            rows.append((codec.JSON, text))
+        elif name != "stream chunk":
+            rows.append((codec.JSON, binary))
+        rows += [(codec.BINARY, binary), (codec.BINARY_ZLIB, binary)]
+        baseline = None
+        for codec_, message in rows:
+            size, encode_us, decode_us = measure(message, codec_)
+            baseline = baseline or size
+            print(f"{name:>20} {codec_:>6} {size:>9} {baseline / size:>6.2f} {encode_us:>10.0f} {decode_us:>10.0f}")
+
+    # 差分重排的作用: 对同一段记录比较直接 zlib 压缩和 BINARY_ZLIB.
+    tail = records[-FETCH_DEGREE_LINES:]
+    plain = codec.dumps(series(*zip(*tail)), codec.BINARY)
+    print(f"\nlast {len(tail)} records as series: BINARY {len(plain)} bytes, "
+          f"zlib only {len(zlib.compress(plain, codec.COMPRESS_LEVEL))}, "
+          f"BINARY_ZLIB {len(codec.dumps(series(*zip(*tail)), codec.BINARY_ZLIB))}")
+    whole = series(*zip(*records))
+    for level in (1, 6, 9):
+        codec.COMPRESS_LEVEL = level
+        start = time.perf_counter()
+        size = len(codec.dumps(whole, codec.BINARY_ZLIB))
+        print(f"whole history, level {level}: {len(codec.dumps(whole, codec.BINARY))} -> {size} bytes "
+              f"in {(time.perf_counter() - start) * 1e3:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""
+加密吞吐量: 旧的 AES-CBC (静态 IV + pad) 和现在的 AES-GCM, 负载为数 MB 的电量记录文本.
+
+在项目根目录运行 (需要 key.toml): `python benchmarks/bench_encryption.py [MB]`.
+"""
+
+import json
+import sys
+import time
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad, unpad
+
+from ecnuqueryelectricbill import KEY
+from ecnuqueryelectricbill.encryption import decrypt, encrypt
+
+SIZE_MB = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+ROUNDS = 10
+IV = bytes(16)
+
+
+def old_encrypt(message: str | bytes) -> bytes:
+    if isinstance(message, str):
+        message = message.encode('utf-8')
+    return AES.new(KEY, AES.MODE_CBC, iv=IV).encrypt(pad(message, AES.block_size))
+
+
+def old_decrypt(data: bytes) -> bytes:
+    return unpad(AES.new(KEY, AES.MODE_CBC, iv=IV).decrypt(data), AES.block_size)
+
+
+def history_payload() -> str:
+    lines = []
+    size, i = 0, 0
+    while size < SIZE_MB * 1e6:
+        line = f"{1.7e9 + i * 173:.2f}, {100 - i * 0.01:.7g}"
+        lines.append(line)
+        size += len(line) + 1
+        i += 1
+    return json.dumps({"retcode": 0, "content": "\n".join(lines)})
+
+
+def measure(name: str, func, data) -> object:
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        out = func(data)
+    elapsed = (time.perf_counter() - start) / ROUNDS
+    print(f"{name:>12}: {elapsed * 1000:8.2f} ms, {len(data) / elapsed / 1e6:8.1f} MB/s")
+    return out
+
+
+def main():
+    payload = history_payload()
+    print(f"payload: {len(payload) / 1e6:.1f} MB")
+    ciphertext = measure("cbc encrypt", old_encrypt, payload)
+    measure("cbc decrypt", old_decrypt, ciphertext)
+    ciphertext = measure("gcm encrypt", encrypt, payload)
+    measure("gcm decrypt", decrypt, ciphertext)
+    small = json.dumps({"retcode": 0, "content": 42.5})
+    start = time.perf_counter()
+    for _ in range(10000):
+        decrypt(encrypt(small))
+    print(f"small message round trip: {(time.perf_counter() - start) / 10000 * 1e6:.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+对比旧的 FETCH_DEGREE_FILE 做法 (整个 csv 去重重写后 splitlines 取最后 N 行)
+和 DegreeStore 取最后 N 条记录的耗时, 以及读取期间事件循环的最大停顿.
+
+在项目根目录运行 (需要 key.toml): `python benchmarks/bench_history_tail.py [行数]`.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from ecnuqueryelectricbill.store import DegreeStore, format_record, migrate_csv
+
+LINES = int(sys.argv[1]) if len(sys.argv) > 1 else 3_000_000
+TAIL = 1000
+
+
+def write_history(path: str):
+    """每 10 秒一条, 每 20 条电量下降 0.01, 和实际日志中大量重复的情况类似."""
+    degree = 1e5
+    with open(path, "w") as f:
+        for i in range(LINES):
+            if i % 20 == 0:
+                degree -= 0.01
+            f.write(f"{1.7e9 + i * 10:.2f}, {round(degree, 2)}\n")
+
+
+def old_fetch(path: str) -> str:
+    prev_degree = -1
+    new = []
+    with open(path, "r") as f:
+        for line in f:
+            if line.isspace():
+                continue
+            timestamp, degree_ = line.split(',')
+            degree_ = float(degree_)
+            if degree_ == prev_degree:
+                continue
+            new.append(','.join((timestamp, str(degree_))))
+            prev_degree = degree_
+    with open(path, "w") as f:
+        f.write('\n'.join(new) + "\n")
+    with open(path, "r") as f:
+        return "\n".join(f.read().splitlines()[-TAIL:])
+
+
+def new_fetch(store: DegreeStore) -> str:
+    return "\n".join(format_record(*record) for record in store.tail(TAIL))
+
+
+async def max_loop_lag(func, *args) -> tuple[float, float]:
+    """在线程中执行 func, 同时测量事件循环最大的调度延迟, 返回 (耗时, 最大延迟)."""
+    lag = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal lag
+        while not done:
+            start = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lag = max(lag, time.perf_counter() - start - 0.001)
+
+    task = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.to_thread(func, *args)
+    elapsed = time.perf_counter() - start
+    done = True
+    await task
+    return elapsed, lag
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = os.path.join(directory, "degree.csv")
+        bin_path = os.path.join(directory, "degree.bin")
+        write_history(csv_path)
+        print(f"history: {LINES} lines, {os.path.getsize(csv_path) / 1e6:.1f} MB csv")
+
+        start = time.perf_counter()
+        old_fetch(csv_path)  # 第一次会真正去重重写.
+        print(f"old fetch (first, rewrite): {time.perf_counter() - start:8.3f} s")
+        start = time.perf_counter()
+        old_fetch(csv_path)
+        print(f"old fetch (deduped file):   {time.perf_counter() - start:8.3f} s")
+
+        write_history(csv_path)
+        start = time.perf_counter()
+        migrate_csv(csv_path, bin_path)
+        print(f"one-shot migration:         {time.perf_counter() - start:8.3f} s")
+
+        store = DegreeStore(bin_path)
+        print(f"store: {len(store)} records, {os.path.getsize(bin_path) / 1e6:.1f} MB")
+        start = time.perf_counter()
+        for _ in range(100):
+            new_fetch(store)
+        print(f"new fetch (tail {TAIL}):       {(time.perf_counter() - start) / 100 * 1000:8.3f} ms")
+
+        elapsed, lag = await max_loop_lag(new_fetch, store)
+        print(f"new fetch in thread: {elapsed * 1000:.3f} ms, max event loop lag {lag * 1000:.3f} ms")
+        store.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,98 @@
+"""
+启动时的导入耗时: 用 `python -X importtime` 分别导入三个入口模块, 检查耗时预算和不应在启动时加载的重型依赖.
+
+Qt 只在客户端弹窗或创建 QApplication 时才需要, Selenium 只在登录失效时才需要,
+matplotlib 和 numpy 只在 billvisualize 画图或使用 BINARY_ZLIB 编码时才需要, 都不应在导入入口模块时加载.
+机器快慢不同, 预算以基准耗时 (`python -c pass` 启动时自身导入模块的耗时, 同样取多轮最小值) 的倍数给出.
+超出预算或加载了不该加载的模块时以状态码 1 退出, 当前环境缺少某个入口的依赖 (如服务器上没有 PySide6) 时跳过该入口.
+
+在项目根目录运行: `python benchmarks/bench_import_time.py [轮数]`.
+"""
+
+import subprocess
+import sys
+
+ROUNDS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+# 入口 -> (模块, 导入耗时预算 (基准耗时的倍数), 导入时不应加载的包).
+ENTRIES = {
+    "billqueryserver": (
+        "ecnuqueryelectricbill.main_server", 4, ("PySide6", "qasync", "selenium", "matplotlib", "numpy"),
+    ),
+    "billqueryclient": (
+        # main 一开始就要创建 QApplication, 所以 Qt 算在启动耗时内.
+        "ecnuqueryelectricbill.main_client", 8, ("selenium", "matplotlib", "numpy"),
+    ),
+    "billvisualize": (
+        "ecnuqueryelectricbill.visualize_bill", 4, ("PySide6", "qasync", "selenium", "matplotlib", "numpy"),
+    ),
+}
+TOP = 5  # 报告的最耗时的包的个数.
+
+
+def startup_time() -> float:
+    """在新的解释器中什么也不导入, 返回启动时自身导入的模块 (site, encodings 等) 的累计毫秒."""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "pass"], capture_output=True, text=True)
+    total = 0.0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if (len(name) - len(name.lstrip())) // 2 == 0:
+            total += int(cumulative) / 1000
+    return total
+
+
+def import_time(module: str) -> tuple[float, dict[str, float], set[str]]:
+    """
+    在新的解释器中导入 module 一次.
+    返回 (module 的累计导入毫秒, 各个包在其中的导入毫秒, 所有被导入的模块), 导入失败时抛出 ImportError.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise ImportError(result.stderr.strip().splitlines()[-1])
+    total, children, pending, imported = 0.0, {}, {}, set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        imported.add(name)
+        # 子模块先于父模块输出, 先记下, 遇到顶层模块时再决定是否属于入口模块. 按包的顶层名字汇总自身耗时.
+        top = name.split(".")[0]
+        pending[top] = pending.get(top, 0) + int(self_) / 1000
+        if depth == 0:
+            if name == module:
+                total, children = int(cumulative) / 1000, pending
+            pending = {}
+    return total, children, imported
+
+
+def main():
+    failed = False
+    baseline = min(startup_time() for _ in range(ROUNDS))
+    print(f"{'baseline':>16}: {baseline:6.1f} ms")
+    for entry, (module, factor, forbidden) in ENTRIES.items():
+        budget = factor * baseline
+        try:
+            runs = [import_time(module) for _ in range(ROUNDS)]
+        except ImportError as e:
+            print(f"{entry:>16}: skipped, {e}")
+            continue
+        total, children, imported = min(runs, key=lambda run: run[0])
+        heavy = ", ".join(f"{name} {ms:.0f}" for name, ms in sorted(children.items(), key=lambda x: -x[1])[:TOP])
+        status = "ok" if total <= budget else "OVER BUDGET"
+        print(f"{entry:>16}: {total:6.1f} ms (budget {budget:.0f} ms = {factor}x baseline) {status}  [{heavy}]")
+        loaded = sorted(name for name in forbidden if name in imported)
+        if loaded:
+            print(f"{'':>16}  loaded at import: {', '.join(loaded)}")
+        failed |= total > budget or bool(loaded)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""
+服务端负载测试: 在子进程中运行 server_main, 上游指向本地模拟的 epay (见 fake_epay.py),
+同时建立大量 GuardClient 连接, 分别压测 GET_DEGREE, FETCH_DEGREE_FILE 和 POST_TOKEN,
+报告吞吐量, p50/p99 延迟和服务端内存.
+
+`--save` 把结果保存为基准, 之后的运行与基准比较, 吞吐量下降或 p99 延迟, 内存上升超过 --tolerance 时以状态码 1 退出.
+基准和机器有关, 请在同一台机器上先对修改前的代码运行一次 `--save`.
+
+在项目根目录运行 (需要 key.toml, 服务端使用 SERVER_PORT): `python benchmarks/bench_load.py [--clients 2000]`.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import toml
+from websockets.asyncio.client import connect
+
+from ecnuqueryelectricbill import SERVER_PORT, Command
+from ecnuqueryelectricbill.client import GuardClient
+from ecnuqueryelectricbill.store import DegreeStore
+from fake_epay import FakeEpay
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_baseline.json")
+HISTORY = 100_000  # 每个宿舍预先写入的电量记录数.
+CONNECT_CONCURRENCY = 100  # 同时进行的握手数, 避免超过 listen 的 backlog.
+SERVER_CODE = (
+    "import asyncio, os, sys\n"
+    "import ecnuqueryelectricbill.server as server\n"
+    "os.chdir(sys.argv[1])\n"  # 服务端的文件放在临时目录中.
+    "asyncio.run(server.server_main(query_url=sys.argv[2]))\n"
+)
+
+
+def write_rooms(directory: str, rooms: int):
+    """rooms 个宿舍的 room.toml 和电量记录, 第一个为默认宿舍."""
+    config = {"roomNo": "0", "elcarea": 1, "elcbuis": "b"}
+    config["rooms"] = {f"room{i}": {"roomNo": str(i), "elcarea": 1, "elcbuis": "b"} for i in range(1, rooms)}
+    with open(os.path.join(directory, "room.toml"), "w") as f:
+        toml.dump(config, f)
+    os.makedirs(os.path.join(directory, "degree"), exist_ok=True)
+    for i in range(rooms):
+        name = "degree.bin" if i == 0 else os.path.join("degree", f"room{i}.bin")
+        store = DegreeStore(os.path.join(directory, name))
+        for j in range(HISTORY):
+            store.append(1.7e9 + j * 60, 1000 - j * 0.01)
+        store.close()
+
+
+def room_name(i: int) -> str:
+    return "default" if i == 0 else f"room{i}"
+
+
+def memory_mb(pid: int | str = "self") -> dict[str, float]:
+    """进程当前 (VmRSS) 和峰值 (VmHWM) 常驻内存, 只在 Linux 上可用."""
+    result = {}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "VmHWM"):
+                    result[key] = int(value.split()[0]) / 1024
+    except OSError:
+        pass
+    return result
+
+
+async def wait_port(port: int, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def connect_clients(count: int, rooms: int) -> list[GuardClient]:
+    semaphore = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def one(i: int) -> GuardClient:
+        async with semaphore:
+            connection = await connect(f"ws://127.0.0.1:{SERVER_PORT}/", max_size=None)
+            client = GuardClient(connection, room_name(i % rooms))
+            await client.hello()
+            return client
+
+    return await asyncio.gather(*(one(i) for i in range(count)))
+
+
+async def fetch_degree_file(client: GuardClient):
+    """只接收不写文件, 避免测到客户端的磁盘."""
+    await client._request(Command.FETCH_DEGREE_FILE)
+
+
+async def phase(clients: list[GuardClient], requests: int, op) -> dict[str, float]:
+    """所有客户端同时各自连续发送 requests 个请求."""
+    latencies: list[float] = []
+
+    async def one(client: GuardClient):
+        for _ in range(requests):
+            start = time.perf_counter()
+            await op(client)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(client) for client in clients))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "throughput": len(latencies) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000,
+    }
+
+
+async def run(args) -> dict:
+    fake = FakeEpay(latency=args.latency, lifetime=args.lifetime)
+    url = await fake.start()
+    with tempfile.TemporaryDirectory() as directory:
+        write_rooms(directory, args.rooms)
+        server = subprocess.Popen(
+            [sys.executable, "-c", SERVER_CODE, directory, url],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            await wait_port(SERVER_PORT)
+            idle = memory_mb(server.pid)
+            clients = await connect_clients(args.clients, args.rooms)
+            results = {"server_idle_rss_mb": idle.get("VmRSS", 0),
+                       "server_connected_rss_mb": memory_mb(server.pid).get("VmRSS", 0)}
+            ops = {
+                Command.GET_DEGREE: lambda client: client.fetch_degree(),
+                Command.FETCH_DEGREE_FILE: fetch_degree_file,
+                Command.POST_TOKEN: lambda client: client.post_token(*fake.login()),
+            }
+            for command, op in ops.items():
+                results[command] = await phase(clients, args.requests, op)
+            results["server_peak_rss_mb"] = memory_mb(server.pid).get("VmHWM", 0)
+            await asyncio.gather(*(client.client.close() for client in clients))
+        finally:
+            server.terminate()
+            server.wait()
+    await fake.stop()
+    results["upstream_requests"] = fake.requests
+    results["upstream_expired"] = fake.expired
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """返回超出容忍范围的退化项."""
+    regressions = []
+    for command in (Command.GET_DEGREE, Command.FETCH_DEGREE_FILE, Command.POST_TOKEN):
+        new, old = results[command], baseline.get(command)
+        if old is None:
+            continue
+        if new["throughput"] < old["throughput"] * (1 - tolerance):
+            regressions.append(f"{command} throughput {old['throughput']:.0f} -> {new['throughput']:.0f} req/s")
+        if new["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{command} p99 {old['p99_ms']:.2f} -> {new['p99_ms']:.2f} ms")
+    old_rss = baseline.get("server_peak_rss_mb")
+    if old_rss and results["server_peak_rss_mb"] > old_rss * (1 + tolerance):
+        regressions.append(f"server peak rss {old_rss:.1f} -> {results['server_peak_rss_mb']:.1f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务端负载测试.")
+    parser.add_argument("--clients", type=int, default=2000, help="同时连接的客户端数")
+    parser.add_argument("--requests", type=int, default=5, help="每个客户端每种命令的请求数")
+    parser.add_argument("--rooms", type=int, default=20, help="宿舍数, 客户端平均分配到各宿舍")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟 epay 的响应延迟 (秒)")
+    parser.add_argument("--lifetime", type=float, default=float("inf"), help="模拟 epay 会话的寿命 (秒)")
+    parser.add_argument("--baseline", default=BASELINE, help="基准结果文件")
+    parser.add_argument("--save", action="store_true", help="把本次结果保存为基准")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="允许的退化比例")
+    args = parser.parse_args()
+    # 每个连接在客户端和服务端各占一个文件描述符.
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (min(max(soft, args.clients * 2 + 256), hard), hard))
+
+    results = asyncio.run(run(args))
+    results["config"] = {k: getattr(args, k) for k in ("clients", "requests", "rooms", "latency", "lifetime")}
+    print(f"{args.clients} clients, {args.rooms} rooms, {args.requests} requests per command per client")
+    for command in (Command.GET_DEGREE, Command.FETCH_DEGREE_FILE, Command.POST_TOKEN):
+        r = results[command]
+        print(f"{command:>18}: {r['throughput']:8.0f} req/s, p50 {r['p50_ms']:8.2f} ms, p99 {r['p99_ms']:8.2f} ms")
+    print(f"server rss: idle {results['server_idle_rss_mb']:.1f} MB, "
+          f"connected {results['server_connected_rss_mb']:.1f} MB, peak {results['server_peak_rss_mb']:.1f} MB")
+    print(f"client rss: {memory_mb().get('VmRSS', 0):.1f} MB")
+    print(f"upstream: {results['upstream_requests']} requests, {results['upstream_expired']} expired sessions")
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config") != results["config"]:
+            print(f"baseline was recorded with {baseline.get('config')}, not comparable.")
+            sys.exit(2)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("regressions:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print("no regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
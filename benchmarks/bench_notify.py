@@ -0,0 +1,48 @@
+"""
+通知的扇出: ROOMS 个宿舍同时跌破警告电量时, observe 的耗时, 以及分批投递到多个 sink
+(其中一个前几次投递失败) 需要的投递次数和全部送达的时间.
+
+在项目根目录运行: `python benchmarks/bench_notify.py [宿舍数]`.
+"""
+
+import asyncio
+import logging
+import sys
+import time
+
+from ecnuqueryelectricbill.server.notify import FakeSink, Notifier
+
+ROOMS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+SINK_LATENCY = 0.05  # 模拟 webhook / SMTP 每次投递的耗时 (秒).
+
+
+async def main():
+    logging.disable(logging.ERROR)  # 重试的警告太多.
+    everyone = FakeSink(latency=SINK_LATENCY)
+    flaky = FakeSink(latency=SINK_LATENCY, fail=2)
+    per_room = [FakeSink(rooms=[f"room{i}"], latency=SINK_LATENCY) for i in range(ROOMS)]
+    notifier = Notifier([everyone, flaky, *per_room], batch_delay=0.2, backoff=0.1)
+    task = asyncio.create_task(notifier.run())
+
+    start = time.perf_counter()
+    for i in range(ROOMS):
+        notifier.observe(f"room{i}", 10.5, 9.5)
+        notifier.observe(f"room{i}", 9.5, 9.4)  # 重复, 被去重.
+    observe = time.perf_counter() - start
+    await notifier.flush()
+    elapsed = time.perf_counter() - start
+    task.cancel()
+
+    sinks = [everyone, flaky, *per_room]
+    delivered = sum(len(sink.sent) for sink in sinks)
+    attempts = sum(sink.attempts for sink in sinks)
+    print(f"{ROOMS} rooms, {len(sinks)} sinks")
+    print(f"observe: {observe / (ROOMS * 2) * 1e6:.1f} us per call")
+    print(f"delivered {delivered} notifications in {attempts} sends "
+          f"(one per notification per sink would be {delivered}), all done in {elapsed:.2f} s")
+    print(f"shared sink batches: {[len(batch) for batch in everyone.batches]}, "
+          f"flaky sink attempts: {flaky.attempts}, delivered: {len(flaky.sent)}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+写入电量记录时 websocket 请求的延迟: 不写入, 在事件循环中直接写入 (旧做法), 以及通过 writer 任务写入.
+
+写入负载: 每 APPEND_INTERVAL 秒追加一条记录并 fsync, 每 REWRITE_INTERVAL 秒整个重写一次 REWRITE_MB 的历史文件
+(类似旧版本去重时重写 degree.csv). 同时 CLIENTS 个客户端不停地发送 GET_DEGREE, 统计往返延迟.
+在项目根目录运行 (需要 key.toml): `python benchmarks/bench_server_latency.py [秒数]`.
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from websockets.asyncio.client import connect
+from websockets.asyncio.server import serve
+
+from ecnuqueryelectricbill import Command, DEFAULT_ROOM, codec
+from ecnuqueryelectricbill.encryption import decrypt, encrypt
+from ecnuqueryelectricbill.store import DegreeStore
+import ecnuqueryelectricbill.server as server
+from ecnuqueryelectricbill.server.room import Room
+from ecnuqueryelectricbill.server.writer import FSYNC_ALWAYS, Writer
+
+DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 5
+CLIENTS = 20
+APPEND_INTERVAL = 0.01
+REWRITE_INTERVAL = 0.5
+REWRITE_MB = 32
+
+
+async def client_loop(port: int, latencies: list[float], stop: asyncio.Event):
+    request = encrypt(codec.dumps({"type": Command.GET_DEGREE}))
+    async with connect(f"ws://127.0.0.1:{port}/") as client:
+        while not stop.is_set():
+            start = time.perf_counter()
+            await client.send(request)
+            codec.loads(decrypt(await client.recv()))
+            latencies.append(time.perf_counter() - start)
+
+
+def rewrite_inline(path: str, content: bytes):
+    with open(path, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+async def write_load(mode: str, store: DegreeStore, history: str, stop: asyncio.Event):
+    content = os.urandom(REWRITE_MB << 20)
+    degree = 1e5
+    last_rewrite = time.monotonic()
+    while not stop.is_set():
+        await asyncio.sleep(APPEND_INTERVAL)
+        degree -= 0.01
+        if mode == "inline":
+            store.append(time.time(), degree)
+            store.sync()
+        else:
+            server.writer.append(store, time.time(), degree)
+        if time.monotonic() - last_rewrite >= REWRITE_INTERVAL:
+            last_rewrite = time.monotonic()
+            if mode == "inline":
+                rewrite_inline(history, content)
+            else:
+                server.writer.replace(history, content)
+
+
+async def run(mode: str, directory: str) -> list[float]:
+    room = Room(DEFAULT_ROOM)
+    room.degree = 42.5
+    server.rooms[room.name] = room
+    store = DegreeStore(os.path.join(directory, f"{mode}.bin"))
+    server.writer = Writer(fsync=FSYNC_ALWAYS)
+    writer_task = asyncio.create_task(server.writer.run())
+    latencies: list[float] = []
+    stop = asyncio.Event()
+    async with serve(server.dorm_querying, "127.0.0.1", 0) as ws_server:
+        port = ws_server.sockets[0].getsockname()[1]
+        tasks = [asyncio.create_task(client_loop(port, latencies, stop)) for _ in range(CLIENTS)]
+        if mode != "idle":
+            tasks.append(asyncio.create_task(
+                write_load(mode, store, os.path.join(directory, f"{mode}.csv"), stop)
+            ))
+        await asyncio.sleep(DURATION)
+        stop.set()
+        await asyncio.gather(*tasks)
+    await server.writer.flush()
+    writer_task.cancel()
+    await asyncio.gather(writer_task, return_exceptions=True)
+    store.close()
+    return latencies
+
+
+def report(name: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:>8}: {len(latencies) / DURATION:8.0f} req/s, p50 {statistics.median(latencies) * 1000:7.2f} ms, "
+        f"p99 {p99 * 1000:7.2f} ms, max {latencies[-1] * 1000:7.2f} ms"
+    )
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in ("idle", "inline", "writer"):
+            report(mode, await run(mode, directory))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""
+对着本地模拟的 epay 服务, 比较有无会话保活时需要重新登录 (打开浏览器) 的次数和上游请求数.
+
+模拟的 epay 会话空闲 IDLE 秒或者登录 LIFETIME 秒后过期, 过期后查询返回 302 (跳转到登录页).
+宿舍白天用电, 夜里电量不变, 此时自适应轮询会退避到很长的间隔, 没有保活时会话就会空闲过期.
+time.time 换成按 SCALE 加快的模拟时钟, 默认 90 秒模拟从晚上 8 点开始的 12.5 小时,
+服务端的自适应轮询和会话管理都按模拟时间工作.
+在项目根目录运行 (需要 key.toml): `python benchmarks/bench_session_keepalive.py [秒数]`.
+"""
+
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+from ecnuqueryelectricbill import DEFAULT_ROOM
+import ecnuqueryelectricbill.server as server
+from ecnuqueryelectricbill.server.room import Room
+from ecnuqueryelectricbill.server.session import SessionManager
+from ecnuqueryelectricbill.server.upstream import UpstreamClient
+from ecnuqueryelectricbill.server.writer import FSYNC_NEVER, Writer
+from fake_epay import FakeEpay
+
+DURATION = float(sys.argv[1]) if len(sys.argv) > 1 else 90
+SCALE = 0.002  # 模拟时间 1 秒对应的实际秒数.
+IDLE = 5 * 60  # 模拟的 epay 会话空闲过期时间 (模拟秒).
+LIFETIME = 4 * 3600  # 模拟的 epay 会话最长寿命 (模拟秒).
+DAY_SPEED = 8 / (16 * 3600)  # 白天 (8 点到 24 点) 每模拟秒用电量 (度).
+START = 20 * 3600  # 模拟开始的时刻.
+
+
+real_time = time.time
+
+
+class Clock:
+    """模拟时钟, 第一天的 0 点为 0."""
+
+    def __init__(self):
+        self.start = time.monotonic()
+
+    def __call__(self) -> float:
+        return START + (time.monotonic() - self.start) / SCALE
+
+
+def degree(now: float) -> float:
+    """模拟时刻 now 的剩余电量, 白天按 DAY_SPEED 用电."""
+    days, seconds = divmod(now, 24 * 3600)
+    used = days * 16 * 3600 + max(seconds - 8 * 3600, 0)
+    return round(100 - used * DAY_SPEED, 2)
+
+
+class NoKeepalive(SessionManager):
+    """原来的做法: 只按电量变化决定查询间隔, 会话过期后才发现."""
+
+    def keepalive_delay(self, session, now=None) -> float:
+        return float("inf")
+
+
+async def run(manager: SessionManager) -> tuple[int, int, float]:
+    """返回 (登录次数, 上游请求数, 模拟时长)."""
+    clock = Clock()
+    fake = FakeEpay(idle=IDLE, lifetime=LIFETIME, now=clock, degree=lambda: degree(clock()))
+    url = await fake.start()
+    server.sessions = manager
+    server.writer = Writer(fsync=FSYNC_NEVER)
+    writer_task = asyncio.create_task(server.writer.run())
+    room = Room(DEFAULT_ROOM, "1", 1, "b")
+    logins = 0
+    time.time = clock
+    try:
+        async with UpstreamClient(query_url=url) as upstream:
+            server.upstream = upstream
+            end = time.monotonic() + DURATION
+            while time.monotonic() < end:
+                if room.session is None or room.session.expired:
+                    logins += 1
+                    room.session = manager.post(*fake.login())
+                delay = await server.degree_querying(room)
+                await asyncio.sleep((server.QUERY_INTERVAL if delay is None else delay) * SCALE)
+        simulated = clock() - START
+    finally:
+        time.time = real_time
+    writer_task.cancel()
+    await asyncio.gather(writer_task, return_exceptions=True)
+    room.store.close()
+    await fake.stop()
+    return logins, fake.requests, simulated
+
+
+async def main():
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)  # 电量记录写在临时目录中.
+        try:
+            for name, manager in (("no keepalive", NoKeepalive()), ("keepalive", SessionManager())):
+                logins, requests, simulated = await run(manager)
+                learned = manager.lifetime.idle_limit()
+                print(f"{name:>12}: {logins:3d} logins, {requests:5d} upstream requests "
+                      f"in {simulated / 3600:.1f} simulated hours, learned idle limit {learned / 60:.1f} min")
+        finally:
+            os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
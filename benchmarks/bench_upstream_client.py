@@ -0,0 +1,98 @@
+"""
+对比每次新建 httpx.AsyncClient 和复用 UpstreamClient 连接池时单次查询的延迟.
+
+在本地起一个自签名证书的 HTTPS 服务代替 epay.ecnu.edu.cn, 需要系统中有 openssl 命令.
+在项目根目录运行 (需要 key.toml): `python benchmarks/bench_upstream_client.py`.
+"""
+
+import asyncio
+import json
+import os
+import ssl
+import statistics
+import subprocess
+import tempfile
+import time
+
+import httpx
+
+from ecnuqueryelectricbill.server.upstream import UpstreamClient
+
+QUERIES = 200
+BODY = json.dumps({"retcode": 0, "retmsg": "成功", "restElecDegree": 42.5}).encode("utf-8")
+
+
+def make_ssl_context(directory: str) -> ssl.SSLContext:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+         "-subj", "/CN=localhost", "-keyout", key, "-out", cert],
+        check=True, capture_output=True,
+    )
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert, key)
+    return context
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """极简 HTTP/1.1 keep-alive 服务, 对任何请求都返回查询成功."""
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(BODY)}\r\n\r\n".encode("ascii")
+                + BODY
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+def report(name: str, latencies: list[float]):
+    latencies = sorted(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(
+        f"{name:>8}: mean {statistics.mean(latencies) * 1000:7.2f} ms, "
+        f"p50 {statistics.median(latencies) * 1000:7.2f} ms, p99 {p99 * 1000:7.2f} ms"
+    )
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=make_ssl_context(directory))
+    port = server.sockets[0].getsockname()[1]
+    url = f"https://127.0.0.1:{port}/epaycas/electric/queryelectricbill"
+    data = {"sysid": 1, "roomNo": "21102_MH_95_326", "elcarea": 102, "elcbuis": "new-95_MH"}
+    headers = {"X-CSRF-TOKEN": "token"}
+    cookies = {"JSESSIONID": "session", "cookie": "cookie"}
+
+    fresh = []
+    for _ in range(QUERIES):
+        start = time.perf_counter()
+        async with httpx.AsyncClient(verify=False) as client:
+            await client.post(url, data=data, headers=headers, cookies=cookies)
+        fresh.append(time.perf_counter() - start)
+
+    pooled = []
+    async with UpstreamClient(verify=False) as client:
+        for _ in range(QUERIES):
+            start = time.perf_counter()
+            await client.post(url, data=data, headers=headers, cookies=cookies)
+            pooled.append(time.perf_counter() - start)
+
+    server.close()
+    await server.wait_closed()
+    report("fresh", fresh)
+    report("pooled", pooled)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+本地模拟的 epay queryelectricbill 接口, 供 benchmarks 中的脚本使用.
+
+会话在空闲 idle 秒或登录 lifetime 秒后过期, 过期后查询返回 302 (跳转到登录页), 和真实的 epay 一样.
+每个请求可以加上 latency 秒的延迟, 模拟上游的响应时间.
+"""
+
+import asyncio
+import json
+import secrets
+import time
+from typing import Callable
+
+QUERY_PATH = "/epaycas/electric/queryelectricbill"
+
+
+class FakeEpay:
+    def __init__(
+        self,
+        idle: float = float("inf"),
+        lifetime: float = float("inf"),
+        latency: float = 0,
+        now: Callable[[], float] = time.monotonic,
+        degree: Callable[[], float] = lambda: 42.5,
+    ):
+        self.idle = idle
+        self.lifetime = lifetime
+        self.latency = latency
+        self.now = now
+        self.degree = degree
+        self.sessions: dict[str, tuple[str, float, float]] = {}  # JSESSIONID -> (token, 登录时间, 最后使用时间).
+        self.requests = 0
+        self.expired = 0
+        self._server: asyncio.Server | None = None
+        self._writers: set[asyncio.StreamWriter] = set()  # 未关闭的连接, stop 时一并关闭.
+
+    def login(self) -> tuple[str, dict[str, str]]:
+        """模拟一次登录, 返回 (x_csrf_token, cookies)."""
+        session_id, token = secrets.token_hex(8), secrets.token_hex(8)
+        self.sessions[session_id] = (token, self.now(), self.now())
+        return token, {"JSESSIONID": session_id, "cookie": "cas"}
+
+    def query(self, session_id: str, token: str) -> bool:
+        self.requests += 1
+        now = self.now()
+        if session_id not in self.sessions:
+            return False
+        token_, login, last = self.sessions[session_id]
+        if token != token_ or now - last > self.idle or now - login > self.lifetime:
+            del self.sessions[session_id]
+            self.expired += 1
+            return False
+        self.sessions[session_id] = (token_, login, now)
+        return True
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.add(writer)
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = {}
+                for line in head.decode("latin-1").split("\r\n")[1:]:
+                    if ":" in line:
+                        key, value = line.split(":", 1)
+                        headers[key.strip().lower()] = value.strip()
+                await reader.readexactly(int(headers.get("content-length", 0)))
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                cookies = dict(c.strip().split("=", 1) for c in headers.get("cookie", "").split(";") if "=" in c)
+                if self.query(cookies.get("JSESSIONID", ""), headers.get("x-csrf-token", "")):
+                    body = json.dumps(
+                        {"retcode": 0, "retmsg": "成功", "restElecDegree": self.degree()}
+                    ).encode("utf-8")
+                    writer.write(
+                        b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                        + f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+                    )
+                else:
+                    writer.write(b"HTTP/1.1 302 Found\r\nLocation: /cas/login\r\nContent-Length: 0\r\n\r\n")
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # 客户端断开, 或者 stop 时连接被关闭, 都是正常结束.
+            pass
+        finally:
+            self._writers.discard(writer)
+            writer.close()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """开始监听, 返回查询接口的 URL."""
+        self._server = await asyncio.start_server(self.handle, host, port)
+        port = self._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}{QUERY_PATH}"
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            # wait_closed 会等待所有连接关闭, 先关闭客户端还保持着的长连接.
+            for writer in list(self._writers):
+                writer.close()
+            await self._server.wait_closed()
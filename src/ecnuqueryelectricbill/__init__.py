@@ -1,25 +1,42 @@
+import functools
 import logging
-
-import toml
 import os
 from pathlib import Path
 
 SERVER_PORT = 30530
+HEARTBEAT_INTERVAL = 30  # 服务端向订阅者推送心跳的间隔 (秒).
 KEY_FILE = "key.toml"
+DEFAULT_ROOM = "default"  # 消息中未指明宿舍时使用的宿舍名, 对应 room.toml 顶层的宿舍信息.
 
-# 移动到项目目录.
+# 项目目录, key.toml 和其他配置文件, 电量记录都在这里.
 proj_path = Path(__file__).parent
 while proj_path.name != "src":
     proj_path = proj_path.parent
 proj_path = proj_path.parent
-os.chdir(proj_path)
 
-KEY = toml.load(KEY_FILE)["key"].encode("utf-8")
-IV = toml.load(KEY_FILE)["iv"].encode("utf-8")
-if len(KEY) != 32:
-    raise ValueError("Key must be 32 bytes long")
-if len(IV) != 16:
-    raise ValueError("IV must be 16 bytes long")
+
+def chdir_project():
+    """移动到项目目录, 各入口的 main 开始时调用, 之后的相对路径都相对于项目目录."""
+    os.chdir(proj_path)
+
+
+@functools.cache
+def load_key() -> bytes:
+    """读取项目目录下 KEY_FILE 中的密钥, 第一次加密或解密时才读取, 只读取一次."""
+    import toml
+
+    key = toml.load(proj_path / KEY_FILE)["key"].encode("utf-8")
+    if len(key) != 32:
+        raise ValueError("Key must be 32 bytes long")
+    return key
+
+
+def __getattr__(name: str):
+    # 兼容 `from ecnuqueryelectricbill import KEY`, 用到时才读取 key.toml.
+    if name == "KEY":
+        return load_key()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
@@ -28,14 +45,43 @@ logging.basicConfig(
 
 class Command:
     """
-    一个 Command json 格式就像: `{"type": command_type, "args": ...}`.
-    返回值就像: `{"retcode": RETCODE, content: ...}`.
+    一个 Command 编码前的格式就像: `{"type": command_type, "room": room_name, "id": request_id, "args": ...}`.
+    `room` 可省略, 省略时为 DEFAULT_ROOM.
+    返回值就像: `{"retcode": RETCODE, "id": request_id, content: ...}`.
+    `id` 为客户端给出的整数, 服务端在该请求的所有返回消息中原样带回, 客户端据此匹配返回值.
+    带 `id` 的请求在服务端并发处理 (HELLO 除外), 返回顺序可能和发送顺序不同;
+    不带 `id` 的请求按顺序逐个处理, 和旧版本相同.
+    SUBSCRIBE 之后服务端还会主动推送 `{"retcode": 0, "push": push_type, "content": ...}`, 见 Push.
     """
 
     POST_TOKEN = "post_token"
     POST_ROOM = "post_room"
     GET_DEGREE = "get_degree"
     FETCH_DEGREE_FILE = "fetch_degree_file"
+    # args: {"from": 起始时间戳, "to": 结束时间戳, "max_points": 最多点数, "method": 降采样方法}, 均可省略.
+    # 返回 {"timestamp": [...], "degree": [...]}.
+    FETCH_DEGREE_RANGE = "fetch_degree_range"
+    # args: {"offset": 已有记录数, "since": 已有的最后时间戳, "crc": 已有记录的 CRC32, "chunk": 每块记录数},
+    # 均可省略, 给出 since 时只发送时间戳大于 since 的记录.
+    # 不给出 since 时服务端先校验 crc, 和自己前 offset 条记录不同时返回 ErrChecksum, 客户端应当从头重新下载.
+    # 需要先通过 HELLO 协商为二进制编码, 分块的格式见 server.stream_degree_file.
+    STREAM_DEGREE_FILE = "stream_degree_file"
+    SUBSCRIBE = "subscribe"
+    # 返回 {"degree": 当前电量, "speed": 消耗速度 (度/天), "hours": 预计多少小时后耗尽,
+    # "low": 置信区间下界, "high": 置信区间上界, "points": 拟合用的记录数}, 无法预测的项为 null.
+    FORECAST = "forecast"
+    # 立即向上游查询一次电量 (不使用缓存), 返回值同 GET_DEGREE.
+    # 服务端限制刷新频率, 太频繁时返回 ErrRateLimited, content 为还需要等待的秒数.
+    REFRESH = "refresh"
+    # args: {"codecs": [支持的编码, ...]}, 返回服务端选定的编码, 之后双方都使用该编码发送, 见 codec 模块.
+    HELLO = "hello"
+
+
+class Push:
+    """服务端推送的消息类型."""
+
+    DEGREE = "degree"  # 订阅时以及宿舍电量变化时推送, content 为电量, 含义同 GET_DEGREE.
+    HEARTBEAT = "heartbeat"  # 每 HEARTBEAT_INTERVAL 秒推送一次, content 为服务端时间戳.
 
 
 class RetCode:
@@ -43,3 +89,5 @@ class RetCode:
     ErrUnknown = 1
     ErrArgs = 2
     ErrNoFile = 3
+    ErrRateLimited = 4
+    ErrChecksum = 5  # STREAM_DEGREE_FILE 给出的 crc 和服务端前 offset 条记录的 CRC32 不同.
@@ -0,0 +1,114 @@
+"""
+基于 NumPy 的电量序列分析, 适合很长的记录.
+
+`smooth` 和 `consuming_speed` 与 consumption 模块中的同名函数计算方式相同,
+结果在浮点误差范围内一致 (见 benchmarks/bench_analytics.py).
+"""
+
+import math
+from datetime import datetime
+
+import numpy as np
+
+DAY = 3600 * 24
+WEEK = DAY * 7
+_EPOCH_WEEKDAY = 3  # 1970-01-01 是星期四, 周聚合从星期一开始.
+_MIN_SCALE = 1e-200  # 分块递推时块内累乘系数的下限, 保证 1 / 累乘系数 不会溢出.
+
+
+def _local_offset() -> float:
+    return datetime.now().astimezone().utcoffset().total_seconds()
+
+
+def _ema(a: np.ndarray, x: np.ndarray, r0: float) -> np.ndarray:
+    """
+    计算 r[i] = r[i - 1] * a[i] + x[i] * (1 - a[i]), r[-1] = r0.
+
+    序列分块后, 块内用累乘和累加向量化求解 (块首初值为 0), 块间的初值只需要一次长度为块数的递推.
+    块长根据最小的 a 选取, 保证块内累乘系数不小于 _MIN_SCALE.
+    """
+    n = len(a)
+    if not n:
+        return np.empty(0)
+    a_min = float(a.min())
+    if a_min <= 0:
+        # 累乘会变成 0, 无法分块, 只能逐个计算.
+        r = np.empty(n)
+        for i in range(n):
+            r0 = r0 * a[i] + x[i] * (1 - a[i])
+            r[i] = r0
+        return r
+    block = n if a_min >= 1 else max(1, min(n, int(math.log(_MIN_SCALE) / math.log(a_min))))
+    blocks = -(-n // block)
+    pad = blocks * block - n
+    b = np.concatenate((x * (1 - a), np.zeros(pad))).reshape(blocks, block)
+    a = np.concatenate((a, np.ones(pad))).reshape(blocks, block)
+    scale = np.cumprod(a, axis=1)
+    local = scale * np.cumsum(b / scale, axis=1)  # 块首初值为 0 时块内的结果.
+    carry = np.empty(blocks)  # 每块的初值.
+    for i in range(blocks):
+        carry[i] = r0
+        r0 = scale[i, -1] * r0 + local[i, -1]
+    return (local + scale * carry[:, None]).ravel()[:n]
+
+
+def smooth(timestamp, data, alpha=0.9, k=0.6) -> np.ndarray:
+    """时间间隔感知的指数平滑, 参数含义同 consumption.smooth."""
+    t = np.asarray(timestamp, dtype=float)
+    x = np.asarray(data, dtype=float)
+    assert len(t) == len(x)
+    if not len(x):
+        return np.empty(0)
+    delta_time = np.diff(t, prepend=t[0])
+    max_delta_time = delta_time.max() or 1  # 只有一个点时 delta_time 全为 0, 结果与间隔无关.
+    a = alpha * np.exp(-k * (delta_time / max_delta_time))
+    r0 = x[0] * a[0] + x[0] * (1 - a[0])  # 与逐个计算时第一步的舍入保持一致.
+    r = np.empty(len(x))
+    r[0] = r0
+    r[1:] = _ema(a[1:], x[1:], r0)
+    return r
+
+
+def consuming_speed(timestamp, degree) -> tuple[np.ndarray, np.ndarray]:
+    """消耗速度, 返回 (时间戳, 平滑后的速度), 速度单位: 度/天."""
+    t = np.asarray(timestamp, dtype=float)
+    d = np.asarray(degree, dtype=float)
+    delta_time = np.diff(t)
+    speed_t = delta_time / 2 + t[:-1]
+    speed = np.maximum(d[:-1] - d[1:], 0) / delta_time * 3600 * 24
+    return speed_t, smooth(speed_t, speed)
+
+
+def recharges(timestamp, degree) -> tuple[np.ndarray, np.ndarray]:
+    """检测充值, 返回 (充值后第一条记录的时间戳, 增加的电量)."""
+    t = np.asarray(timestamp, dtype=float)
+    delta = np.diff(np.asarray(degree, dtype=float))
+    index = np.flatnonzero(delta > 0)
+    return t[index + 1], delta[index]
+
+
+def aggregate(timestamp, degree, period: float = DAY, offset: float = 0) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    按时间段统计用电量和充值量, 返回 (时间段起始时间戳, 用电量, 充值量), 只包含有记录的时间段.
+
+    相邻两条记录之间的变化计入后一条记录所在的时间段, offset 为时间段边界相对 UTC 零点的偏移 (秒).
+    """
+    t = np.asarray(timestamp, dtype=float)
+    delta = np.diff(np.asarray(degree, dtype=float))
+    if not len(delta):
+        return np.empty(0), np.empty(0), np.empty(0)
+    bucket = np.floor((t[1:] + offset) / period).astype(np.int64)
+    keys, inverse = np.unique(bucket, return_inverse=True)
+    consumed = np.bincount(inverse, weights=np.maximum(-delta, 0), minlength=len(keys))
+    recharged = np.bincount(inverse, weights=np.maximum(delta, 0), minlength=len(keys))
+    return keys * period - offset, consumed, recharged
+
+
+def daily(timestamp, degree):
+    """按本地时间的自然日统计, 见 aggregate."""
+    return aggregate(timestamp, degree, DAY, _local_offset())
+
+
+def weekly(timestamp, degree):
+    """按本地时间的自然周 (星期一开始) 统计, 见 aggregate."""
+    return aggregate(timestamp, degree, WEEK, _local_offset() + _EPOCH_WEEKDAY * DAY)
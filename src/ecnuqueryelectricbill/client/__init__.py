@@ -1,30 +1,38 @@
+"""
+客户端. Qt 和 Selenium 只在需要弹窗或打开浏览器时才导入,
+只用 GuardClient 收发消息的脚本 (如 billvisualize) 不需要加载它们.
+"""
+
 import asyncio
-from PySide6.QtCore import Qt
-from PySide6.QtWidgets import QDialog, QLabel, QPushButton, QVBoxLayout
 import json
 import logging
 import traceback
-from typing import Optional
+import zlib
+from typing import TYPE_CHECKING, Optional
 
 import toml
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.wait import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 from websockets.asyncio.client import connect, ClientConnection
 
-from ecnuqueryelectricbill import Command, SERVER_PORT
+from ecnuqueryelectricbill import Command, Push, RetCode, SERVER_PORT, DEFAULT_ROOM, HEARTBEAT_INTERVAL, codec
 from ecnuqueryelectricbill.encryption import decrypt, encrypt
-from selenium.webdriver import Edge
+from ecnuqueryelectricbill.store import RECORD, DegreeStore
+
+if TYPE_CHECKING:
+    from ecnuqueryelectricbill.client.browser import BrowserPool
 
 CLIENT_CONFIG = "client.toml"
+WAITING_SIZE = 4  # 每个请求最多缓存的返回消息数, 分块传输时消费慢于接收会暂停读取连接, 保持背压.
 alert_degree = 10  # 警告电量 (度), 当宿舍电量低于当前电量时客户端显示警告.
+alert_hours = 24  # 服务端预测电量将在这么多小时内耗尽时, 客户端提前显示警告.
+browsers: Optional["BrowserPool"] = None  # 第一次需要浏览器时由 get_browsers 创建.
 
 
 def load_config():
-    global alert_degree
+    global alert_degree, alert_hours
     with open(CLIENT_CONFIG, "r") as f:
         ret = toml.load(f)
         alert_degree = ret.get("alert_degree", alert_degree)
+        alert_hours = ret.get("alert_hours", alert_hours)
         return ret
 
 
@@ -48,8 +56,22 @@ async def _post_token_example():
     await client.close()
 
 
-def alert(title: str, text: str, button: str = "好的", topmost=True) -> bool:
-    """显示对话弹窗, 如果用户表示同意操作, 返回 True, 如果用户关闭弹窗返回 False."""
+def get_browsers() -> "BrowserPool":
+    global browsers
+    if browsers is None:
+        from ecnuqueryelectricbill.client.browser import BrowserPool
+
+        browsers = BrowserPool()
+    return browsers
+
+
+_dialogs: dict[str, object] = {}  # 标题 -> 打开着的非模态对话框, 保持引用以免被回收.
+
+
+def _make_dialog(title: str, text: str, button: str, topmost: bool):
+    from PySide6.QtCore import Qt
+    from PySide6.QtWidgets import QDialog, QLabel, QPushButton, QVBoxLayout
+
     dialog = QDialog()
     dialog.setWindowTitle(title)
     dialog.setWindowFlags(
@@ -64,76 +86,233 @@ def alert(title: str, text: str, button: str = "好的", topmost=True) -> bool:
     layout.addWidget(btn)
 
     dialog.setLayout(layout)
-    return dialog.exec() == QDialog.Accepted
+    return dialog
+
+
+def show_alert(title: str, text: str, button: str = "好的", topmost=True) -> asyncio.Future:
+    """
+    显示非模态对话弹窗, 立即返回一个 future, 用户点击按钮时结果为 True, 关闭弹窗时为 False.
+    不需要结果时可以不 await. 同一标题的弹窗只保留最新的一个, 旧的会被关闭.
+    取消 future 时关闭弹窗. 需要在 qasync 的事件循环中调用.
+    """
+    from PySide6.QtWidgets import QDialog
+
+    future = asyncio.get_running_loop().create_future()
+    old = _dialogs.pop(title, None)
+    if old is not None:
+        old.close()
+    dialog = _make_dialog(title, text, button, topmost)
+
+    def finished(result: int):
+        if _dialogs.get(title) is dialog:
+            del _dialogs[title]
+        if not future.done():
+            future.set_result(result == QDialog.Accepted)
+
+    dialog.finished.connect(finished)
+    future.add_done_callback(lambda f: dialog.close() if f.cancelled() else None)
+    _dialogs[title] = dialog
+    dialog.show()
+    return future
 
 
 class GuardClient:
     """
     保证 server 始终取得正确的 token 和 cookies.
     需要手动关闭 client.
+
+    每个请求带有递增的 id, 后台的 _dispatch Task 按 id 把返回消息交给对应的请求,
+    所以多个命令可以在同一个连接上同时进行 (比如 fetch_degree_routine 运行时下载历史记录).
+    每个请求的返回消息最多缓存 WAITING_SIZE 条, 缓存满时 _dispatch 暂停读取连接,
+    所以分块下载的内存占用不随历史长度增长, 代价是慢的下载会推迟同一连接上其他请求的返回.
     """
 
-    def __init__(self, client: ClientConnection):
+    def __init__(self, client: ClientConnection, room: str = DEFAULT_ROOM):
         self.client = client
+        self.room = room
+        self.codec = codec.JSON  # 发送时使用的编码, 由 hello 协商.
+        self._next_id = 0
+        self._waiting: dict[int, asyncio.Queue] = {}  # 请求 id -> 该请求的返回消息, 按发送顺序排列.
+        self._pushes: asyncio.Queue = asyncio.Queue()  # 服务端推送的消息.
+        self._dispatcher: Optional[asyncio.Task] = None
+        self._error: Optional[Exception] = None  # 连接关闭时 _dispatch 收到的异常.
 
-    async def _send_command(self, type_: str, args: Optional[object] = None):
-        dic = {"type": type_}
+    async def _send_command(self, type_: str, args: Optional[object] = None) -> int:
+        """发送命令, 返回请求 id, 用 _recv_ret 接收该请求的返回消息."""
+        if self._error is not None:
+            raise self._error
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+        rid = self._next_id
+        self._next_id += 1
+        dic = {"type": type_, "room": self.room, "id": rid}
         if args is not None:
             dic["args"] = args
-        await self.client.send(encrypt(json.dumps(dic)))
+        self._waiting[rid] = asyncio.Queue(maxsize=WAITING_SIZE)
+        try:
+            await self.client.send(encrypt(codec.dumps(dic, self.codec)))
+        except BaseException:
+            self._forget(rid)
+            raise
+        return rid
 
-    async def _recv_ret(self):
-        return json.loads(decrypt(await self.client.recv()))
+    def _forget(self, rid: Optional[int]):
+        """不再接收请求 rid 的返回消息, 清空其队列, 以免 _dispatch 一直等在已经没人读取的队列上."""
+        queue = self._waiting.pop(rid, None)
+        while queue is not None and not queue.empty():
+            queue.get_nowait()
 
-    async def post_token(self, x_csrf_token: str, cookies: dict[str, str]):
-        await self._send_command(
-            Command.POST_TOKEN, {"x_csrf_token": x_csrf_token, "cookies": cookies}
-        )
-        ret = await self._recv_ret()
+    async def _recv(self) -> dict:
+        return codec.loads(decrypt(await self.client.recv()))
+
+    async def _dispatch(self):
+        """
+        接收所有消息并分发, 直到连接关闭.
+        旧版本的服务端不带回 id 且按顺序处理, 此时返回消息属于最早发出的请求,
+        所以对旧版本的服务端不要同时进行多个请求.
+        连接关闭后, 等待中的请求和推送都会收到 recv 抛出的异常.
+        """
+        try:
+            while True:
+                ret = await self._recv()
+                if "push" in ret:
+                    self._pushes.put_nowait(ret)
+                    continue
+                rid = ret.get("id", next(iter(self._waiting), None))
+                if rid in self._waiting:
+                    await self._waiting[rid].put(ret)
+                else:
+                    logging.warning(f"unexpected ret: {ret}.")
+        except Exception as e:
+            self._error = e
+            for queue in (*self._waiting.values(), self._pushes):
+                if queue.full():
+                    queue.get_nowait()  # 请求反正要失败, 丢掉一条返回消息, 保证异常能送到.
+                queue.put_nowait(e)
+
+    async def _recv_ret(self, rid: int, done: bool = True) -> dict:
+        """
+        接收请求 rid 的下一条返回消息.
+        done 为 True 表示这是该请求的最后一条, 之后不再等待它的消息, 分块传输时中间的消息传入 False.
+        """
+        try:
+            ret = await self._waiting[rid].get()
+        finally:
+            if done:
+                self._forget(rid)
+        if isinstance(ret, Exception):
+            raise ret
+        return ret
+
+    async def _request(self, type_: str, args: Optional[object] = None) -> dict:
+        """发送命令并等待返回值, retcode 不为 0 时抛出 ValueError."""
+        ret = await self._recv_ret(await self._send_command(type_, args))
         if ret["retcode"] != 0:
             raise ValueError(f"retcode is not zero: {ret}.")
+        return ret
+
+    async def hello(self):
+        """和服务端协商消息编码, 优先使用二进制编码."""
+        self.codec = (await self._request(Command.HELLO, {"codecs": list(codec.CODECS)}))["content"]
+
+    def _discard_heartbeats(self):
+        """丢弃已经排队的心跳, 在登录等耗时的交互之后调用, 免得积压的心跳让同一个提示连续出现."""
+        kept = []
+        while not self._pushes.empty():
+            push = self._pushes.get_nowait()
+            if isinstance(push, Exception) or push["push"] != Push.HEARTBEAT:
+                kept.append(push)
+        for push in kept:
+            self._pushes.put_nowait(push)
+
+    async def _recv_push(self) -> dict:
+        push = await self._pushes.get()
+        if isinstance(push, Exception):
+            self._pushes.put_nowait(push)
+            raise push
+        return push
+
+    async def post_token(self, x_csrf_token: str, cookies: dict[str, str]):
+        await self._request(Command.POST_TOKEN, {"x_csrf_token": x_csrf_token, "cookies": cookies})
 
     async def fetch_degree(self):
-        await self._send_command(Command.GET_DEGREE)
-        ret = await self._recv_ret()
-        if ret["retcode"] != 0:
-            raise ValueError(f"retcode is not zero: {ret}.")
-        return ret["content"]
+        return (await self._request(Command.GET_DEGREE))["content"]
+
+    async def refresh_degree(self):
+        """让服务端立即查询一次电量, 刷新太频繁时服务端拒绝, 抛出 ValueError."""
+        return (await self._request(Command.REFRESH))["content"]
+
+    async def subscribe(self):
+        """订阅宿舍电量, 之后服务端会推送 Push 消息."""
+        await self._request(Command.SUBSCRIBE)
+
+    async def fetch_forecast(self) -> dict:
+        """获取服务端对电量耗尽时间的预测, 格式见 Command.FORECAST."""
+        return (await self._request(Command.FORECAST))["content"]
 
     async def fetch_degree_routine(self):
-        """对此 Task 调用 cancel 方法来停止运行."""
+        """
+        订阅服务端推送, 只在电量变化时处理.
+        心跳超时时抛出 TimeoutError, 由外部重新连接.
+        对此 Task 调用 cancel 方法来停止运行.
+        """
+        await self.hello()
+        await self.subscribe()
         prev_degree = -1
-        while not asyncio.current_task().cancelled():
-            degree: float = await self.fetch_degree()
+        degree = None
+        forecast_alerted = False  # 每次充值之后只提前警告一次.
+        while True:
+            push = await asyncio.wait_for(self._recv_push(), HEARTBEAT_INTERVAL * 3)
+            if push["push"] == Push.DEGREE:
+                degree = push["content"]
+            elif degree not in (-1, -2):
+                # 心跳, 只有登录信息或宿舍信息仍然缺失时才需要再次处理.
+                continue
             if degree == -1:
                 logging.info("login invalid.")
                 # 从这里开始登录失效了, 重新登录, 需要启动浏览器.
-                token = self.ask_for_login()
+                token = await self.ask_for_login()
                 if token is not None:
                     await self.post_token(**token)
-                    alert("成功上传", "成功上传登录 token.")
+                    show_alert("成功上传", "成功上传登录 token.")
                     logging.info("token posted.")
+                self._discard_heartbeats()
             elif degree == -2:
                 logging.info("room info missing.")
-                room = self.ask_for_room()
+                room = await self.ask_for_room()
                 if room is not None:
                     await self.post_room(**room)
-                    alert("成功上传", "成功上传宿舍信息.")
+                    show_alert("成功上传", "成功上传宿舍信息.")
                     logging.info("room posted.")
+                self._discard_heartbeats()
             else:
                 logging.info(f"{degree=}.")
+                # 提示只显示, 不等待用户关闭, 继续处理之后的推送.
                 if degree < alert_degree:
-                    alert(
+                    show_alert(
                         title="电费不足",
                         text="请及时进行电量的充值, 以防止意外断电的情况.",
                     )
                 elif degree > prev_degree > 0:  # prev_degree < 0 为特殊情况.
-                    alert(
+                    forecast_alerted = False
+                    show_alert(
                         title="电量充值",
                         text=f"检测到电量增加: 增加度数为 {degree - prev_degree:.2f}.",
                     )
+                elif not forecast_alerted:
+                    try:
+                        hours = (await self.fetch_forecast())["hours"]
+                    except ValueError as e:
+                        # 预测失败 (如服务端还没有这个宿舍) 只当作没有预测, 不影响接收推送.
+                        logging.warning(f"forecast failed: {e}")
+                        hours = None
+                    if hours is not None and hours < alert_hours:
+                        forecast_alerted = True
+                        show_alert(
+                            title="电量即将耗尽",
+                            text=f"按最近的用电速度, 电量预计在 {hours:.1f} 小时后耗尽,\n请及时充值.",
+                        )
                 prev_degree = degree
-            await asyncio.sleep(10)
 
     def __await__(self):
         task = asyncio.create_task(self.fetch_degree_routine())
@@ -141,98 +320,118 @@ class GuardClient:
         return task.result()
 
     @classmethod
-    def ask_for_login(cls):
-        if not alert(
+    async def ask_for_login(cls) -> Optional[dict]:
+        """
+        先尝试用保存的 CAS 登录状态无界面获取 token, 不行再让用户登录.
+        浏览器在工作线程中操作, 等待用户登录期间事件循环照常运行, 连接保持活跃.
+        """
+        pool = get_browsers()
+        rst = await asyncio.to_thread(pool.fetch_login_headless)
+        if rst is not None:
+            logging.info("got login info headlessly.")
+            return rst
+        if not await show_alert(
             title="请登录",
             text="登录信息已失效,\n请在打开的界面重新登录,\n然后等待浏览器自动关闭.",
         ):
             return None
-        driver = Edge()
-        try:
-            driver.get(
-                "https://epay.ecnu.edu.cn/epaycas/electric/load4electricbill?elcsysid=1"
-            )  # 这个网址会重定向至登录界面.
-            WebDriverWait(driver, timeout=60 * 60).until(
-                EC.url_matches(r"https://epay.ecnu.edu.cn")  # 等待登录之后的重定向.
-            )
-            j_session_id = driver.get_cookie("JSESSIONID")["value"]
-            cookie = driver.get_cookie("cookie")["value"]
-            # 在 main frame 中以获取 x_csrf_token.
-            meta = driver.find_element(By.XPATH, "/html/head/meta[4]")
-            x_csrf_token = meta.get_property("content")
-            rst = {
-                "x_csrf_token": x_csrf_token,
-                "cookies": {"JSESSIONID": j_session_id, "cookie": cookie},
-            }
-            logging.debug("Got login info: {}".format(rst))
-            return rst
-        finally:
-            driver.quit()
+        return await asyncio.to_thread(pool.fetch_login_interactive)
 
     @classmethod
-    def ask_for_room(cls):
-        if not alert(
+    async def ask_for_room(cls) -> Optional[dict]:
+        if not await show_alert(
             title="宿舍信息未配置",
             text="请点击确认按钮, 先登录 ECNU 帐号,\n"
             "然后对自己宿舍的电量进行一次查询,\n"
             "浏览器会读取宿舍信息并自动关闭.",
         ):
             return None
-        driver = Edge()
-        try:
-            driver.get(
-                "https://epay.ecnu.edu.cn/epaycas/electric/load4electricbill?elcsysid=1"
-            )  # 这个网址会重定向至登录界面.
-            # 先等待用户登录.
-            WebDriverWait(driver, timeout=60 * 60).until(
-                EC.url_matches(r"https://epay.ecnu.edu.cn")
-            )
-            # 等待按钮出现, 放置回调函数.
-            WebDriverWait(driver, timeout=60 * 60).until(
-                EC.presence_of_element_located((By.ID, "queryBill"))
-            )
-            driver.execute_script("""
-            let button = document.querySelector("#queryBill");
-            button.onclick = function() {
-                let a = document.createElement("a");
-                a.id = "query_clicked"; // 查询按钮按下时添加新元素, 终结下面的 WebDriverWait.
-                document.body.appendChild(a);
-            }
-            """)
-            WebDriverWait(driver, timeout=60 * 60).until(
-                EC.presence_of_element_located((By.ID, "query_clicked"))
-            )
-            elcbuis = driver.find_element(By.ID, "elcbuis").get_property("value")
-            elcarea = driver.find_element(By.ID, "elcarea").get_property("value")
-            elcroom = driver.find_element(By.ID, "elcroom").get_property("value")
-            return {
-                "elcbuis": elcbuis,
-                "elcarea": int(elcarea),
-                "roomNo": elcroom,
-            }
-        finally:
-            driver.quit()
+        return await asyncio.to_thread(get_browsers().fetch_room_interactive)
 
     async def post_room(self, roomNo: str, elcarea: int, elcbuis: str):
-        await self._send_command(
+        await self._request(
             Command.POST_ROOM,
             {"roomNo": roomNo, "elcarea": elcarea, "elcbuis": elcbuis},
         )
-        ret = await self._recv_ret()
-        if ret["retcode"] != 0:
-            raise ValueError(f"retcode is not zero: {ret}.")
+
+    async def fetch_degree_range(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        max_points: int = 1000,
+        method: str = "lttb",
+    ) -> tuple[list[float], list[float]]:
+        """获取时间范围 [start, end) 内降采样后的电量记录, 返回 (时间戳列表, 电量列表)."""
+        ret = await self._request(
+            Command.FETCH_DEGREE_RANGE,
+            {"from": start, "to": end, "max_points": max_points, "method": method},
+        )
+        return ret["content"]["timestamp"], ret["content"]["degree"]
+
+    async def stream_degree_file(self, save_file: str, chunk: int = 4096, by_time: bool = False) -> int:
+        """
+        分块下载全部电量记录到 save_file (DegreeStore 的二进制格式), 每收到一块立即写入.
+
+        save_file 已经存在时从已有的记录数继续下载, 服务端发现已有的记录和它的不一致时丢掉本地记录从头下载.
+        下载没有以一致的校验和结束时 (断开, 出错或被取消), 丢掉本次写入的记录, 本地文件保持原样.
+        by_time 为 True 时改为只下载比本地最后一条记录更新的记录, 适合本地只保留部分历史的情况.
+        需要先调用 hello 协商为二进制编码. 返回本次新下载的记录数.
+        """
+        store = DegreeStore(save_file)
+        count = len(store)
+        rid = None
+        try:
+            while True:
+                args = {"offset": count, "crc": store.checksum(), "chunk": chunk}
+                if by_time and count:
+                    args["since"] = store[-1][0]
+                crc = args["crc"]
+                rid = await self._send_command(Command.STREAM_DEGREE_FILE, args)
+                ret = await self._recv_ret(rid, done=False)
+                if ret["retcode"] != RetCode.ErrChecksum or not count:
+                    break
+                logging.warning(f"{save_file} does not match the server, downloading from scratch.")
+                self._forget(rid)
+                store.truncate(0)
+                count = 0
+            if ret["retcode"] != 0:
+                raise ValueError(f"retcode is not zero: {ret}.")
+            offset = ret["content"]["offset"]  # 服务端记录中的下标.
+            seq = 0
+            while True:
+                ret = await self._recv_ret(rid, done=False)
+                if ret.get("stream") != seq or ret.get("offset") != offset:
+                    raise ValueError(f"unexpected stream message: {ret.get('stream')=}, {ret.get('offset')=}.")
+                if ret.get("end"):
+                    if ret["checksum"] != crc:
+                        raise ValueError(f"checksum mismatch: {ret['checksum']} != {crc}.")
+                    return len(store) - count
+                crc = zlib.crc32(ret["content"], crc)
+                store.extend_raw(ret["content"])
+                offset += len(ret["content"]) // RECORD.size
+                seq += 1
+        except BaseException:
+            store.truncate(count)
+            raise
+        finally:
+            self._forget(rid)
+            store.close()
 
     async def fetch_degree_file(self, save_file: str):
-        await self._send_command(Command.FETCH_DEGREE_FILE)
-        ret = await self._recv_ret()
-        if ret["retcode"] != 0:
-            raise ValueError(f"retcode is not zero: {ret}.")
+        ret = await self._request(Command.FETCH_DEGREE_FILE)
+        content = ret["content"]
         with open(save_file, "w") as f:
-            f.write(ret["content"])
+            if isinstance(content, str):
+                f.write(content)
+            else:  # 二进制编码时为电量序列.
+                f.write("\n".join(
+                    f"{t:.2f}, {d:.7g}" for t, d in zip(content["timestamp"], content["degree"])
+                ))
 
 
-def notify_server_shutdown():
-    alert(
+async def notify_server_shutdown():
+    """等待用户关闭提示后再重连, 等待期间其他弹窗照常响应."""
+    await show_alert(
         title="billquery-client",
         text="无法连接到 billquery 服务器,\n请检查服务器状态.",
     )
@@ -241,15 +440,20 @@ def notify_server_shutdown():
 async def client_main():
     config = load_config()
     server_address = config["server_address"]
-    while True:
-        try:
+    room = config.get("room", DEFAULT_ROOM)
+    try:
+        while True:
             try:
-                conn = await connect(f"ws://{server_address}:{SERVER_PORT}/")
+                try:
+                    conn = await connect(f"ws://{server_address}:{SERVER_PORT}/")
+                except Exception:
+                    await notify_server_shutdown()
+                    continue
+                async with conn as client:
+                    await GuardClient(client, room)
             except Exception:
-                notify_server_shutdown()
-                continue
-            async with conn as client:
-                await GuardClient(client)
-        except Exception:
-            traceback.print_exc()
-        await asyncio.sleep(3)
+                traceback.print_exc()
+            await asyncio.sleep(3)
+    finally:
+        if browsers is not None:
+            browsers.close()
@@ -0,0 +1,166 @@
+import logging
+import os
+import threading
+from typing import Optional
+
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver import Edge, EdgeOptions
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.wait import WebDriverWait
+
+EPAY_URL = "https://epay.ecnu.edu.cn/epaycas/electric/load4electricbill?elcsysid=1"  # 未登录时会重定向至登录界面.
+EPAY_PATTERN = r"^https://epay\.ecnu\.edu\.cn"  # 登录界面的地址中也可能带有 epay 的地址, 所以要求在开头.
+PROFILE_DIR = "browser-profile"  # 浏览器的用户数据目录, 保存 CAS 的登录状态, 下次可以免登录.
+HEADLESS_TIMEOUT = 20  # 无界面获取 token 时等待跳转回 epay 的秒数, 超时说明需要重新登录.
+KEEP_DRIVER = 5 * 60  # 用完的无界面浏览器保留这么多秒, 期间再次需要时直接复用.
+INTERACTIVE_TIMEOUT = 60 * 60  # 等待用户在浏览器中操作的秒数.
+
+
+def read_login(driver: Edge) -> dict:
+    """从已经登录的 epay 页面读取 token 和 cookies, 格式同 GuardClient.post_token 的参数."""
+    j_session_id = driver.get_cookie("JSESSIONID")["value"]
+    cookie = driver.get_cookie("cookie")["value"]
+    # 在 main frame 中以获取 x_csrf_token.
+    meta = driver.find_element(By.XPATH, "/html/head/meta[4]")
+    x_csrf_token = meta.get_property("content")
+    rst = {
+        "x_csrf_token": x_csrf_token,
+        "cookies": {"JSESSIONID": j_session_id, "cookie": cookie},
+    }
+    logging.debug("Got login info: {}".format(rst))
+    return rst
+
+
+class BrowserPool:
+    """
+    共用一个持久化用户数据目录的浏览器.
+
+    各方法都会阻塞到浏览器操作结束 (有界面时最长 INTERACTIVE_TIMEOUT 秒), 客户端在工作线程中调用.
+
+    CAS 登录状态保存在用户数据目录中, 只要还没过期, 就可以用无界面浏览器打开 epay 直接拿到新的 token,
+    不需要弹窗让用户登录. 同一个用户数据目录同一时间只能被一个浏览器使用,
+    所以最多只有一个浏览器在运行, 需要的模式 (有无界面) 不同时先关掉原来的.
+    无界面浏览器用完后保留 keep 秒供复用, 有界面的用完立即关闭, 免得窗口一直留在桌面上.
+    """
+
+    def __init__(self, profile_dir: str = PROFILE_DIR, keep: float = KEEP_DRIVER):
+        self.profile_dir = os.path.abspath(profile_dir)
+        self.keep = keep
+        self._driver: Optional[Edge] = None
+        self._headless = False
+        self._timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+
+    def acquire(self, headless: bool) -> Edge:
+        """取得一个浏览器, 用完后需要调用 release."""
+        with self._lock:
+            self._cancel_timer()
+            if self._driver is not None and self._headless == headless:
+                try:
+                    self._driver.current_url  # 检查浏览器是否还活着.
+                    return self._driver
+                except WebDriverException:
+                    pass
+            self._quit()
+            options = EdgeOptions()
+            options.add_argument(f"--user-data-dir={self.profile_dir}")
+            if headless:
+                options.add_argument("--headless=new")
+            self._driver = Edge(options=options)
+            self._headless = headless
+            return self._driver
+
+    def release(self, driver: Edge):
+        with self._lock:
+            if driver is not self._driver:
+                return
+            if self._headless and self.keep > 0:
+                self._timer = threading.Timer(self.keep, self.close)
+                self._timer.daemon = True
+                self._timer.start()
+            else:
+                self._quit()
+
+    def close(self):
+        with self._lock:
+            self._cancel_timer()
+            self._quit()
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _quit(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except WebDriverException:
+                pass
+            self._driver = None
+
+    def fetch_login_headless(self) -> Optional[dict]:
+        """CAS 登录状态仍然有效时, 不显示窗口获取新的 token 和 cookies, 否则返回 None."""
+        try:
+            driver = self.acquire(headless=True)
+        except WebDriverException:
+            logging.exception("failed to start headless browser.")
+            return None
+        try:
+            driver.get(EPAY_URL)
+            WebDriverWait(driver, timeout=HEADLESS_TIMEOUT).until(EC.url_matches(EPAY_PATTERN))
+            return read_login(driver)
+        except (TimeoutException, WebDriverException, TypeError):
+            # 停在了登录界面, 或者页面不完整 (get_cookie 返回 None).
+            logging.info("headless login failed, interactive login needed.")
+            return None
+        finally:
+            self.release(driver)
+
+    def fetch_login_interactive(self) -> dict:
+        """打开浏览器让用户登录, 登录后跳转回 epay 时读取 token 和 cookies."""
+        driver = self.acquire(headless=False)
+        try:
+            driver.get(EPAY_URL)  # 这个网址会重定向至登录界面.
+            WebDriverWait(driver, timeout=INTERACTIVE_TIMEOUT).until(
+                EC.url_matches(EPAY_PATTERN)  # 等待登录之后的重定向.
+            )
+            return read_login(driver)
+        finally:
+            self.release(driver)
+
+    def fetch_room_interactive(self) -> dict:
+        """打开浏览器, 在用户查询一次自己宿舍的电量后读取宿舍信息, 格式同 GuardClient.post_room 的参数."""
+        driver = self.acquire(headless=False)
+        try:
+            driver.get(EPAY_URL)  # 这个网址会重定向至登录界面, 用户数据目录中登录状态有效时不需要登录.
+            # 先等待用户登录.
+            WebDriverWait(driver, timeout=INTERACTIVE_TIMEOUT).until(
+                EC.url_matches(EPAY_PATTERN)
+            )
+            # 等待按钮出现, 放置回调函数.
+            WebDriverWait(driver, timeout=INTERACTIVE_TIMEOUT).until(
+                EC.presence_of_element_located((By.ID, "queryBill"))
+            )
+            driver.execute_script("""
+            let button = document.querySelector("#queryBill");
+            button.onclick = function() {
+                let a = document.createElement("a");
+                a.id = "query_clicked"; // 查询按钮按下时添加新元素, 终结下面的 WebDriverWait.
+                document.body.appendChild(a);
+            }
+            """)
+            WebDriverWait(driver, timeout=INTERACTIVE_TIMEOUT).until(
+                EC.presence_of_element_located((By.ID, "query_clicked"))
+            )
+            elcbuis = driver.find_element(By.ID, "elcbuis").get_property("value")
+            elcarea = driver.find_element(By.ID, "elcarea").get_property("value")
+            elcroom = driver.find_element(By.ID, "elcroom").get_property("value")
+            return {
+                "elcbuis": elcbuis,
+                "elcarea": int(elcarea),
+                "roomNo": elcroom,
+            }
+        finally:
+            self.release(driver)
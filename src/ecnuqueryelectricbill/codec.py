@@ -0,0 +1,207 @@
+"""
+客户端和服务端之间消息 (加密前) 的编码.
+
+- JSON: 最初的格式, 任何时候都可以解码, 作为后备.
+- BINARY: 一个字节的 MAGIC 加一个字节的版本号, 之后是带类型标记的值.
+  array.array("d") / array.array("f") 整段打包为 float64 / float32 数组, 适合传输电量记录.
+  bytes 原样传输, 只有 BINARY 编码支持.
+- BINARY_ZLIB: 先按 BINARY 打包, 不小于 COMPRESS_MIN 字节时以一个字节的 ZMAGIC 开头, 之后是 zlib 压缩的内容.
+  打包时 float 数组改为存储相邻元素位模式之差, 并按字节位置重排 (第 0 字节们, 第 1 字节们, ...),
+  单调变化的时间戳和电量的差值高位字节几乎都相同, 压缩效果比直接压缩好得多. 这一变换是无损的.
+
+消息先编码 (压缩) 再加密, 加密后的数据无法压缩, 所以 websocket 的 permessage-deflate 不起作用.
+解码时根据首字节自动判断格式, 连接双方通过 Command.HELLO 协商发送时使用的格式.
+"""
+
+import array
+import json
+import struct
+import sys
+import zlib
+
+JSON = "json"
+BINARY = "bin1"
+BINARY_ZLIB = "bin1z"
+CODECS = (BINARY_ZLIB, BINARY, JSON)  # 按优先顺序排列.
+BINARY_CODECS = (BINARY_ZLIB, BINARY)  # 可以传输 bytes 和数组的编码.
+
+MAGIC = 0xB1
+ZMAGIC = 0xB2
+VERSION = 1
+COMPRESS_MIN = 256  # 打包后小于这么多字节的消息不压缩, 以 BINARY 的格式发送.
+COMPRESS_LEVEL = 1  # 级别再高压缩率只提高几个百分点, 耗时却成倍增加, 见 benchmarks/bench_compression.py.
+
+_NONE, _FALSE, _TRUE, _INT, _FLOAT, _STR, _LIST, _DICT, _F64_ARRAY, _F32_ARRAY, _BYTES = range(11)
+_DELTA_F64_ARRAY, _DELTA_F32_ARRAY = 11, 12
+_ARRAY_TAGS = {"d": _F64_ARRAY, "f": _F32_ARRAY}
+_TAG_TYPECODES = {tag: typecode for typecode, tag in _ARRAY_TAGS.items()}
+_DELTA_TAGS = {"d": _DELTA_F64_ARRAY, "f": _DELTA_F32_ARRAY}
+_DELTA_TYPECODES = {tag: typecode for typecode, tag in _DELTA_TAGS.items()}
+_DELTA_DTYPES = {"d": "<u8", "f": "<u4"}  # 和数组元素位宽相同的无符号整数.
+_U32 = struct.Struct("<I")
+_I64 = struct.Struct("<q")
+_F64 = struct.Struct("<d")
+
+
+def _json_default(obj):
+    if isinstance(obj, array.array):
+        if obj.typecode == "f":
+            # 只保留 float32 的有效位数, 避免 42.349998474121094 这样的输出.
+            return [float(f"{x:.7g}") for x in obj]
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def warm_up():
+    """提前导入 BINARY_ZLIB 用到的 numpy, 服务端启动时在线程中调用, 免得第一条压缩消息在事件循环中等待导入."""
+    _delta_shuffle(array.array("d", [0.0]))
+
+
+def _delta_shuffle(obj: array.array) -> bytes:
+    """float 数组 -> 位模式的差分, 按字节位置重排. 整数溢出时回绕, _unshuffle_delta 中同样回绕, 所以无损."""
+    import numpy as np  # 只有 BINARY_ZLIB 用到, 不让每个导入 codec 的入口都加载 numpy.
+
+    dtype = np.dtype(_DELTA_DTYPES[obj.typecode])
+    bits = np.frombuffer(obj, dtype=dtype.newbyteorder("=")).astype(dtype)
+    delta = np.diff(bits, prepend=dtype.type(0))
+    return delta.view(np.uint8).reshape(-1, dtype.itemsize).T.tobytes()
+
+
+def _unshuffle_delta(data: memoryview, typecode: str, count: int) -> array.array:
+    import numpy as np
+
+    dtype = np.dtype(_DELTA_DTYPES[typecode])
+    delta = np.frombuffer(data, dtype=np.uint8).reshape(dtype.itemsize, count).T.copy().view(dtype)
+    result = array.array(typecode)
+    result.frombytes(np.cumsum(delta, dtype=dtype).astype(dtype.newbyteorder("=")).tobytes())
+    return result
+
+
+def _pack(obj, out: bytearray, delta: bool = False):
+    if obj is None:
+        out.append(_NONE)
+    elif obj is True or obj is False:
+        out.append(_TRUE if obj else _FALSE)
+    elif isinstance(obj, int):
+        out.append(_INT)
+        out += _I64.pack(obj)
+    elif isinstance(obj, float):
+        out.append(_FLOAT)
+        out += _F64.pack(obj)
+    elif isinstance(obj, str):
+        data = obj.encode("utf-8")
+        out.append(_STR)
+        out += _U32.pack(len(data))
+        out += data
+    elif isinstance(obj, (bytes, bytearray, memoryview)):
+        out.append(_BYTES)
+        out += _U32.pack(len(obj))
+        out += obj
+    elif delta and isinstance(obj, array.array) and obj.typecode in _DELTA_TAGS:
+        out.append(_DELTA_TAGS[obj.typecode])
+        out += _U32.pack(len(obj))
+        out += _delta_shuffle(obj)
+    elif isinstance(obj, array.array) and obj.typecode in _ARRAY_TAGS:
+        out.append(_ARRAY_TAGS[obj.typecode])
+        out += _U32.pack(len(obj))
+        if sys.byteorder == "big":
+            obj = array.array(obj.typecode, obj)
+            obj.byteswap()
+        out += obj.tobytes()
+    elif isinstance(obj, (list, tuple)):
+        out.append(_LIST)
+        out += _U32.pack(len(obj))
+        for item in obj:
+            _pack(item, out, delta)
+    elif isinstance(obj, dict):
+        out.append(_DICT)
+        out += _U32.pack(len(obj))
+        for key, value in obj.items():
+            _pack(str(key), out)
+            _pack(value, out, delta)
+    else:
+        raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def _unpack(view: memoryview, pos: int):
+    tag = view[pos]
+    pos += 1
+    if tag == _NONE:
+        return None, pos
+    if tag == _FALSE:
+        return False, pos
+    if tag == _TRUE:
+        return True, pos
+    if tag == _INT:
+        return _I64.unpack_from(view, pos)[0], pos + _I64.size
+    if tag == _FLOAT:
+        return _F64.unpack_from(view, pos)[0], pos + _F64.size
+    (count,) = _U32.unpack_from(view, pos)
+    pos += _U32.size
+    if tag == _STR:
+        return str(view[pos:pos + count], "utf-8"), pos + count
+    if tag == _BYTES:
+        return bytes(view[pos:pos + count]), pos + count
+    if tag in _TAG_TYPECODES:
+        result = array.array(_TAG_TYPECODES[tag])
+        end = pos + count * result.itemsize
+        result.frombytes(view[pos:end])
+        if sys.byteorder == "big":
+            result.byteswap()
+        return result, end
+    if tag in _DELTA_TYPECODES:
+        typecode = _DELTA_TYPECODES[tag]
+        end = pos + count * array.array(typecode).itemsize
+        return _unshuffle_delta(view[pos:end], typecode, count), end
+    if tag == _LIST:
+        result = []
+        for _ in range(count):
+            item, pos = _unpack(view, pos)
+            result.append(item)
+        return result, pos
+    if tag == _DICT:
+        result = {}
+        for _ in range(count):
+            key, pos = _unpack(view, pos)
+            result[key], pos = _unpack(view, pos)
+        return result, pos
+    raise ValueError(f"unknown tag: {tag}")
+
+
+def dumps(obj, codec: str = JSON) -> bytes | bytearray:
+    if codec == BINARY:
+        out = bytearray((MAGIC, VERSION))
+        _pack(obj, out)
+        return out
+    if codec == BINARY_ZLIB:
+        out = bytearray((MAGIC, VERSION))
+        _pack(obj, out, delta=True)
+        if len(out) < COMPRESS_MIN:
+            return out
+        return bytes((ZMAGIC,)) + zlib.compress(out, COMPRESS_LEVEL)
+    return json.dumps(obj, default=_json_default).encode("utf-8")
+
+
+def loads(data: bytes | bytearray | memoryview):
+    view = memoryview(data)
+    if len(view) and view[0] == ZMAGIC:
+        view = memoryview(zlib.decompress(view[1:]))
+        if not len(view) or view[0] != MAGIC:
+            raise ValueError("compressed message is not in binary codec")
+    if len(view) and view[0] == MAGIC:
+        if view[1] != VERSION:
+            raise ValueError(f"unsupported binary codec version: {view[1]}")
+        obj, pos = _unpack(view, 2)
+        if pos != len(view):
+            raise ValueError("trailing data after message")
+        return obj
+    return json.loads(data if isinstance(data, (bytes, bytearray)) else bytes(view))
+
+
+def choose(offered: object) -> str:
+    """从对方支持的格式中选出双方都支持且优先的一个, 都不支持时为 JSON."""
+    if isinstance(offered, list):
+        for codec in CODECS:
+            if codec in offered:
+                return codec
+    return JSON
@@ -4,23 +4,33 @@
 
 import asyncio
 from websockets.asyncio.client import connect
+from PySide6.QtWidgets import QApplication
+import qasync
 
-from ecnuqueryelectricbill import SERVER_PORT
-from ecnuqueryelectricbill.client import GuardClient, load_config, alert
+from ecnuqueryelectricbill import SERVER_PORT, DEFAULT_ROOM, chdir_project
+from ecnuqueryelectricbill.client import GuardClient, load_config, show_alert
 
 
-async def main():
-    # 已经在项目根目录见 __init__.py
-
+async def config_room():
     config = load_config()
     server_address = config["server_address"]
     async with connect(f"ws://{server_address}:{SERVER_PORT}/") as client:
-        gc = GuardClient(client)
-        room = GuardClient.ask_for_room()
+        gc = GuardClient(client, config.get("room", DEFAULT_ROOM))
+        room = await GuardClient.ask_for_room()
         if room is not None:
             await gc.post_room(**room)
-            alert("成功上传", "成功上传宿舍信息")
+            await show_alert("成功上传", "成功上传宿舍信息")
+
+
+def main():
+    chdir_project()
+    app = QApplication([])
+    app.setQuitOnLastWindowClosed(False)
+    loop = qasync.QEventLoop(app)
+    asyncio.set_event_loop(loop)
+    with loop:
+        loop.run_until_complete(config_room())
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
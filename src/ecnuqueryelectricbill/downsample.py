@@ -0,0 +1,85 @@
+"""
+电量序列的降采样, 用于在不传输全部记录的情况下绘制长时间范围的图像.
+"""
+
+LTTB = "lttb"
+MINMAX = "minmax"
+MEAN = "mean"
+METHODS = (LTTB, MINMAX, MEAN)
+
+
+def lttb(timestamp, data, n):
+    """
+    Largest-Triangle-Three-Buckets 降采样, 保留首尾两点, 中间每个桶选出与前后形成三角形面积最大的点.
+
+    结果是原始数据点的子集, 曲线形状 (包括充值时的跳变) 保留得比较好. n 至少为 3.
+    """
+    length = len(timestamp)
+    if n >= length or n < 3:
+        return list(timestamp), list(data)
+    every = (length - 2) / (n - 2)
+    a = 0
+    picked = [0]
+    for i in range(n - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, length)
+        avg_t = sum(timestamp[avg_start:avg_end]) / (avg_end - avg_start)
+        avg_d = sum(data[avg_start:avg_end]) / (avg_end - avg_start)
+        best, best_area = -1, -1.0
+        for j in range(int(i * every) + 1, int((i + 1) * every) + 1):
+            area = abs(
+                (timestamp[a] - avg_t) * (data[j] - data[a])
+                - (timestamp[a] - timestamp[j]) * (avg_d - data[a])
+            )
+            if area > best_area:
+                best, best_area = j, area
+        picked.append(best)
+        a = best
+    picked.append(length - 1)
+    return [timestamp[i] for i in picked], [data[i] for i in picked]
+
+
+def _buckets(timestamp, n):
+    """按时间等分为 n 个桶, 生成每个非空桶的 [start, end) 下标."""
+    t0 = timestamp[0]
+    width = (timestamp[-1] - t0) / n or 1
+
+    def bucket(i):
+        return min(int((timestamp[i] - t0) / width), n - 1)
+
+    start = 0
+    for i in range(1, len(timestamp)):
+        if bucket(i) != bucket(start):
+            yield start, i
+            start = i
+    yield start, len(timestamp)
+
+
+def minmax(timestamp, data, n):
+    """每个时间桶保留最小值和最大值两个点, 不会抹掉任何极值."""
+    if n >= len(timestamp) or n < 2:
+        return list(timestamp), list(data)
+    t, d = [], []
+    for start, end in _buckets(timestamp, n // 2):
+        lo = min(range(start, end), key=data.__getitem__)
+        hi = max(range(start, end), key=data.__getitem__)
+        for i in sorted({lo, hi}):
+            t.append(timestamp[i])
+            d.append(data[i])
+    return t, d
+
+
+def mean(timestamp, data, n):
+    """每个时间桶取时间和电量的平均值."""
+    if n >= len(timestamp) or n < 1:
+        return list(timestamp), list(data)
+    t, d = [], []
+    for start, end in _buckets(timestamp, n):
+        t.append(sum(timestamp[start:end]) / (end - start))
+        d.append(sum(data[start:end]) / (end - start))
+    return t, d
+
+
+def downsample(timestamp, data, n, method=LTTB):
+    """把序列降到不超过 n 个点, method 为 METHODS 之一."""
+    return {LTTB: lttb, MINMAX: minmax, MEAN: mean}[method](timestamp, data, n)
@@ -1,15 +1,39 @@
-from ecnuqueryelectricbill import KEY, IV
+"""
+AES-256-GCM 加密, 每条消息使用随机 nonce.
+
+密文格式: nonce (12 字节) + 密文 + tag (16 字节), 密文与明文等长, 不需要填充.
+"""
+
 from Crypto.Cipher import AES
-from Crypto.Util.Padding import pad, unpad
+from Crypto.Random import get_random_bytes
+
+from ecnuqueryelectricbill import load_key
+
+NONCE_SIZE = 12
+TAG_SIZE = 16
 
 
-def encrypt(message: str | bytes) -> bytes:
-    _cipher = AES.new(KEY, AES.MODE_CBC, iv=IV)  # 不能提出去, 似乎是一次性的对象.
+def encrypt(message: str | bytes | bytearray | memoryview) -> bytearray:
     if isinstance(message, str):
         message = message.encode('utf-8')
-    return _cipher.encrypt(pad(message, AES.block_size))
+    nonce = get_random_bytes(NONCE_SIZE)
+    cipher = AES.new(load_key(), AES.MODE_GCM, nonce=nonce)  # GCM 对象只能用于一条消息.
+    size = len(message)
+    out = bytearray(NONCE_SIZE + size + TAG_SIZE)
+    view = memoryview(out)
+    view[:NONCE_SIZE] = nonce
+    cipher.encrypt(message, output=view[NONCE_SIZE:NONCE_SIZE + size])  # 直接写入结果, 不产生中间副本.
+    view[NONCE_SIZE + size:] = cipher.digest()
+    return out
 
 
-def decrypt(data: bytes) -> bytes:
-    _cipher = AES.new(KEY, AES.MODE_CBC, iv=IV)
-    return unpad(_cipher.decrypt(data), AES.block_size)
+def decrypt(data: bytes | bytearray | memoryview) -> bytearray:
+    """解密并校验, 密文被篡改或密钥不一致时抛出 ValueError."""
+    view = memoryview(data)
+    if len(view) < NONCE_SIZE + TAG_SIZE:
+        raise ValueError("ciphertext too short")
+    cipher = AES.new(load_key(), AES.MODE_GCM, nonce=bytes(view[:NONCE_SIZE]))
+    out = bytearray(len(view) - NONCE_SIZE - TAG_SIZE)
+    cipher.decrypt(view[NONCE_SIZE:-TAG_SIZE], output=out)
+    cipher.verify(bytes(view[-TAG_SIZE:]))
+    return out
@@ -1,26 +1,27 @@
 import asyncio
 from PySide6.QtWidgets import QApplication
+from ecnuqueryelectricbill import chdir_project
 from ecnuqueryelectricbill.client import client_main
 import qasync
 
 
-def setup_asyncio():
-    """配置AsyncIO事件循环并在应用退出时正确关闭"""
-    loop = qasync.QEventLoop(QApplication.instance())
+def setup_asyncio(app: QApplication) -> qasync.QEventLoop:
+    """配置 qasync 事件循环, 弹窗和 asyncio 任务共用这一个循环, 在应用退出时正确关闭."""
+    loop = qasync.QEventLoop(app)
     asyncio.set_event_loop(loop)
-    QApplication.instance().aboutToQuit.connect(lambda: loop.stop())
+    app.aboutToQuit.connect(lambda: loop.stop())
+    return loop
 
 
 def main():
-    # 已经在项目根目录见 __init__.py
+    chdir_project()
     app = QApplication([])
-    setup_asyncio()
+    app.setQuitOnLastWindowClosed(False)  # 客户端常驻后台, 关闭弹窗不退出.
+    loop = setup_asyncio(app)
 
-    # 在Qt事件循环中运行异步任务
-    asyncio.run(client_main())
-
-    # 启动Qt事件循环
-    app.exec()
+    # 在 Qt 事件循环中运行异步任务, 非模态弹窗在等待期间也能响应.
+    with loop:
+        loop.run_until_complete(client_main())
 
 
 if __name__ == "__main__":
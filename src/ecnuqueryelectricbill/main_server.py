@@ -1,10 +1,20 @@
+import argparse
+
+from ecnuqueryelectricbill import chdir_project
 from ecnuqueryelectricbill.server import server_main
+from ecnuqueryelectricbill.server.metrics import METRICS_PORT
 import asyncio
 
 
 def main():
-    # 已经在项目根目录见 __init__.py
-    asyncio.run(server_main())
+    chdir_project()
+    parser = argparse.ArgumentParser(description="ECNU 宿舍电量查询服务端.")
+    parser.add_argument(
+        "--metrics", nargs="?", type=int, const=METRICS_PORT, default=None, metavar="PORT",
+        help=f"开启指标收集, 在 127.0.0.1:PORT/metrics 提供 (默认端口 {METRICS_PORT})",
+    )
+    args = parser.parse_args()
+    asyncio.run(server_main(args.metrics))
 
 
 if __name__ == "__main__":
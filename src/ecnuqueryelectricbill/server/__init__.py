@@ -1,186 +1,727 @@
+import array
 import asyncio
 import json
 import logging
-import os
 import time
-import traceback
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar
+import os
 from json import JSONDecodeError
 from typing import Optional
 
-import httpx
 import toml
 import websockets
-from websockets.asyncio.server import ServerConnection
+from websockets.asyncio.server import ServerConnection, broadcast
 
-from ecnuqueryelectricbill import SERVER_PORT, Command, RetCode
+from ecnuqueryelectricbill import SERVER_PORT, DEFAULT_ROOM, HEARTBEAT_INTERVAL, Command, Push, RetCode, codec
+from ecnuqueryelectricbill.downsample import LTTB, METHODS, downsample
 from ecnuqueryelectricbill.encryption import encrypt, decrypt
+from ecnuqueryelectricbill.store import RECORD, format_record
+from ecnuqueryelectricbill.server import metrics
+from ecnuqueryelectricbill.server.adaptive import AdaptiveInterval
+from ecnuqueryelectricbill.server.cache import QueryCache, RefreshLimiter
+from ecnuqueryelectricbill.server.forecast import DepletionForecast
+from ecnuqueryelectricbill.server.notify import NOTIFY_FILE, Notifier, load_notifier
+from ecnuqueryelectricbill.server.room import Room, valid_room_name
+from ecnuqueryelectricbill.server.scheduler import Scheduler
+from ecnuqueryelectricbill.server.session import Session, SessionManager
+from ecnuqueryelectricbill.server.state import STATE_FILE, RoomState, StateStore
+from ecnuqueryelectricbill.server.upstream import QUERY_URL, UpstreamClient, UpstreamError, auth_failed
+from ecnuqueryelectricbill.server.writer import FSYNC_INTERVAL, Writer
 
-ROOM_FILE = "room.toml"
-DEGREE_FILE = "degree.csv"
+ROOM_FILE = "room.toml"  # 手动编写的宿舍信息, 修改后下次启动时导入 STATE_FILE.
 FETCH_DEGREE_LINES = 1000
+MAX_RANGE_POINTS = 10000  # FETCH_DEGREE_RANGE 一次最多返回的点数.
+STREAM_CHUNK = 4096  # STREAM_DEGREE_FILE 默认每块的记录数.
+MAX_STREAM_CHUNK = 65536
+QUERY_INTERVAL = 10  # 查询失败 (token 失效等) 时的查询间隔 (秒), 成功时由 AdaptiveInterval 决定.
+QUERY_WORKERS = 8  # 同时进行的上游查询数上限.
+QUERY_JITTER = 0.2  # 查询间隔的随机浮动比例.
+HTTP_MAX_CONNECTIONS = 16  # 上游连接池大小.
+HTTP_TIMEOUT = 10  # 上游请求超时 (秒).
+HTTP_RETRIES = 2  # 上游请求失败时的重试次数.
+HTTP_BACKOFF = 0.5  # 首次重试前等待的秒数, 之后每次翻倍.
+READ_WORKERS = 4  # 读取电量记录的线程数.
+FSYNC = FSYNC_INTERVAL  # 写入电量记录后的 fsync 策略, 见 writer 模块.
+FSYNC_INTERVAL_SECONDS = 1.0
+MAX_INFLIGHT = 16  # 每个连接同时处理的带 id 的请求数上限, 达到上限时暂停读取该连接的消息.
 
-x_csrf_token = ""
-cookies = {}
-degree = -1
+rooms: dict[str, Room] = {}
+subscriptions: dict[str, set[ServerConnection]] = {}  # 宿舍名 -> 订阅了该宿舍的连接.
+connection_codecs: dict[ServerConnection, str] = {}  # 通过 HELLO 协商过编码的连接, 其余连接使用 JSON.
+scheduler: Optional[Scheduler] = None
+upstream: Optional[UpstreamClient] = None
+writer: Optional[Writer] = None
+notifier: Optional[Notifier] = None
+state: Optional[StateStore] = None
+sessions = SessionManager()
+query_cache = QueryCache()
+refresh_limiter = RefreshLimiter()
+request_id: ContextVar[Optional[int]] = ContextVar("request_id", default=None)  # 正在处理的请求的 id.
+readers = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="reader")  # 线程在使用时才创建.
 
-roomNo = ""
-elcarea = -1
-elcbuis = ""
+COMMANDS = {v for k, v in vars(Command).items() if k.isupper()}
+UPSTREAM_SECONDS = metrics.Histogram("upstream_query_seconds", "Latency of queryelectricbill requests.")
+UPSTREAM_RESULTS = metrics.Counter(
+    "upstream_queries_total", "Upstream queries by result (ok, expired or error).", ("result",)
+)
+CONNECTIONS = metrics.Gauge("websocket_connections", "Open websocket connections.")
+MESSAGES = metrics.Counter("websocket_messages_total", "Received messages by command.", ("command",))
+MESSAGE_SECONDS = metrics.Histogram(
+    "websocket_message_seconds", "Time to handle one message, by command.", ("command",)
+)
+CODEC_SECONDS = metrics.Histogram("codec_seconds", "Message serialization time.", ("op",))
+CRYPTO_SECONDS = metrics.Histogram("crypto_seconds", "Message encryption time.", ("op",))
+HISTORY_BYTES = metrics.Gauge(
+    "history_file_bytes", "Size of each room's degree history.", ("room",),
+    collect=lambda: {
+        (name,): len(room.store) * RECORD.size for name, room in rooms.items() if room._store is not None
+    },
+)
 
 
-def load_room():
-    global roomNo, elcarea, elcbuis
+def read_room_file() -> dict:
+    """读取 ROOM_FILE, 不存在时为空, 可在线程中调用."""
     try:
         with open(ROOM_FILE, "r") as f:
-            room = toml.load(f)
+            return toml.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def read_notify_file() -> dict:
+    """读取 NOTIFY_FILE, 不存在时为空 (不发通知), 可在线程中调用."""
+    try:
+        with open(NOTIFY_FILE, "r") as f:
+            return toml.load(f)
     except FileNotFoundError:
-        room = {}
-    roomNo = room.get("roomNo", "")
-    elcarea = room.get("elcarea", -1)
-    elcbuis = room.get("elcbuis", "")
+        return {}
 
 
-def save_room(roomNo: str, elcarea: int, elcbuis: str):
-    room_info = {"roomNo": roomNo, "elcarea": elcarea, "elcbuis": elcbuis}
-    logging.info(f"room info saved: {room_info}")
-    with open(ROOM_FILE, "w") as f:
-        f.write(toml.dumps(room_info))
-    load_room()
+def read_state(path: str = STATE_FILE) -> tuple[StateStore, list[RoomState], Optional[tuple[int, dict]]]:
+    """
+    打开 STATE_FILE, 读出上次运行时保存的宿舍状态, 可在线程中调用.
+
+    ROOM_FILE 在上次导入之后被修改过 (或从未导入过) 时还返回 (修改时间, 内容), 否则为 None.
+    """
+    store = StateStore(path)
+    try:
+        mtime = os.stat(ROOM_FILE).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    room_file = None
+    if mtime is not None and mtime != store.get_meta("room_file_mtime"):
+        room_file = (mtime, read_room_file())
+    return store, store.load(), room_file
+
+
+def load_state(saved: list[RoomState], room_file: Optional[tuple[int, dict]]):
+    """
+    用 read_state 的结果恢复宿舍信息, 登录会话和最近电量, 之后 GET_DEGREE 立即返回上次的电量,
+    会话仍然有效时也不需要客户端重新登录. 修改过的 ROOM_FILE 中的宿舍信息优先, 并导入数据库.
+    """
+    for room_state in saved:
+        if not valid_room_name(room_state.name):
+            continue
+        room = get_room(room_state.name, create=True)
+        room.roomNo = room_state.info["roomNo"]
+        room.elcarea = room_state.info["elcarea"]
+        room.elcbuis = room_state.info["elcbuis"]
+        if room_state.session is not None:
+            room.session = sessions.restore(room_state.session)
+        if room_state.degree is not None:
+            room.degree = room_state.degree
+    logging.info(f"restored {len(saved)} rooms from {state.path}.")
+    if room_file is not None:
+        mtime, config = room_file
+        load_room(config)
+        writer.call(state.save_rooms, {name: room.info() for name, room in rooms.items() if room.configured()})
+        writer.call(state.set_meta, "room_file_mtime", mtime)
+        logging.info(f"imported {ROOM_FILE} into {state.path}.")
 
 
-async def query_electric_degree():
+def load_room(config: dict):
     """
-    查询 electric degree 并把结果放在 degree 全局变量中, 返回是否成功获取.
+    从 ROOM_FILE 的内容 (见 read_room_file) 设置所有宿舍信息.
+
+    顶层的 roomNo/elcarea/elcbuis 为默认宿舍, `[rooms.<name>]` 表为其他宿舍.
+    """
+    infos = {name: info for name, info in config.get("rooms", {}).items()}
+    infos[DEFAULT_ROOM] = config
+    for name, info in infos.items():
+        if not valid_room_name(name):
+            logging.warning(f"invalid room name ignored: {name!r}")
+            continue
+        room = rooms.get(name) or Room(name)
+        room.roomNo = info.get("roomNo", "")
+        room.elcarea = info.get("elcarea", -1)
+        room.elcbuis = info.get("elcbuis", "")
+        add_room(room)
+
+
+def save_room(name: str, roomNo: str, elcarea: int, elcbuis: str):
+    room = get_room(name, create=True)
+    room.roomNo, room.elcarea, room.elcbuis = roomNo, elcarea, elcbuis
+    room.adaptive = AdaptiveInterval()
+    room.forecast = DepletionForecast()
+    logging.info(f"room info saved: {room}")
+    default = rooms.get(DEFAULT_ROOM)
+    config = default.info() if default is not None and default.configured() else {}
+    others = {n: r.info() for n, r in rooms.items() if n != DEFAULT_ROOM and r.configured()}
+    if others:
+        config["rooms"] = others
+    # ROOM_FILE 只是方便查看和手动修改的副本, 以数据库为准.
+    writer.replace(ROOM_FILE, toml.dumps(config))
+    if state is not None:
+        writer.call(state.save_rooms, {name: room.info()})
+        writer.call(mark_room_file_saved)
+    if scheduler is not None:
+        scheduler.reschedule(name)
+
+
+def mark_room_file_saved():
+    """save_room 写入的 ROOM_FILE 和数据库一致, 记下它的修改时间, 下次启动时不必重新导入, 在写线程中调用."""
+    state.set_meta("room_file_mtime", os.stat(ROOM_FILE).st_mtime_ns)
+
+
+def add_room(room: Room):
+    rooms[room.name] = room
+    if scheduler is not None:
+        scheduler.add(room)
+
+
+def get_room(name: str, create: bool = False) -> Optional[Room]:
+    """按名字取宿舍, create 为 True 时不存在则新建并加入调度."""
+    room = rooms.get(name)
+    if room is None and create:
+        room = Room(name)
+        add_room(room)
+    return room
+
+
+async def query_electric_degree(room: Room, refresh: bool = False):
+    """
+    查询 electric degree 并把结果放在 room.degree 中, 返回是否成功获取.
 
     - 成功查询时设置 degree 为剩余电量(度).
     - 如果宿舍信息没配置, degree 为 -2.
-    - token 为设置或权限不足或宿舍信息不正确时, degree 为 -1.
+    - token 未设置或登录失效时, degree 为 -1.
+      登录失效时共用该会话的宿舍不再请求上游, 直到重新上传 token.
+    - 上游暂时出错时抛出 UpstreamError, degree 不变, 见 fetch_electric_degree.
+
+    配置了同一个宿舍的多个宿舍名共用 query_cache: CACHE_TTL 内的结果直接使用, 同时进行的查询合并为一次.
+    refresh 为 True 时不使用缓存的结果. 会话快要需要保活时也不使用缓存, 而是用自己的会话查询一次.
     """
-    global degree
-    if not roomNo or elcarea < 0 or not elcbuis:
+    if not room.configured():
         # 没有配置宿舍信息.
-        degree = -2
+        room.degree = -2
         return False
-    async with httpx.AsyncClient() as client:
-        data = {
-            "sysid": 1,
-            "roomNo": roomNo,
-            "elcarea": elcarea,
-            "elcbuis": elcbuis
-        }
-        response = await client.post(
-            "https://epay.ecnu.edu.cn/epaycas/electric/queryelectricbill",
+    session = room.session
+    if session is None or session.expired:
+        room.degree = -1
+        return False
+    key = room.upstream_key()
+    if sessions.keepalive_delay(session) <= query_cache.ttl:
+        degree = await fetch_electric_degree(room, session)
+        query_cache.put(key, degree)
+    else:
+        degree = None if refresh else query_cache.get(key)
+        if degree is None:
+            degree, shared = await query_cache.fetch(key, lambda: fetch_electric_degree(room, session))
+            if degree is None and shared:
+                # 别人的会话失效不代表自己的也失效, 用自己的会话再查一次.
+                degree, _ = await query_cache.fetch(key, lambda: fetch_electric_degree(room, session))
+    if degree is None:
+        room.degree = -1
+        return False
+    room.degree = degree
+    return True
+
+
+async def fetch_electric_degree(room: Room, session: Session) -> Optional[float]:
+    """
+    用 session 向上游查询宿舍的剩余电量, 会话失效时返回 None, 并更新会话的状态.
+
+    只有跳转到登录页, 401/403 或表示未登录的 retcode 才算会话失效; 5xx, 非 JSON 的内容 (维护页面等)
+    和其他 retcode (如这个宿舍的信息不正确) 抛出 UpstreamError, 不影响共用该会话的其他宿舍.
+    """
+    data = {
+        "sysid": 1,
+        "roomNo": room.roomNo,
+        "elcarea": room.elcarea,
+        "elcbuis": room.elcbuis
+    }
+    start = time.perf_counter()
+    try:
+        response = await upstream.post(
+            upstream.query_url,
             headers={
-                "X-CSRF-TOKEN": x_csrf_token
+                "X-CSRF-TOKEN": session.x_csrf_token
             },
             data=data,
-            cookies=cookies
+            cookies=session.cookies
         )
-    try:
-        ret = json.loads(response.text)
-        if ret['retcode'] == 0 and ret['retmsg'] == "成功":
-            degree = ret["restElecDegree"]
-            return True
-        else:
-            degree = -1
-            return False
-    except KeyError:
-        degree = -1
-        return False
-    except JSONDecodeError:
-        degree = -1
-        return False
+    except Exception:
+        if metrics.enabled:
+            UPSTREAM_RESULTS.inc("error")
+        raise
+    if metrics.enabled:
+        UPSTREAM_SECONDS.observe(time.perf_counter() - start)
+    ret = None
+    if not auth_failed(response):
+        try:
+            ret = json.loads(response.text)
+            if ret['retcode'] == 0 and ret['retmsg'] == "成功":
+                sessions.succeeded(session)
+                if metrics.enabled:
+                    UPSTREAM_RESULTS.inc("ok")
+                return ret["restElecDegree"]
+        except (KeyError, TypeError, JSONDecodeError):
+            ret = None
+        if not isinstance(ret, dict) or not auth_failed(response, ret):
+            if metrics.enabled:
+                UPSTREAM_RESULTS.inc("error")
+            detail = ret if isinstance(ret, dict) else response.text[:100]
+            raise UpstreamError(f"{room.name}: upstream returned {response.status_code}: {detail!r}")
+    sessions.failed(session)
+    if metrics.enabled:
+        UPSTREAM_RESULTS.inc("expired")
+    return None
+
+
+def encode(message: object, codec_: str) -> bytes | bytearray:
+    """编码并加密一条消息."""
+    if not metrics.enabled:
+        return encrypt(codec.dumps(message, codec_))
+    start = time.perf_counter()
+    data = codec.dumps(message, codec_)
+    middle = time.perf_counter()
+    data = encrypt(data)
+    CODEC_SECONDS.observe(middle - start, "dumps")
+    CRYPTO_SECONDS.observe(time.perf_counter() - middle, "encrypt")
+    return data
+
+
+def decode(data: bytes) -> object:
+    """解密并解码一条消息."""
+    if not metrics.enabled:
+        return codec.loads(decrypt(data))
+    start = time.perf_counter()
+    data = decrypt(data)
+    middle = time.perf_counter()
+    message = codec.loads(data)
+    CRYPTO_SECONDS.observe(middle - start, "decrypt")
+    CODEC_SECONDS.observe(time.perf_counter() - middle, "loads")
+    return message
+
+
+async def send_message(connection: ServerConnection, message: dict):
+    """发送一条返回消息, 正在处理的请求带有 id 时附上 id."""
+    rid = request_id.get()
+    if rid is not None:
+        message["id"] = rid
+    await connection.send(encode(message, connection_codecs.get(connection, codec.JSON)))
 
 
 async def send_ret(connection: ServerConnection, code: int, content: Optional[object] = None):
     ret = {"retcode": code}
     if content is not None:
         ret['content'] = content
-    await connection.send(
-        encrypt(json.dumps(ret))
-    )
+    await send_message(connection, ret)
+
+
+def publish(connections, push_type: str, content: object):
+    """
+    向多个连接推送同一条消息, 每种编码只编码加密一次.
+    发送缓冲区堆积的慢连接会被跳过, 不会阻塞.
+    """
+    if not connections:
+        return
+    groups: dict[str, list[ServerConnection]] = {}
+    for connection in connections:
+        groups.setdefault(connection_codecs.get(connection, codec.JSON), []).append(connection)
+    push = {"retcode": RetCode.Ok, "push": push_type, "content": content}
+    for codec_, group in groups.items():
+        broadcast(group, encode(push, codec_))
+
+
+async def heartbeat():
+    while True:
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        publish({c for conns in subscriptions.values() for c in conns}, Push.HEARTBEAT, time.time())
+
+
+def read_degree_lines(room: Room, lines: int) -> str:
+    """最后 lines 条电量记录的文本, 耗时和 lines 成正比, 与历史长度无关, 可在线程中调用."""
+    return "\n".join(format_record(*record) for record in room.store.tail(lines))
 
 
-def remove_duplicate_degrees_in_file():
-    prev_degree = -1
-    new = []
-    with open(DEGREE_FILE, "r") as f:
-        for line in f:
-            if line.isspace():
-                continue
-            timestamp, degree_ = line.split(',')
-            degree_ = float(degree_)
-            if degree_ == prev_degree:
-                continue
-            new.append(','.join((timestamp, str(degree_))))
-            prev_degree = degree_
-    with open(DEGREE_FILE, "w") as f:
-        f.write('\n'.join(new) + "\n")
+def series(timestamp, degree) -> dict:
+    """电量序列的传输格式, 二进制编码时整段打包为 float64 / float32 数组."""
+    return {"timestamp": array.array("d", timestamp), "degree": array.array("f", degree)}
+
+
+def read_degree_series(room: Room, lines: int) -> dict:
+    """和 read_degree_lines 相同的记录, 以 series 格式返回, 可在线程中调用."""
+    records = room.store.tail(lines)
+    return series([record[0] for record in records], [record[1] for record in records])
+
+
+def read_degree_range(room: Room, start: Optional[float], end: Optional[float],
+                      max_points: int, method: str) -> dict:
+    """时间范围 [start, end) 内的电量记录, 降采样到不超过 max_points 个点, 可在线程中调用."""
+    records = room.store.range(start, end)
+    return series(*downsample(
+        [record[0] for record in records], [record[1] for record in records], max_points, method
+    ))
+
+
+def open_store(room: Room):
+    """打开宿舍的电量记录, 并用窗口内的历史记录初始化消耗预测, 可在线程中调用."""
+    for record in room.store.range(time.time() - room.forecast.window):
+        room.forecast.update(*record)
+
+
+def forecast(room: Room) -> dict:
+    """FORECAST 的返回内容, 当前电量未知 (登录失效等) 时从最后一条记录的电量开始预测."""
+    degree = room.degree
+    if degree < 0 and room.forecast.points:
+        degree = room.forecast.points[-1][1]
+    return {"degree": degree, **room.forecast.forecast(degree)}
+
+
+def parse_range_args(args: object) -> Optional[tuple]:
+    """检查 FETCH_DEGREE_RANGE 的参数, 不合法时返回 None."""
+    if args is None:
+        args = {}
+    if not isinstance(args, dict):
+        return None
+    start, end = args.get("from"), args.get("to")
+    max_points = args.get("max_points", FETCH_DEGREE_LINES)
+    method = args.get("method", LTTB)
+    for t in (start, end):
+        if t is not None and (isinstance(t, bool) or not isinstance(t, (int, float))):
+            return None
+    if (isinstance(max_points, bool) or not isinstance(max_points, int)
+            or not 3 <= max_points <= MAX_RANGE_POINTS or method not in METHODS):
+        return None
+    return start, end, max_points, method
+
+
+def parse_stream_args(args: object, room: Room) -> Optional[tuple[int, int, int, bool]]:
+    """
+    检查 STREAM_DEGREE_FILE 的参数, 返回 (offset, crc, chunk, 是否需要校验 crc), 不合法时返回 None.
+
+    给出 since 时间戳时, 从第一条时间戳大于 since 的记录开始, 忽略 offset,
+    此时客户端只有部分记录, crc 不是服务端前 offset 条记录的 CRC32, 不需要校验.
+    """
+    if args is None:
+        args = {}
+    if not isinstance(args, dict):
+        return None
+    since = args.get("since")
+    if since is not None:
+        if isinstance(since, bool) or not isinstance(since, (int, float)):
+            return None
+        args = {**args, "offset": room.store.bisect(since, right=True)}
+    values = (args.get("offset", 0), args.get("crc", 0), args.get("chunk", STREAM_CHUNK))
+    if any(isinstance(v, bool) or not isinstance(v, int) for v in values):
+        return None
+    offset, crc, chunk = values
+    if not 0 <= offset <= len(room.store) or not 0 <= crc < 1 << 32 or not 0 < chunk <= MAX_STREAM_CHUNK:
+        return None
+    return offset, crc, chunk, since is None
+
+
+async def read_in_thread(func, *args):
+    """在读线程池中执行读取电量记录的 func, 不阻塞事件循环."""
+    return await asyncio.get_running_loop().run_in_executor(readers, func, *args)
+
+
+async def open_new_store(room: Room):
+    """
+    运行中新建的宿舍 (POST_TOKEN, POST_ROOM) 和启动时一样在线程中打开记录, 旧 csv 的转换可能比较慢.
+    持有 room.querying, 打开完成之前 degree_querying 不会在事件循环中访问 room.store.
+    """
+    async with room.querying:
+        if not room.store_opened():
+            await read_in_thread(open_store, room)
+
+
+async def stream_degree_file(connection: ServerConnection, room: Room, offset: int, crc: int, chunk: int,
+                             verify: bool):
+    """
+    从第 offset 条记录开始分块发送电量记录的原始字节, 只在内存中保留一块.
+
+    verify 为 True 时先在读线程中计算自己前 offset 条记录的 CRC32, 和客户端给出的 crc 不同时返回 ErrChecksum,
+    不发送任何记录, 避免客户端在错误的记录后面续传.
+    之后先发送 `{"retcode": 0, "content": {"offset": offset, "total": 总数}}`,
+    每块为 `{"retcode": 0, "stream": 序号, "offset": 本块起始下标, "content": 记录字节}`,
+    最后一条为 `{"retcode": 0, "stream": 序号, "end": True, "offset": 总数, "checksum": crc}`,
+    checksum 是从 crc 开始, 对本次发送的字节继续计算的 CRC32,
+    verify 为 True 时等于整个记录文件的 CRC32, 否则只用来检查本次传输.
+    websocket 的发送缓冲区满时 send 会等待, 所以慢客户端也不会让服务端积压数据.
+    """
+    total = len(room.store)
+    if verify and await read_in_thread(room.store.checksum, offset) != crc:
+        await send_ret(connection, RetCode.ErrChecksum)
+        return
+    await send_ret(connection, RetCode.Ok, {"offset": offset, "total": total})
+    seq = 0
+    for start in range(offset, total, chunk):
+        data = await read_in_thread(room.store.read_bytes, start, min(start + chunk, total))
+        crc = zlib.crc32(data, crc)
+        await send_message(connection, {"retcode": RetCode.Ok, "stream": seq, "offset": start, "content": data})
+        seq += 1
+    await send_message(
+        connection, {"retcode": RetCode.Ok, "stream": seq, "end": True, "offset": total, "checksum": crc}
+    )
 
 
 async def dorm_querying(connection: ServerConnection):
-    global x_csrf_token, cookies
-    async for message in connection:
-        message = json.loads(decrypt(message))
-        logging.info(f"Got message: {message['type']}")
-        logging.debug(f"Whole message: {message}")
-        if message["type"] == Command.GET_DEGREE:
-            await send_ret(connection, RetCode.Ok, degree)
-        elif message["type"] == Command.POST_TOKEN:
-            args = message.get("args")
-            if (isinstance(args, dict)
-                    and isinstance(args.get('x_csrf_token'), str)
-                    and isinstance(args.get('cookies'), dict)):
-                x_csrf_token = args.get('x_csrf_token')
-                cookies = args.get('cookies')
-                await send_ret(connection, RetCode.Ok)
-            else:
+    if metrics.enabled:
+        CONNECTIONS.inc()
+    try:
+        await handle_messages(connection)
+    finally:
+        if metrics.enabled:
+            CONNECTIONS.dec()
+        for conns in subscriptions.values():
+            conns.discard(connection)
+        connection_codecs.pop(connection, None)
+
+
+async def handle_messages(connection: ServerConnection):
+    """
+    逐条读取连接上的消息.
+    不带 id 的消息按顺序处理完再读下一条, 带 id 的消息放到单独的 Task 中并发处理,
+    同一连接上最多 MAX_INFLIGHT 个. HELLO 总是按顺序处理, 保证之后的请求使用协商好的编码.
+    """
+    inflight = asyncio.Semaphore(MAX_INFLIGHT)
+    tasks: set[asyncio.Task] = set()
+    try:
+        async for data in connection:
+            message = decode(data)
+            rid = message.get("id")
+            if rid is not None and (isinstance(rid, bool) or not isinstance(rid, int)):
                 await send_ret(connection, RetCode.ErrArgs)
-        elif message["type"] == Command.FETCH_DEGREE_FILE:
-            if not os.path.exists(DEGREE_FILE):
-                await send_ret(connection, RetCode.ErrNoFile)
+            elif rid is None or message.get("type") == Command.HELLO:
+                await handle_request(connection, message, rid)
             else:
-                remove_duplicate_degrees_in_file()
-                with open(DEGREE_FILE, "r") as f:
-                    await send_ret(connection, RetCode.Ok,
-                                   "\n".join(f.read().splitlines()[-FETCH_DEGREE_LINES:]))
-        elif message["type"] == Command.POST_ROOM:
-            args = message.get("args")
-            if (isinstance(args, dict)
-                    and isinstance(args.get('roomNo'), str)
-                    and isinstance(args.get('elcarea'), int)
-                    and isinstance(args.get('elcbuis'), str)):
-                save_room(
-                    roomNo=args.get('roomNo'),
-                    elcarea=args.get('elcarea'),
-                    elcbuis=args.get('elcbuis')
-                )
-                await send_ret(connection, RetCode.Ok)
+                await inflight.acquire()
+                task = asyncio.create_task(handle_concurrently(connection, message, rid, inflight))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def handle_concurrently(connection: ServerConnection, message: dict, rid: int, inflight: asyncio.Semaphore):
+    try:
+        await handle_request(connection, message, rid)
+    except websockets.ConnectionClosed:
+        pass
+    except Exception:
+        # 和按顺序处理时抛出异常一样, 以 1011 关闭连接.
+        logging.exception(f"failed to handle message: {message.get('type')}")
+        await connection.close(1011)
+    finally:
+        inflight.release()
+
+
+async def handle_request(connection: ServerConnection, message: dict, rid: Optional[int]):
+    """处理一条消息, 期间发送的返回消息都带上 rid."""
+    token = request_id.set(rid)
+    try:
+        if not metrics.enabled:
+            await handle_message(connection, message)
+            return
+        command = message.get("type")
+        if not isinstance(command, str) or command not in COMMANDS:
+            command = "unknown"  # 不让任意的 type 变成新的标签.
+        start = time.perf_counter()
+        await handle_message(connection, message)
+        MESSAGES.inc(command)
+        MESSAGE_SECONDS.observe(time.perf_counter() - start, command)
+    finally:
+        request_id.reset(token)
+
+
+async def handle_message(connection: ServerConnection, message: dict):
+    room_name = message.get("room", DEFAULT_ROOM)
+    logging.info(f"Got message: {message['type']} ({room_name})")
+    logging.debug(f"Whole message: {message}")
+    if not valid_room_name(room_name):
+        await send_ret(connection, RetCode.ErrArgs)
+    elif message["type"] == Command.GET_DEGREE:
+        room = get_room(room_name)
+        await send_ret(connection, RetCode.Ok, room.degree if room is not None else -2)
+    elif message["type"] == Command.POST_TOKEN:
+        args = message.get("args")
+        if (isinstance(args, dict)
+                and isinstance(args.get('x_csrf_token'), str)
+                and isinstance(args.get('cookies'), dict)):
+            room = get_room(room_name, create=True)
+            await open_new_store(room)
+            room.session = sessions.post(args.get('x_csrf_token'), args.get('cookies'))
+            if state is not None:
+                writer.call(state.save_session, room.session, [room_name])
+            if scheduler is not None:
+                # 共用这个会话的宿舍都立即用新的 token 查询.
+                for other in list(rooms.values()):
+                    if other.session is room.session:
+                        scheduler.reschedule(other.name)
+            await send_ret(connection, RetCode.Ok)
+        else:
+            await send_ret(connection, RetCode.ErrArgs)
+    elif message["type"] == Command.FETCH_DEGREE_FILE:
+        room = get_room(room_name)
+        if room is None or not len(room.store):
+            await send_ret(connection, RetCode.ErrNoFile)
+        elif connection_codecs.get(connection) in codec.BINARY_CODECS:
+            await send_ret(connection, RetCode.Ok,
+                           await read_in_thread(read_degree_series, room, FETCH_DEGREE_LINES))
+        else:
+            await send_ret(connection, RetCode.Ok,
+                           await read_in_thread(read_degree_lines, room, FETCH_DEGREE_LINES))
+    elif message["type"] == Command.FETCH_DEGREE_RANGE:
+        room = get_room(room_name)
+        range_args = parse_range_args(message.get("args"))
+        if range_args is None:
+            await send_ret(connection, RetCode.ErrArgs)
+        elif room is None or not len(room.store):
+            await send_ret(connection, RetCode.ErrNoFile)
+        else:
+            await send_ret(connection, RetCode.Ok,
+                           await read_in_thread(read_degree_range, room, *range_args))
+    elif message["type"] == Command.STREAM_DEGREE_FILE:
+        room = get_room(room_name)
+        if room is None or not len(room.store):
+            await send_ret(connection, RetCode.ErrNoFile)
+        elif connection_codecs.get(connection) not in codec.BINARY_CODECS:
+            await send_ret(connection, RetCode.ErrArgs)  # 记录字节只能用二进制编码传输.
+        elif (stream_args := parse_stream_args(message.get("args"), room)) is None:
+            await send_ret(connection, RetCode.ErrArgs)
+        else:
+            await stream_degree_file(connection, room, *stream_args)
+    elif message["type"] == Command.HELLO:
+        args = message.get("args")
+        chosen = codec.choose(args.get("codecs") if isinstance(args, dict) else None)
+        await send_ret(connection, RetCode.Ok, chosen)  # 回复本身仍使用原来的编码.
+        connection_codecs[connection] = chosen
+    elif message["type"] == Command.SUBSCRIBE:
+        subscriptions.setdefault(room_name, set()).add(connection)
+        await send_ret(connection, RetCode.Ok)
+        room = get_room(room_name)
+        publish([connection], Push.DEGREE, room.degree if room is not None else -2)
+    elif message["type"] == Command.FORECAST:
+        room = get_room(room_name)
+        if room is None:
+            await send_ret(connection, RetCode.ErrNoFile)
+        else:
+            # 还没有记录 (新宿舍, 或者 writer 还没写入) 时各项为 None, 不算错误.
+            await send_ret(connection, RetCode.Ok, forecast(room))
+    elif message["type"] == Command.REFRESH:
+        room = get_room(room_name)
+        if room is None or not room.configured():
+            # 宿舍信息不完整时不会查询上游, 也不占用刷新次数.
+            await send_ret(connection, RetCode.Ok, -2)
+        elif (wait := refresh_limiter.acquire(room.upstream_key())) > 0:
+            await send_ret(connection, RetCode.ErrRateLimited, round(wait, 1))
+        else:
+            try:
+                await degree_querying(room, refresh=True)
+            except Exception:
+                # 上游出错时和定时查询一样只记录日志, 不断开连接.
+                logging.exception(f"failed to refresh {room.name}.")
+                await send_ret(connection, RetCode.ErrUnknown)
             else:
-                await send_ret(connection, RetCode.ErrArgs)
+                await send_ret(connection, RetCode.Ok, room.degree)
+    elif message["type"] == Command.POST_ROOM:
+        args = message.get("args")
+        if (isinstance(args, dict)
+                and isinstance(args.get('roomNo'), str)
+                and isinstance(args.get('elcarea'), int)
+                and isinstance(args.get('elcbuis'), str)):
+            save_room(
+                room_name,
+                roomNo=args.get('roomNo'),
+                elcarea=args.get('elcarea'),
+                elcbuis=args.get('elcbuis')
+            )
+            await open_new_store(get_room(room_name))
+            await send_ret(connection, RetCode.Ok)
+        else:
+            await send_ret(connection, RetCode.ErrArgs)
 
 
-def record_degree():
-    global degree
-    logging.info(f"Recorded degree: {degree}.")
-    with open(DEGREE_FILE, 'a') as f:
-        f.write(f"{time.time():.2f}, {degree}\n")
+def record_degree(room: Room):
+    timestamp = time.time()
+    if writer.append(room.store, timestamp, room.degree):
+        room.forecast.update(timestamp, room.degree)
+        logging.info(f"Recorded degree: {room.degree} ({room.name}).")
 
 
-async def degree_querying():
-    global degree
-    while True:
+async def degree_querying(room: Room, refresh: bool = False) -> Optional[float]:
+    """
+    查询一个宿舍的电量并记录, 由 scheduler 调用, 也由 REFRESH 调用 (refresh 为 True, 不使用缓存).
+    同一个宿舍的查询持有 room.querying 依次进行, 不会重复记录同一次变化.
+
+    返回距离下一次查询的秒数, 查询失败时返回 None, 使用默认间隔.
+    """
+    async with room.querying:
+        prev_degree = room.degree
         try:
-            query_result = await query_electric_degree()
-            logging.info(f"{query_result=}, {degree=}.")
-            if query_result:
-                record_degree()
-        except Exception:
-            logging.error(traceback.format_exc())
-        await asyncio.sleep(10)
+            query_result = await query_electric_degree(room, refresh)
+        except UpstreamError as e:
+            # 电量保持不变, 按 QUERY_INTERVAL 重试.
+            logging.warning(e)
+            return None
+        logging.info(f"{room.name}: {query_result=}, degree={room.degree}.")
+        if query_result:
+            record_degree(room)
+        if room.degree != prev_degree:
+            if state is not None:
+                writer.call(state.save_degree, room.name, room.degree, time.time(), room.session)
+            publish(subscriptions.get(room.name), Push.DEGREE, room.degree)
+            if notifier is not None:
+                notifier.observe(room.name, prev_degree, room.degree, forecast(room)["hours"])
+        if not query_result:
+            return None
+        # 不晚于会话需要保活的时刻查询, 查询本身就是保活请求.
+        return min(room.adaptive.update(time.time(), room.degree), sessions.keepalive_delay(room.session))
 
 
-async def server_main():
-    load_room()
+async def server_main(metrics_port: Optional[int] = None, query_url: str = QUERY_URL):
+    """
+    metrics_port 不为 None 时开启指标收集, 在本机该端口上提供 /metrics.
+    query_url 为上游查询接口, 测试时可以指向本地模拟的 epay.
+    """
+    global scheduler, upstream, writer, notifier, state
+    metrics_server = await metrics.serve(metrics_port) if metrics_port is not None else None
+    scheduler = Scheduler(
+        degree_querying, interval=QUERY_INTERVAL, workers=QUERY_WORKERS, jitter=QUERY_JITTER
+    )
+    writer = Writer(fsync=FSYNC, fsync_interval=FSYNC_INTERVAL_SECONDS)
+    state, saved, room_file = await asyncio.to_thread(read_state)
+    load_state(saved, room_file)
+    notifier = load_notifier(await asyncio.to_thread(read_notify_file))
+    # 提前打开所有宿舍的记录, 旧 csv 记录的转换可能比较慢, 放在线程中进行.
+    await asyncio.to_thread(lambda: [open_store(room) for room in list(rooms.values())])
+    await read_in_thread(codec.warm_up)
     server = await websockets.asyncio.server.serve(dorm_querying, "", SERVER_PORT)
-    await asyncio.gather(server.serve_forever(), degree_querying())
+    async with UpstreamClient(
+        max_connections=HTTP_MAX_CONNECTIONS,
+        timeout=HTTP_TIMEOUT,
+        retries=HTTP_RETRIES,
+        backoff=HTTP_BACKOFF,
+        query_url=query_url,
+    ) as upstream:
+        try:
+            await asyncio.gather(server.serve_forever(), scheduler.run(), heartbeat(), writer.run(), notifier.run())
+        finally:
+            state.close()
+            if metrics_server is not None:
+                metrics_server.close()
@@ -0,0 +1,58 @@
+from collections import deque
+
+from ecnuqueryelectricbill.consumption import consuming_speed
+
+ALERT_DEGREE = 10  # 低于此电量 (度) 视为电量不足, 接近时加快查询.
+NEAR_ALERT_MARGIN = 5  # 电量在 ALERT_DEGREE 之上 NEAR_ALERT_MARGIN 以内时查询间隔不超过 NEAR_ALERT_INTERVAL.
+MIN_INTERVAL = 10  # 最短查询间隔 (秒).
+MAX_INTERVAL = 30 * 60  # 最长查询间隔 (秒).
+NEAR_ALERT_INTERVAL = 60
+BELOW_ALERT_INTERVAL = 5 * 60  # 电量已经不足时, 只需要及时发现充值.
+SAFETY = 0.5  # 预测的下次变化时间乘以此系数作为查询间隔, 宁早勿晚.
+WINDOW = 16  # 用于估计消耗速度的最近电量变化点个数.
+
+
+class AdaptiveInterval:
+    """
+    根据最近的电量消耗速度决定下一次查询间隔.
+
+    - 电量变化时, 用 `consuming_speed` 估计速度, 预测下一次变化的时间.
+    - 电量不变时, 查询间隔指数退避, 直到 MAX_INTERVAL.
+    - 刚充值或者电量接近 ALERT_DEGREE 时缩短间隔, 保证不会错过越过阈值的时刻.
+    """
+
+    def __init__(self, alert_degree: float = ALERT_DEGREE):
+        self.alert_degree = alert_degree
+        self.timestamps: deque[float] = deque(maxlen=WINDOW)  # 电量发生变化的时间点.
+        self.degrees: deque[float] = deque(maxlen=WINDOW)
+        self.interval: float = MIN_INTERVAL
+
+    def speed(self) -> float:
+        """当前估计的消耗速度, 单位: 度/秒, 数据不足时为 0."""
+        if len(self.timestamps) < 3:
+            return 0
+        _, s = consuming_speed(list(self.timestamps), list(self.degrees))
+        return s[-1] / 3600 / 24
+
+    def update(self, timestamp: float, degree: float) -> float:
+        """记录一次成功查询的结果, 返回距离下一次查询的秒数."""
+        prev = self.degrees[-1] if self.degrees else None
+        if prev != degree:
+            self.timestamps.append(timestamp)
+            self.degrees.append(degree)
+        speed = self.speed()
+        if prev is None or degree > prev:
+            # 第一次查询, 或者刚充值 (电量可能分几次到账), 尽快确认.
+            self.interval = MIN_INTERVAL
+        elif degree < prev:
+            self.interval = SAFETY * (prev - degree) / speed if speed > 0 else MIN_INTERVAL
+        else:
+            self.interval *= 2
+        if degree > self.alert_degree and speed > 0:
+            self.interval = min(self.interval, SAFETY * (degree - self.alert_degree) / speed)
+        if self.alert_degree <= degree <= self.alert_degree + NEAR_ALERT_MARGIN:
+            self.interval = min(self.interval, NEAR_ALERT_INTERVAL)
+        elif degree < self.alert_degree:
+            self.interval = min(self.interval, BELOW_ALERT_INTERVAL)
+        self.interval = min(max(self.interval, MIN_INTERVAL), MAX_INTERVAL)
+        return self.interval
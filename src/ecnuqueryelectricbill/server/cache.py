@@ -0,0 +1,110 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Hashable, Optional
+
+from ecnuqueryelectricbill.server import metrics
+
+CACHE_TTL = 30  # 上游查询结果的有效期 (秒).
+REFRESH_INTERVAL = 60  # 同一个宿舍两次 REFRESH 之间至少间隔的秒数.
+REFRESH_RATE = 0.2  # 所有宿舍的 REFRESH 合计每秒最多触发的上游查询数 (长期平均).
+REFRESH_BURST = 5  # 允许的 REFRESH 突发数.
+
+CACHE_RESULTS = metrics.Counter(
+    "upstream_cache_total", "Degree lookups by cache result.", ("result",)  # hit, shared, miss.
+)
+
+
+class QueryCache:
+    """
+    上游电量查询结果的 TTL 缓存, 并合并同一时刻的相同查询 (single-flight).
+
+    键为上游的宿舍标识 (见 Room.upstream_key), 室友各自配置的宿舍名不同, 但键相同,
+    所以 ttl 秒内只会向 epay 查询一次, 正在进行的查询完成时所有等待者共享同一个结果.
+    只缓存成功的结果 (不为 None), 查询抛出的异常也会交给所有等待者, 发起者被取消时等待者得到 None.
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL, clock: Callable[[], float] = time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._entries: dict[Hashable, tuple[float, float]] = {}  # 键 -> (查询时间, 结果).
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def get(self, key: Hashable) -> Optional[float]:
+        """ttl 内的查询结果, 没有或已过期时为 None."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._clock() - entry[0] >= self.ttl:
+            del self._entries[key]
+            return None
+        if metrics.enabled:
+            CACHE_RESULTS.inc("hit")
+        return entry[1]
+
+    def put(self, key: Hashable, value: Optional[float]):
+        if value is not None:
+            self._entries[key] = (self._clock(), value)
+
+    async def fetch(self, key: Hashable, query: Callable[[], Awaitable[Optional[float]]]) -> tuple[Optional[float], bool]:
+        """
+        不看缓存, 执行 query 并缓存结果, 同一个键已经有查询在进行时等待它的结果.
+        返回 (结果, 是否来自其他调用方的查询).
+        """
+        future = self._inflight.get(key)
+        if future is not None:
+            if metrics.enabled:
+                CACHE_RESULTS.inc("shared")
+            # 等待者被取消时不影响进行中的查询.
+            return await asyncio.shield(future), True
+        if metrics.enabled:
+            CACHE_RESULTS.inc("miss")
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await query()
+        except asyncio.CancelledError:
+            # 发起者被取消 (如 REFRESH 的连接断开) 不应取消等待者, 交给它们 None, 由它们自己重新查询.
+            future.set_result(None)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # 没有等待者时不报告 "exception was never retrieved".
+            raise
+        else:
+            self.put(key, value)
+            future.set_result(value)
+            return value, False
+        finally:
+            del self._inflight[key]
+
+
+class RefreshLimiter:
+    """
+    REFRESH 的限流: 每个键至少间隔 interval 秒, 所有键合计按令牌桶限制为每秒 rate 次, 最多突发 burst 次.
+    """
+
+    def __init__(self, interval: float = REFRESH_INTERVAL, rate: float = REFRESH_RATE, burst: int = REFRESH_BURST,
+                 clock: Callable[[], float] = time.monotonic):
+        self.interval = interval
+        self.rate = rate
+        self.burst = burst
+        self._clock = clock
+        self._last: dict[Hashable, float] = {}
+        self._tokens = float(burst)
+        self._updated = clock()
+
+    def acquire(self, key: Hashable) -> float:
+        """允许时记下这次刷新并返回 0, 否则返回还需要等待的秒数."""
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            return self.interval - (now - last)
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        self._tokens -= 1
+        self._last[key] = now
+        # 超过 interval 的记录不再起作用, 顺便清理, 避免键越积越多.
+        for other in [k for k, t in self._last.items() if now - t >= self.interval]:
+            del self._last[other]
+        return 0
@@ -0,0 +1,96 @@
+import math
+from collections import deque
+from typing import Optional
+
+WINDOW = 3 * 24 * 3600  # 只用最近这么多秒内的电量变化点估计消耗速度.
+MAX_POINTS = 4096  # 窗口内最多保留的点数.
+MIN_POINTS = 3
+Z = 1.96  # 置信区间对应的正态分位数 (95%).
+RECHARGE = 1  # 电量上升超过这么多度才视为充值, 更小的上升当作读数波动.
+
+
+class DepletionForecast:
+    """
+    用滑动窗口内的电量记录做最小二乘直线拟合, 预测电量耗尽的时间.
+
+    只维护窗口内 t, d, t², t·d, d² 的累加和, 新增和移出一个点都是 O(1), 预测时不需要遍历记录.
+    时间戳相对于原点 origin, 避免大数相减损失精度. 窗口滑过一个 window 后把原点移到窗口内第一个点,
+    并重新计算累加和, 消除反复加减带来的误差累积, 均摊下来仍是 O(1).
+    充值 (电量上升超过 RECHARGE) 后之前的记录不再代表当前的消耗, 清空窗口.
+    """
+
+    def __init__(self, window: float = WINDOW, max_points: int = MAX_POINTS):
+        self.window = window
+        self.points: deque[tuple[float, float]] = deque(maxlen=max_points)  # (相对时间, 电量).
+        self.origin = 0.0
+        self._sums = [0.0] * 5  # t, d, t², t·d, d².
+
+    def _add(self, t: float, d: float, sign: int):
+        for i, v in enumerate((t, d, t * t, t * d, d * d)):
+            self._sums[i] += sign * v
+
+    def reset(self):
+        self.points.clear()
+        self._sums = [0.0] * 5
+
+    def update(self, timestamp: float, degree: float):
+        """加入一条新的电量记录, 时间戳需要递增."""
+        if self.points and degree > self.points[-1][1] + RECHARGE:
+            self.reset()
+        if not self.points:
+            self.origin = timestamp
+        t = timestamp - self.origin
+        if len(self.points) == self.points.maxlen:
+            self._add(*self.points[0], -1)  # deque 会自动丢弃最旧的点.
+        self.points.append((t, degree))
+        self._add(t, degree, 1)
+        while self.points[0][0] < t - self.window:
+            self._add(*self.points.popleft(), -1)
+        if self.points[0][0] > self.window:
+            self._rebase()
+
+    def _rebase(self):
+        shift = self.points[0][0]
+        self.origin += shift
+        self.points = deque(((t - shift, d) for t, d in self.points), maxlen=self.points.maxlen)
+        self._sums = [0.0] * 5
+        for t, d in self.points:
+            self._add(t, d, 1)
+
+    def slope(self) -> Optional[tuple[float, float]]:
+        """拟合直线的斜率 (度/秒) 及其标准误差, 点数不足时为 None."""
+        n = len(self.points)
+        if n < MIN_POINTS:
+            return None
+        st, sd, stt, std, sdd = self._sums
+        sxx = stt - st * st / n
+        if sxx <= 0:
+            return None
+        sxy = std - st * sd / n
+        syy = sdd - sd * sd / n
+        b = sxy / sxx
+        sse = max(syy - b * sxy, 0)
+        return b, math.sqrt(sse / (n - 2) / sxx)
+
+    def forecast(self, degree: float) -> dict:
+        """
+        从当前电量 degree 开始按拟合的速度消耗, 预测距离耗尽的小时数.
+
+        返回 `{"speed": 度/天, "hours": 小时, "low": 小时, "high": 小时, "points": 点数}`,
+        low 和 high 为消耗速度取置信区间上下界时的结果.
+        无法预测 (数据不足或电量没有下降) 时相应的值为 None, 置信区间上界没有下降时 high 为 None.
+        """
+        result = {"speed": None, "hours": None, "low": None, "high": None, "points": len(self.points)}
+        fit = self.slope()
+        if fit is None:
+            return result
+        b, se = fit
+        result["speed"] = -b * 3600 * 24
+        if b >= 0:
+            return result
+        degree = max(degree, 0)
+        result["hours"] = degree / -b / 3600
+        result["low"] = degree / -(b - Z * se) / 3600
+        if b + Z * se < 0:
+            result["high"] = degree / -(b + Z * se) / 3600
+        return result
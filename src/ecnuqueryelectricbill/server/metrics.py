@@ -0,0 +1,143 @@
+"""
+Prometheus 文本格式的服务端指标.
+
+默认关闭, 关闭时埋点处只多一次 `metrics.enabled` 的判断, 不计时也不更新任何数据.
+开启后 (billqueryserver --metrics) 在本机的 METRICS_PORT 上提供 `GET /metrics`.
+"""
+
+import asyncio
+import bisect
+import logging
+from typing import Callable, Optional
+
+METRICS_PORT = 30531
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+enabled = False
+_registry: list["Metric"] = []
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{n}="{str(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    type_ = ""
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        _registry.append(self)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_}"]
+        lines += self.samples()
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_ = "counter"
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help_, labels)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Metric):
+    """当前值, 可以直接设置, 也可以给出 collect 函数在每次抓取时计算 (返回 标签值元组 -> 值)."""
+
+    type_ = "gauge"
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = (),
+                 collect: Optional[Callable[[], dict[tuple, float]]] = None):
+        super().__init__(name, help_, labels)
+        self._values: dict[tuple, float] = {}
+        self._collect = collect
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self) -> list[str]:
+        values = self._collect() if self._collect is not None else self._values
+        return [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in values.items()]
+
+
+class Histogram(Metric):
+    type_ = "histogram"
+
+    def __init__(self, name: str, help_: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = BUCKETS):
+        super().__init__(name, help_, labels)
+        self.buckets = buckets
+        self._values: dict[tuple, list] = {}  # 标签值 -> [各桶计数 (不累计), 总和, 个数].
+
+    def observe(self, value: float, *labels):
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for k, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, k, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, k)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, k)} {count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in _registry) + "\n"
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """只支持 `GET /metrics` 的极简 HTTP 服务, 每个连接处理一个请求."""
+    try:
+        request = await reader.readuntil(b"\r\n\r\n")
+        method, path = request.split(b" ", 2)[:2]
+        if method == b"GET" and path.split(b"?")[0] == b"/metrics":
+            status, body = b"200 OK", render().encode("utf-8")
+        else:
+            status, body = b"404 Not Found", b"not found\n"
+        writer.write(
+            b"HTTP/1.1 " + status + b"\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("ascii") + body
+        )
+        await writer.drain()
+    except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port: int = METRICS_PORT, host: str = "127.0.0.1") -> asyncio.Server:
+    """开启指标收集并在 host:port 上提供 /metrics, 默认只监听本机."""
+    global enabled
+    enabled = True
+    server = await asyncio.start_server(_handle, host, port)
+    logging.info(f"metrics available at http://{host}:{port}/metrics")
+    return server
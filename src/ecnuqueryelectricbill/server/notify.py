@@ -0,0 +1,376 @@
+"""
+服务端的电量通知: 查询到的电量变化时生成通知, 分批投递到 notify.toml 中配置的各个通知渠道 (sink).
+
+notify.toml 的格式:
+
+```toml
+alert_degree = 10     # 电量低于此值时通知, 可省略.
+alert_hours = 24      # 预计这么多小时内耗尽时提前通知, 可省略.
+min_interval = 21600  # 同一宿舍同一类通知的最短间隔 (秒), 可省略.
+
+[[sinks]]
+type = "webhook"      # POST JSON: {"notifications": [通知, ...]}, 通知的格式见 Notification.to_dict.
+url = "https://example.com/hook"
+rooms = ["A326"]      # 只接收这些宿舍的通知, 省略时接收所有宿舍.
+
+[[sinks]]
+type = "smtp"         # 一批通知合并为一封邮件.
+host = "smtp.example.com"
+port = 465
+ssl = true            # false 时使用 STARTTLS.
+username = "..."
+password = "..."
+sender = "..."
+to = ["..."]
+
+[[sinks]]
+type = "command"      # 每条通知执行一次, 参数中的 {room} {kind} {title} {text} {degree} 会被替换.
+command = ["notify-send", "{title}", "{text}"]
+```
+"""
+
+import asyncio
+import logging
+import smtplib
+import time
+from email.message import EmailMessage
+from typing import Optional
+
+import httpx
+
+from ecnuqueryelectricbill.server import metrics
+from ecnuqueryelectricbill.server.forecast import RECHARGE
+
+NOTIFY_FILE = "notify.toml"
+ALERT_DEGREE = 10
+ALERT_HOURS = 24
+MIN_INTERVAL = 6 * 3600  # 同一宿舍同一类通知的最短间隔 (秒).
+BATCH_DELAY = 1.0  # 收到第一条通知后再等待这么多秒, 把期间的通知合并为一批投递.
+MAX_BATCH = 256
+MAX_QUEUE = 4096  # 排队的通知超过这么多条时丢弃新的通知, 避免 sink 长期失败时内存无限增长.
+RETRIES = 3  # 投递失败时的重试次数.
+BACKOFF = 5.0  # 首次重试前等待的秒数, 之后每次翻倍.
+MAX_SENDING = 32  # 同时进行的投递数上限.
+TIMEOUT = 10  # webhook, SMTP 和命令的超时 (秒).
+
+# 通知的类型.
+LOW = "low"  # 电量低于 alert_degree.
+DEPLETING = "depleting"  # 预计 alert_hours 内耗尽.
+RECHARGED = "recharged"  # 电量上升, 视为充值.
+LOGIN = "login"  # 登录失效, 需要在客户端重新登录.
+
+NOTIFICATIONS = metrics.Counter(
+    "notifications_total", "Notification deliveries by sink type and result (sent, retry, failed, dropped).",
+    ("sink", "result"),
+)
+
+
+class Notification:
+    def __init__(self, room: str, kind: str, title: str, text: str, degree: float, timestamp: float):
+        self.room = room
+        self.kind = kind
+        self.title = title
+        self.text = text
+        self.degree = degree
+        self.timestamp = timestamp
+
+    def to_dict(self) -> dict:
+        return {
+            "room": self.room, "kind": self.kind, "title": self.title,
+            "text": self.text, "degree": self.degree, "timestamp": self.timestamp,
+        }
+
+    def __repr__(self):
+        return f"Notification({self.room!r}, {self.kind!r}, degree={self.degree})"
+
+
+class Sink:
+    """通知渠道, rooms 不为 None 时只接收这些宿舍的通知."""
+
+    type_ = ""
+
+    def __init__(self, rooms: Optional[list[str]] = None):
+        self.rooms = set(rooms) if rooms is not None else None
+
+    def accepts(self, room: str) -> bool:
+        return self.rooms is None or room in self.rooms
+
+    async def send(self, batch: list[Notification]):
+        """投递一批通知, 失败时抛出异常, 由 Notifier 重试整批."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class WebhookSink(Sink):
+    type_ = "webhook"
+
+    def __init__(self, url: str, rooms: Optional[list[str]] = None, timeout: float = TIMEOUT):
+        super().__init__(rooms)
+        self.url = url
+        self._client = httpx.AsyncClient(timeout=timeout)
+
+    async def send(self, batch: list[Notification]):
+        response = await self._client.post(self.url, json={"notifications": [n.to_dict() for n in batch]})
+        response.raise_for_status()
+
+    async def close(self):
+        await self._client.aclose()
+
+
+class SmtpSink(Sink):
+    type_ = "smtp"
+
+    def __init__(self, host: str, sender: str, to: list[str], port: int = 465, ssl: bool = True,
+                 username: Optional[str] = None, password: Optional[str] = None,
+                 rooms: Optional[list[str]] = None, timeout: float = TIMEOUT):
+        super().__init__(rooms)
+        self.host = host
+        self.port = port
+        self.ssl = ssl
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.to = to
+        self.timeout = timeout
+
+    def message(self, batch: list[Notification]) -> EmailMessage:
+        message = EmailMessage()
+        message["Subject"] = batch[0].title if len(batch) == 1 else f"{len(batch)} 条电量通知"
+        message["From"] = self.sender
+        message["To"] = ", ".join(self.to)
+        message.set_content("\n\n".join(f"[{n.room}] {n.title}\n{n.text}" for n in batch))
+        return message
+
+    def _send(self, message: EmailMessage):
+        if self.ssl:
+            smtp = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        with smtp:
+            if not self.ssl:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password or "")
+            smtp.send_message(message)
+
+    async def send(self, batch: list[Notification]):
+        await asyncio.to_thread(self._send, self.message(batch))  # smtplib 是阻塞的.
+
+
+class CommandSink(Sink):
+    type_ = "command"
+
+    def __init__(self, command: list[str], rooms: Optional[list[str]] = None, timeout: float = TIMEOUT):
+        super().__init__(rooms)
+        self.command = command
+        self.timeout = timeout
+
+    async def send(self, batch: list[Notification]):
+        for n in batch:
+            args = [arg.format(**n.to_dict()) for arg in self.command]
+            process = await asyncio.create_subprocess_exec(*args)
+            try:
+                code = await asyncio.wait_for(process.wait(), self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                await process.wait()  # 回收子进程, 不留下僵尸进程.
+                raise
+            if code != 0:
+                raise RuntimeError(f"notify command exited with {code}: {args}")
+
+
+class FakeSink(Sink):
+    """只在内存中记录收到的通知, 用于测试. 前 fail 次投递会失败, 用来检查重试."""
+
+    type_ = "fake"
+
+    def __init__(self, rooms: Optional[list[str]] = None, fail: int = 0, latency: float = 0):
+        super().__init__(rooms)
+        self.fail = fail
+        self.latency = latency
+        self.batches: list[list[Notification]] = []
+        self.attempts = 0
+
+    async def send(self, batch: list[Notification]):
+        self.attempts += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.fail > 0:
+            self.fail -= 1
+            raise ConnectionError("fake sink failure")
+        self.batches.append(batch)
+
+    @property
+    def sent(self) -> list[Notification]:
+        return [n for batch in self.batches for n in batch]
+
+
+SINK_TYPES = {cls.type_: cls for cls in (WebhookSink, SmtpSink, CommandSink, FakeSink)}
+
+
+def make_sink(config: dict) -> Sink:
+    """从 notify.toml 中的一个 [[sinks]] 表创建 sink, 类型未知时抛出 ValueError."""
+    config = dict(config)
+    type_ = config.pop("type", None)
+    if type_ not in SINK_TYPES:
+        raise ValueError(f"unknown sink type: {type_!r}")
+    return SINK_TYPES[type_](**config)
+
+
+class Notifier:
+    """
+    根据每个宿舍的电量变化决定发出哪些通知, 并分批投递到各个 sink.
+
+    去重和限流: 低电量和即将耗尽的通知在条件持续期间只发一次, 电量回升 (充值) 后才会再次发出;
+    此外同一宿舍同一类通知两次之间至少间隔 min_interval 秒, 避免读数在阈值附近波动时反复通知.
+    observe 只把通知放进队列, 不会阻塞查询. run 收到第一条通知后等待 batch_delay 秒,
+    把期间的通知合并为一批, 按 sink 分组后各自投递. 投递失败时按 backoff * 2^n 秒退避重试整批,
+    最多重试 retries 次, 不影响其他 sink 和之后的批次.
+    """
+
+    def __init__(
+        self,
+        sinks: list[Sink],
+        alert_degree: float = ALERT_DEGREE,
+        alert_hours: float = ALERT_HOURS,
+        min_interval: float = MIN_INTERVAL,
+        batch_delay: float = BATCH_DELAY,
+        max_batch: int = MAX_BATCH,
+        retries: int = RETRIES,
+        backoff: float = BACKOFF,
+    ):
+        self.sinks = sinks
+        self.alert_degree = alert_degree
+        self.alert_hours = alert_hours
+        self.min_interval = min_interval
+        self.batch_delay = batch_delay
+        self.max_batch = max_batch
+        self.retries = retries
+        self.backoff = backoff
+        self._queue: asyncio.Queue[Notification] = asyncio.Queue(MAX_QUEUE)
+        self._sending = asyncio.Semaphore(MAX_SENDING)
+        self._tasks: set[asyncio.Task] = set()
+        self._active: set[tuple[str, str]] = set()  # 已经通知过, 条件仍然成立的 (宿舍, 类型).
+        self._last: dict[tuple[str, str], float] = {}  # (宿舍, 类型) -> 上次通知的时间.
+
+    def observe(self, room: str, prev_degree: float, degree: float, hours: Optional[float] = None):
+        """
+        宿舍电量从 prev_degree 变为 degree 时调用, 取值含义同 query_electric_degree.
+        hours 为预计多少小时后耗尽, 无法预测时为 None.
+        """
+        if degree == -1 and prev_degree != -1:
+            self._notify(room, LOGIN, "请重新登录", "登录信息已失效, 请运行客户端重新登录.", degree)
+        if degree < 0:
+            return
+        if prev_degree >= 0 and degree > prev_degree + RECHARGE:
+            self._active.discard((room, LOW))
+            self._active.discard((room, DEPLETING))
+            self._notify(room, RECHARGED, "电量充值", f"检测到电量增加: 增加度数为 {degree - prev_degree:.2f}.", degree)
+        if degree < self.alert_degree:
+            self._notify_once(room, LOW, "电费不足", f"剩余电量 {degree:.2f} 度, 请及时充值.", degree)
+        elif hours is not None and hours < self.alert_hours:
+            self._notify_once(
+                room, DEPLETING, "电量即将耗尽", f"按最近的用电速度, 电量预计在 {hours:.1f} 小时后耗尽, 请及时充值.",
+                degree,
+            )
+
+    def _notify_once(self, room: str, kind: str, title: str, text: str, degree: float):
+        if (room, kind) not in self._active and self._notify(room, kind, title, text, degree):
+            self._active.add((room, kind))
+
+    def _notify(self, room: str, kind: str, title: str, text: str, degree: float) -> bool:
+        """放入投递队列, 返回是否放入 (被限流或队列已满时不放入)."""
+        if not self.sinks:
+            return False
+        now = time.time()
+        last = self._last.get((room, kind))
+        if last is not None and now - last < self.min_interval:
+            return False
+        try:
+            self._queue.put_nowait(Notification(room, kind, title, text, degree, now))
+        except asyncio.QueueFull:
+            logging.warning(f"notification queue full, dropped {kind} for {room}.")
+            if metrics.enabled:
+                NOTIFICATIONS.inc("all", "dropped")
+            return False
+        self._last[(room, kind)] = now
+        return True
+
+    async def _take(self) -> list[Notification]:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_delay
+        while len(batch) < self.max_batch:
+            if self._queue.empty():
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            else:
+                batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _deliver(self, sink: Sink, batch: list[Notification]):
+        delay = self.backoff
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._sending:
+                    await sink.send(batch)
+                if metrics.enabled:
+                    NOTIFICATIONS.inc(sink.type_, "sent", amount=len(batch))
+                return
+            except Exception as e:
+                if attempt == self.retries:
+                    logging.error(f"{sink.type_} sink failed, {len(batch)} notifications dropped: {e!r}")
+                    if metrics.enabled:
+                        NOTIFICATIONS.inc(sink.type_, "failed", amount=len(batch))
+                    return
+                logging.warning(f"{sink.type_} sink failed, retrying in {delay}s: {e!r}")
+                if metrics.enabled:
+                    NOTIFICATIONS.inc(sink.type_, "retry", amount=len(batch))
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    async def run(self):
+        try:
+            while True:
+                batch = await self._take()
+                for sink in self.sinks:
+                    items = [n for n in batch if sink.accepts(n.room)]
+                    if items:
+                        task = asyncio.create_task(self._deliver(sink, items))
+                        self._tasks.add(task)
+                        task.add_done_callback(self._tasks.discard)
+                for _ in batch:
+                    self._queue.task_done()
+        finally:
+            for sink in self.sinks:
+                await sink.close()
+
+    async def flush(self):
+        """等待已经放入队列的通知投递完成 (包括重试)."""
+        await self._queue.join()
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+
+def load_notifier(config: dict) -> Notifier:
+    """从 NOTIFY_FILE 的内容创建 Notifier, 配置有误的 sink 跳过并记录日志."""
+    sinks = []
+    for sink_config in config.get("sinks", []):
+        try:
+            sinks.append(make_sink(sink_config))
+        except (TypeError, ValueError) as e:
+            logging.error(f"invalid notify sink ignored: {e}")
+    logging.info(f"{len(sinks)} notify sinks loaded.")
+    return Notifier(
+        sinks,
+        alert_degree=config.get("alert_degree", ALERT_DEGREE),
+        alert_hours=config.get("alert_hours", ALERT_HOURS),
+        min_interval=config.get("min_interval", MIN_INTERVAL),
+    )
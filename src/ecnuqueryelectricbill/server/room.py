@@ -0,0 +1,78 @@
+import asyncio
+import os
+import re
+from typing import Optional
+
+from ecnuqueryelectricbill import DEFAULT_ROOM
+from ecnuqueryelectricbill.server.adaptive import AdaptiveInterval
+from ecnuqueryelectricbill.server.forecast import DepletionForecast
+from ecnuqueryelectricbill.server.session import Session
+from ecnuqueryelectricbill.store import DegreeStore, migrate_csv
+
+DEGREE_FILE = "degree.bin"
+DEGREE_CSV_FILE = "degree.csv"  # 旧版本的文本记录, 首次打开时自动转换为 DEGREE_FILE.
+DEGREE_DIR = "degree"  # 非默认宿舍的电量记录存放目录.
+
+
+def valid_room_name(name: object) -> bool:
+    """宿舍名会用作文件名, 只允许字母数字下划线和短横线."""
+    return isinstance(name, str) and re.fullmatch(r"[\w\-]+", name) is not None
+
+
+class Room:
+    """
+    单个宿舍的查询状态: 宿舍信息, 登录会话和最近一次查询到的电量.
+
+    degree 的取值含义同 `query_electric_degree`.
+    """
+
+    def __init__(self, name: str, roomNo: str = "", elcarea: int = -1, elcbuis: str = ""):
+        self.name = name
+        self.roomNo = roomNo
+        self.elcarea = elcarea
+        self.elcbuis = elcbuis
+        self.session: Optional[Session] = None  # 由 POST_TOKEN 设置, 可能和其他宿舍共用.
+        self.degree: float = -1
+        self.adaptive = AdaptiveInterval()
+        self.forecast = DepletionForecast()
+        self.querying = asyncio.Lock()  # 定时查询和 REFRESH 不同时查询同一个宿舍.
+        self._store: Optional[DegreeStore] = None
+
+    def configured(self) -> bool:
+        """宿舍信息是否已经配置完整."""
+        return bool(self.roomNo) and self.elcarea >= 0 and bool(self.elcbuis)
+
+    def upstream_key(self) -> tuple:
+        """epay 中宿舍的标识, 不同宿舍名配置了同一个宿舍 (如室友各自运行客户端) 时相同."""
+        return self.roomNo, self.elcarea, self.elcbuis
+
+    def info(self) -> dict:
+        return {"roomNo": self.roomNo, "elcarea": self.elcarea, "elcbuis": self.elcbuis}
+
+    @property
+    def degree_file(self) -> str:
+        """默认宿舍记录在 DEGREE_FILE, 其他宿舍各自记录在 DEGREE_DIR 下."""
+        if self.name == DEFAULT_ROOM:
+            return DEGREE_FILE
+        return os.path.join(DEGREE_DIR, f"{self.name}.bin")
+
+    @property
+    def degree_csv_file(self) -> str:
+        if self.name == DEFAULT_ROOM:
+            return DEGREE_CSV_FILE
+        return os.path.join(DEGREE_DIR, f"{self.name}.csv")
+
+    def store_opened(self) -> bool:
+        return self._store is not None
+
+    @property
+    def store(self) -> DegreeStore:
+        """电量记录, 第一次访问时打开, 如果只有旧的 csv 记录则先转换."""
+        if self._store is None:
+            if not os.path.exists(self.degree_file) and os.path.exists(self.degree_csv_file):
+                migrate_csv(self.degree_csv_file, self.degree_file)
+            self._store = DegreeStore(self.degree_file)
+        return self._store
+
+    def __repr__(self):
+        return f"Room({self.name!r}, {self.info()}, degree={self.degree})"
@@ -0,0 +1,124 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import traceback
+from typing import Awaitable, Callable, Optional
+
+from ecnuqueryelectricbill.server.room import Room
+
+
+class Scheduler:
+    """
+    多宿舍轮询调度器.
+
+    每个宿舍各自按间隔 (上下浮动 jitter 比例) 轮询一次, 间隔由 query 的返回值决定,
+    返回 None 时使用默认的 interval 秒.
+    新加入的宿舍首次轮询时间在 [0, interval) 内随机分布, 避免所有宿舍挤在同一时刻查询.
+    同一时刻最多只有 workers 个查询在进行, 因此宿舍再多, 对上游的并发压力也是有上限的.
+    """
+
+    def __init__(
+        self,
+        query: Callable[[Room], Awaitable[Optional[float]]],
+        interval: float = 10,
+        workers: int = 8,
+        jitter: float = 0.2,
+    ):
+        self._query = query
+        self.interval = interval
+        self.workers = workers
+        self.jitter = jitter
+        self._rooms: dict[str, Room] = {}
+        self._heap: list[tuple[float, int, str]] = []  # (到期时间, 序号, 宿舍名).
+        self._entries: dict[str, int] = {}  # 宿舍名 -> 堆中有效条目的序号, 其余条目已作废.
+        self._running: set[str] = set()  # 正在查询的宿舍.
+        self._rerun: set[str] = set()  # 查询期间被要求立即重查的宿舍.
+        self._counter = itertools.count()
+        self._stopping = False  # run 退出时才取消 worker, 其他来源的 CancelledError 不应让 worker 退出.
+        self._wakeup = asyncio.Event()
+
+    def _push(self, name: str, delay: float):
+        due = asyncio.get_running_loop().time() + delay
+        seq = next(self._counter)
+        heapq.heappush(self._heap, (due, seq, name))
+        self._entries[name] = seq
+        self._wakeup.set()
+
+    def _jittered(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def add(self, room: Room):
+        """加入 (或替换) 一个宿舍, 可以在 run 运行期间调用."""
+        self._rooms[room.name] = room
+        if room.name not in self._entries and room.name not in self._running:
+            self._push(room.name, random.uniform(0, self.interval))
+
+    def remove(self, name: str):
+        self._rooms.pop(name, None)
+
+    def reschedule(self, name: str, delay: float = 0):
+        """让宿舍在 delay 秒后查询, 取代原来的计划, 例如刚上传了 token 时."""
+        if name in self._running:
+            self._rerun.add(name)
+        elif name in self._rooms:
+            self._push(name, delay)
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            room: Room = await queue.get()
+            delay = None
+            try:
+                delay = await self._query(room)
+            except Exception:
+                logging.error(traceback.format_exc())
+            except asyncio.CancelledError:
+                if self._stopping:
+                    raise
+                logging.error(traceback.format_exc())
+            finally:
+                self._running.discard(room.name)
+                if room.name in self._rerun:
+                    self._rerun.discard(room.name)
+                    delay = 0
+                elif delay is None:
+                    delay = self.interval
+                if room.name in self._rooms:
+                    self._push(room.name, self._jittered(delay))
+                queue.task_done()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        # 队列容量等于 worker 数, 查询堆积时调度循环会在 put 处等待, 而不是继续派发.
+        queue = asyncio.Queue(maxsize=self.workers)
+        tasks = [asyncio.create_task(self._worker(queue)) for _ in range(self.workers)]
+        try:
+            while True:
+                if not self._heap:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                    continue
+                due, seq, name = self._heap[0]
+                if self._entries.get(name) != seq:
+                    heapq.heappop(self._heap)  # 已被 reschedule 取代的条目.
+                    continue
+                delay = due - loop.time()
+                if delay > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), delay)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                heapq.heappop(self._heap)
+                del self._entries[name]
+                room = self._rooms.get(name)
+                if room is None:
+                    continue
+                self._running.add(name)
+                await queue.put(room)
+        finally:
+            self._stopping = True
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,144 @@
+import logging
+import statistics
+import time
+from collections import deque
+from typing import Optional
+
+DEFAULT_IDLE_LIMIT = 15 * 60  # 还没有观察到空闲过期时, 假设会话空闲这么多秒后过期.
+MIN_KEEPALIVE = 30  # 保活请求的最短间隔 (秒).
+SAFETY = 0.5  # 空闲时间达到估计的空闲上限乘以此系数时就发送保活请求, 留出调度浮动的余量.
+HISTORY = 16  # 记住最近多少次会话过期.
+
+
+class Session:
+    """
+    一组 epay 登录凭据 (x_csrf_token 和 cookies) 及其使用情况.
+
+    相同 cookies 的宿舍共用同一个 Session, 任何一个宿舍的成功查询都算作这个会话的一次使用,
+    任何一个宿舍发现过期后其他宿舍也不再用它请求上游.
+    """
+
+    def __init__(self, x_csrf_token: str, cookies: dict[str, str], now: Optional[float] = None):
+        now = time.time() if now is None else now
+        self.x_csrf_token = x_csrf_token
+        self.cookies = cookies
+        self.created = now
+        self.last_ok = now  # 最近一次确认会话有效的时间, 刚上传的凭据视为有效.
+        self.expired = False
+
+    def renew(self, x_csrf_token: str, now: Optional[float] = None):
+        """同一组 cookies 重新登录后上传了新的 token."""
+        now = time.time() if now is None else now
+        self.x_csrf_token = x_csrf_token
+        self.created = self.last_ok = now
+        self.expired = False
+
+    def age(self, now: Optional[float] = None) -> float:
+        return (time.time() if now is None else now) - self.created
+
+    def idle(self, now: Optional[float] = None) -> float:
+        return (time.time() if now is None else now) - self.last_ok
+
+    def __repr__(self):
+        return f"Session(age={self.age():.0f}s, idle={self.idle():.0f}s, expired={self.expired})"
+
+
+class SessionLifetime:
+    """
+    根据观察到的结果学习 epay 会话多久不用会过期 (空闲上限), 以及会话总共能用多久 (寿命).
+
+    - 空闲 g 秒后查询成功: 空闲上限至少为 g.
+    - 空闲 g 秒后发现过期: 如果 g 超过已知成功过的最长空闲, 空闲上限小于 g;
+      否则说明不是空闲导致的, 而是会话到了寿命, 只记录寿命.
+    """
+
+    def __init__(self, default_idle_limit: float = DEFAULT_IDLE_LIMIT, min_keepalive: float = MIN_KEEPALIVE):
+        self.default_idle_limit = default_idle_limit
+        self.min_keepalive = min_keepalive
+        self.idle_ok = 0.0  # 成功过的最长空闲时间.
+        self.idle_failed: deque[float] = deque(maxlen=HISTORY)  # 导致过期的空闲时间.
+        self.ages: deque[float] = deque(maxlen=HISTORY)  # 过期会话最后一次有效时的年龄.
+
+    def succeeded(self, idle: float):
+        if idle > self.idle_ok:
+            self.idle_ok = idle
+            # 更长的空闲也成功过, 之前的推断不再成立 (例如服务端改了配置).
+            kept = [g for g in self.idle_failed if g > idle]
+            self.idle_failed.clear()
+            self.idle_failed.extend(kept)
+
+    def failed(self, idle: float, age: float):
+        if idle > self.idle_ok:
+            self.idle_failed.append(idle)
+        self.ages.append(age)
+
+    def idle_limit(self) -> float:
+        """估计的空闲上限 (秒)."""
+        if self.idle_failed:
+            return min(self.idle_failed)
+        return max(self.default_idle_limit, self.idle_ok)
+
+    def expected_lifetime(self) -> Optional[float]:
+        """过期会话寿命的中位数 (秒), 还没有过期记录时为 None."""
+        return statistics.median(self.ages) if self.ages else None
+
+    def keepalive_gap(self) -> float:
+        """会话最多空闲多久就应该发送保活请求."""
+        return max(self.idle_limit() * SAFETY, self.min_keepalive)
+
+
+class SessionManager:
+    """
+    所有宿舍共用的凭据缓存, 按 cookies 去重, 并为每个会话安排保活.
+
+    epay 的查询本身就是一个很小的 POST, 所以保活请求就是提前进行的一次正常查询,
+    由 keepalive_delay 限制宿舍的下一次查询不晚于会话空闲到上限之前.
+    """
+
+    def __init__(self, lifetime: Optional[SessionLifetime] = None):
+        self.lifetime = lifetime or SessionLifetime()
+        self._sessions: dict[tuple, Session] = {}
+
+    @staticmethod
+    def _key(cookies: dict[str, str]) -> tuple:
+        return tuple(sorted(cookies.items()))
+
+    def post(self, x_csrf_token: str, cookies: dict[str, str], now: Optional[float] = None) -> Session:
+        """上传了新的凭据, 返回对应的会话, cookies 相同时沿用已有的会话, 已经过期的会重新开始计时."""
+        key = self._key(cookies)
+        for other in [k for k, session in self._sessions.items() if session.expired and k != key]:
+            del self._sessions[other]
+        session = self._sessions.get(key)
+        if session is None:
+            session = self._sessions[key] = Session(x_csrf_token, cookies, now)
+        elif session.expired:
+            session.renew(x_csrf_token, now)
+        else:
+            session.x_csrf_token = x_csrf_token
+        return session
+
+    def restore(self, session: Session) -> Session:
+        """加入从 StateStore 恢复的会话, cookies 相同的会话已经存在时返回已有的会话."""
+        return self._sessions.setdefault(self._key(session.cookies), session)
+
+    def succeeded(self, session: Session, now: Optional[float] = None):
+        now = time.time() if now is None else now
+        self.lifetime.succeeded(session.idle(now))
+        session.last_ok = now
+
+    def failed(self, session: Session, now: Optional[float] = None):
+        """会话已经失效, 之后使用它的宿舍都不会再请求上游, 直到重新上传凭据."""
+        if session.expired:
+            return
+        now = time.time() if now is None else now
+        session.expired = True
+        self.lifetime.failed(session.idle(now), session.last_ok - session.created)
+        logging.info(
+            f"session expired: age {session.age(now):.0f}s, idle {session.idle(now):.0f}s, "
+            f"learned idle limit {self.lifetime.idle_limit():.0f}s, "
+            f"expected lifetime {self.lifetime.expected_lifetime():.0f}s."
+        )
+
+    def keepalive_delay(self, session: Session, now: Optional[float] = None) -> float:
+        """距离会话需要保活还有多少秒."""
+        return max(self.lifetime.keepalive_gap() - session.idle(now), 0)
@@ -0,0 +1,141 @@
+import json
+import logging
+import sqlite3
+from typing import Optional
+
+from ecnuqueryelectricbill.server.session import Session
+
+STATE_FILE = "state.db"  # 宿舍信息, 登录会话和最近电量, 服务端重启后从这里恢复.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    cookies TEXT PRIMARY KEY,  -- 按键排序的 JSON, 同 SessionManager 的去重方式.
+    x_csrf_token TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_ok REAL NOT NULL,
+    expired INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS rooms (
+    name TEXT PRIMARY KEY,
+    roomNo TEXT NOT NULL DEFAULT '',
+    elcarea INTEGER NOT NULL DEFAULT -1,
+    elcbuis TEXT NOT NULL DEFAULT '',
+    session TEXT REFERENCES sessions (cookies),
+    degree REAL,
+    degree_time REAL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+"""
+
+
+def session_key(cookies: dict[str, str]) -> str:
+    return json.dumps(cookies, sort_keys=True, ensure_ascii=False)
+
+
+class RoomState:
+    """从 StateStore 读出的一个宿舍的状态, session 为 None 时表示没有上传过 token."""
+
+    def __init__(self, name: str, info: dict, session: Optional[Session],
+                 degree: Optional[float], degree_time: Optional[float]):
+        self.name = name
+        self.info = info
+        self.session = session
+        self.degree = degree
+        self.degree_time = degree_time
+
+
+class StateStore:
+    """
+    服务端的持久状态, 保存在 WAL 模式的 SQLite 数据库中.
+
+    每次保存都在一个事务中完成 (with 连接时提交, 出错时回滚), 进程在任何时刻退出都不会留下写到一半的状态.
+    写入方法会阻塞, 由 Writer 在写线程中调用 (见 Writer.call), 所以连接允许跨线程使用,
+    load 只在启动时, 写线程开始工作之前调用.
+    """
+
+    def __init__(self, path: str = STATE_FILE):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # WAL 下仍能保证一致性, 断电时最多丢失最近的提交.
+        self._conn.executescript(SCHEMA)
+
+    def load(self) -> list[RoomState]:
+        """读出所有宿舍的状态, 共用 cookies 的宿舍得到同一个 Session."""
+        sessions = {}
+        for cookies, x_csrf_token, created, last_ok, expired in self._conn.execute(
+                "SELECT cookies, x_csrf_token, created, last_ok, expired FROM sessions"):
+            session = Session(x_csrf_token, json.loads(cookies), created)
+            session.last_ok = last_ok
+            session.expired = bool(expired)
+            sessions[cookies] = session
+        return [
+            RoomState(
+                name, {"roomNo": roomNo, "elcarea": elcarea, "elcbuis": elcbuis},
+                sessions.get(session), degree, degree_time,
+            )
+            for name, roomNo, elcarea, elcbuis, session, degree, degree_time in self._conn.execute(
+                "SELECT name, roomNo, elcarea, elcbuis, session, degree, degree_time FROM rooms")
+        ]
+
+    def get_meta(self, key: str, default: object = None) -> object:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return default if row is None else row[0]
+
+    def set_meta(self, key: str, value: object):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def save_rooms(self, infos: dict[str, dict]):
+        """保存若干宿舍的宿舍信息 (宿舍名 -> Room.info()), 不影响会话和电量."""
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO rooms (name, roomNo, elcarea, elcbuis) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET "
+                "roomNo = excluded.roomNo, elcarea = excluded.elcarea, elcbuis = excluded.elcbuis",
+                [(name, info["roomNo"], info["elcarea"], info["elcbuis"]) for name, info in infos.items()],
+            )
+
+    def save_session(self, session: Session, rooms: list[str]):
+        """保存会话的当前状态, 并记为 rooms 中各宿舍使用的会话, 不再被任何宿舍使用的会话一并删除."""
+        key = session_key(session.cookies)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (cookies, x_csrf_token, created, last_ok, expired) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, session.x_csrf_token, session.created, session.last_ok, int(session.expired)),
+            )
+            self._conn.executemany(
+                "INSERT INTO rooms (name, session) VALUES (?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET session = excluded.session",
+                [(name, key) for name in rooms],
+            )
+            self._conn.execute(
+                "DELETE FROM sessions WHERE cookies NOT IN "
+                "(SELECT session FROM rooms WHERE session IS NOT NULL)"
+            )
+
+    def save_degree(self, room: str, degree: float, timestamp: float, session: Optional[Session] = None):
+        """保存宿舍最近一次查询的电量, session 不为 None 时同时更新其有效时间和是否过期."""
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO rooms (name, degree, degree_time) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET degree = excluded.degree, degree_time = excluded.degree_time",
+                (room, degree, timestamp),
+            )
+            if session is not None:
+                self._conn.execute(
+                    "UPDATE sessions SET last_ok = ?, expired = ? WHERE cookies = ?",
+                    (session.last_ok, int(session.expired), session_key(session.cookies)),
+                )
+
+    def close(self):
+        try:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        except sqlite3.Error:
+            logging.exception("failed to checkpoint state.")
+        self._conn.close()
+
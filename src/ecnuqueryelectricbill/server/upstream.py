@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from importlib.util import find_spec
+from typing import Optional
+
+import httpx
+
+QUERY_URL = "https://epay.ecnu.edu.cn/epaycas/electric/queryelectricbill"
+HTTP2 = find_spec("h2") is not None  # 依赖中的 httpx[http2] 会安装 h2, 缺少时 (如手动只装了 httpx) 退回 HTTP/1.1.
+RETRY_STATUS = {502, 503, 504}
+AUTH_STATUS = {401, 403}  # 除了跳转到 CAS 登录页 (3xx) 以外, 表示登录失效的状态码.
+AUTH_MESSAGES = ("登录", "权限", "会话")  # retcode 不为 0 时, retmsg 中含有这些词视为登录失效.
+
+
+class UpstreamError(Exception):
+    """上游暂时出错 (5xx, 维护页面等非 JSON 内容, 宿舍信息不正确等), 和登录失效无关, 稍后重试即可."""
+
+
+def auth_failed(response: httpx.Response, ret: Optional[dict] = None) -> bool:
+    """response (及其解析出的 JSON ret) 是否表示登录失效."""
+    if response.is_redirect or response.status_code in AUTH_STATUS:
+        return True
+    return ret is not None and any(word in str(ret.get("retmsg", "")) for word in AUTH_MESSAGES)
+
+
+class UpstreamClient:
+    """
+    长连接复用的 epay 查询客户端, 所有宿舍共用一个连接池, 避免每次查询都重新握手.
+
+    各宿舍的 cookies 不同, 所以连接池本身不保存任何 cookie, 每次请求显式带上 Cookie 头.
+    连接出错或者网关错误时按 backoff * 2^n 秒退避重试, 最多重试 retries 次.
+    query_url 可以指向本地的模拟服务, 用于测试.
+    """
+
+    def __init__(
+        self,
+        max_connections: int = 16,
+        max_keepalive_connections: int = 8,
+        keepalive_expiry: float = 60,
+        timeout: float = 10,
+        retries: int = 2,
+        backoff: float = 0.5,
+        verify=True,
+        query_url: str = QUERY_URL,
+    ):
+        self.query_url = query_url
+        self.retries = retries
+        self.backoff = backoff
+        self._client = httpx.AsyncClient(
+            http2=HTTP2,
+            verify=verify,
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry,
+            ),
+            cookies=CookieJar(policy=DefaultCookiePolicy(allowed_domains=[])),
+        )
+
+    async def post(
+        self, url: str, data: dict, headers: dict[str, str], cookies: dict[str, str]
+    ) -> httpx.Response:
+        headers = dict(headers)
+        if cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in cookies.items())
+        attempt = 0
+        while True:
+            try:
+                response = await self._client.post(url, data=data, headers=headers)
+                if response.status_code not in RETRY_STATUS or attempt >= self.retries:
+                    return response
+                logging.warning(f"upstream returned {response.status_code}, retrying.")
+            except httpx.TransportError as e:
+                if attempt >= self.retries:
+                    raise
+                logging.warning(f"upstream request failed: {e!r}, retrying.")
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+            attempt += 1
+
+    async def aclose(self):
+        await self._client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
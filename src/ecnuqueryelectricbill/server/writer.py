@@ -0,0 +1,142 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from ecnuqueryelectricbill.server import metrics
+from ecnuqueryelectricbill.store import DegreeStore
+
+FSYNC_ALWAYS = "always"  # 每次成批写入后都 fsync, 最安全也最慢.
+FSYNC_INTERVAL = "interval"  # 距离上次 fsync 超过 fsync_interval 秒才 fsync, 最多丢失这段时间内的记录.
+FSYNC_NEVER = "never"  # 只 flush, 交给操作系统决定何时落盘.
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+MAX_BATCH = 1024  # 一次成批写入最多合并的请求数.
+
+WRITE_SECONDS = metrics.Histogram("history_write_seconds", "Time to commit one batch of writes, including fsync.")
+WRITE_BATCH = metrics.Histogram(
+    "history_write_batch_requests", "Write requests merged into one batch.", buckets=(1, 2, 4, 8, 16, 64, 256, 1024)
+)
+
+
+class Writer:
+    """
+    服务端唯一写文件的任务, 事件循环中的调用方只把写入请求放进队列, 不会被磁盘阻塞.
+
+    run 每次取出队列中已经积累的所有请求 (不超过 MAX_BATCH), 同一个文件的记录合并为一次写入,
+    在专用的写线程中执行, 然后按 fsync 策略同步 (group commit).
+    写线程只有一个, 所以同一个文件的写入顺序和请求顺序一致.
+    """
+
+    def __init__(self, fsync: str = FSYNC_INTERVAL, fsync_interval: float = 1.0, max_batch: int = MAX_BATCH):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy: {fsync!r}")
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.max_batch = max_batch
+        self._queue: asyncio.Queue[tuple[object, object]] = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="writer")
+        self._dirty: set[DegreeStore] = set()  # 写入后还没有 fsync 的记录文件.
+        self._last_sync = time.monotonic()
+
+    def append(self, store: DegreeStore, timestamp: float, degree: float) -> bool:
+        """追加一条电量记录, 返回是否会写入 (电量和上一条相同时不写入), 含义同 DegreeStore.append."""
+        record = store.prepare(timestamp, degree)
+        if record is None:
+            return False
+        self._queue.put_nowait((store, record))
+        return True
+
+    def replace(self, path: str, content: str | bytes):
+        """用 content 替换整个文件, 先写临时文件再重命名, 不会留下写到一半的文件."""
+        self._queue.put_nowait((path, content))
+
+    def call(self, func, *args):
+        """在写线程中调用 func(*args), 用于其他阻塞的写入 (如 StateStore), 和记录的写入保持先后顺序."""
+        self._queue.put_nowait((func, args))
+
+    async def flush(self):
+        """等待此前的所有请求写入完成."""
+        await self._queue.join()
+
+    def _take(self) -> list[tuple[object, object]]:
+        batch = []
+        while len(batch) < self.max_batch and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    def _commit(self, batch: list[tuple[object, object]]):
+        """在写线程中执行一批请求."""
+        records: dict[DegreeStore, list[bytes]] = {}
+        for target, data in batch:
+            if isinstance(target, DegreeStore):
+                records.setdefault(target, []).append(data)
+                continue
+            self._flush_records(records)  # 保持记录和其他文件之间的先后顺序.
+            records = {}
+            if callable(target):
+                try:
+                    target(*data)
+                except Exception:  # 不影响同一批中的其他写入.
+                    logging.exception(f"failed to call {target.__qualname__}.")
+            else:
+                self._replace(target, data)
+        self._flush_records(records)
+        if self.fsync == FSYNC_ALWAYS or (
+                self.fsync == FSYNC_INTERVAL and time.monotonic() - self._last_sync >= self.fsync_interval):
+            self._sync()
+
+    def _flush_records(self, records: dict[DegreeStore, list[bytes]]):
+        for store, data in records.items():
+            store.write(b"".join(data))
+            self._dirty.add(store)
+
+    def _replace(self, path: str, content: str | bytes):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(content.encode("utf-8") if isinstance(content, str) else content)
+            if self.fsync != FSYNC_NEVER:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def _sync(self):
+        for store in self._dirty:
+            store.sync()
+        self._dirty.clear()
+        self._last_sync = time.monotonic()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                timeout: Optional[float] = None
+                if self._dirty and self.fsync == FSYNC_INTERVAL:
+                    timeout = max(self.fsync_interval - (time.monotonic() - self._last_sync), 0)
+                try:
+                    first = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    # 一段时间没有新的写入, 把之前写入的记录同步到磁盘.
+                    await loop.run_in_executor(self._executor, self._sync)
+                    continue
+                batch = [first] + self._take()
+                start = time.perf_counter()
+                try:
+                    await loop.run_in_executor(self._executor, self._commit, batch)
+                    if metrics.enabled:
+                        WRITE_SECONDS.observe(time.perf_counter() - start)
+                        WRITE_BATCH.observe(len(batch))
+                except OSError:
+                    logging.exception(f"failed to write {len(batch)} requests.")
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            # 退出前把队列中剩下的请求写完.
+            batch = self._take()
+            self._executor.shutdown(wait=True)
+            if batch:
+                self._commit(batch)
+            if self._dirty and self.fsync != FSYNC_NEVER:
+                self._sync()
@@ -0,0 +1,197 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Optional
+
+RECORD = struct.Struct("<df")  # (时间戳 float64, 电量 float32), 每条 12 字节.
+
+
+def format_record(timestamp: float, degree: float) -> str:
+    """转换成原来 degree.csv 中一行的格式, float32 的电量只保留有效位数."""
+    return f"{timestamp:.2f}, {degree:.7g}"
+
+
+class DegreeStore:
+    """
+    定长二进制格式的电量记录, 只追加, 按时间戳递增.
+
+    写入时和上一条记录电量相同则丢弃, 所以文件中相邻两条的电量一定不同.
+    读取通过 mmap 进行, 不需要解析文本, 按时间戳查找为 O(log n), 取最后 n 条为 O(n).
+    读取可以在多个线程中进行, 写入同一时间只能在一个线程中进行.
+    服务端由 writer 任务负责写入: 事件循环中先用 prepare 去重, 之后在写线程中 write 成批写入.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "ab")
+        size = self._file.tell()
+        if size % RECORD.size:
+            # 上次写到一半就退出了, 丢掉不完整的记录.
+            logging.warning(f"{path}: truncating {size % RECORD.size} trailing bytes.")
+            size -= size % RECORD.size
+            self._file.truncate(size)
+        self._len = size // RECORD.size
+        self._mmap: Optional[mmap.mmap] = None
+        self._mapped_len = 0
+        self._lock = threading.Lock()  # 保护 mmap 的重新映射, 防止读线程之间互相关闭映射.
+        self._last: Optional[tuple[float, float]] = self[-1] if self._len else None
+
+    def __len__(self):
+        return self._len
+
+    def _map(self) -> mmap.mmap:
+        """需要持有 _lock 调用, 文件变长之后重新映射."""
+        length = self._len
+        if self._mapped_len != length:
+            self._close_map()
+            with open(self.path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), length * RECORD.size, access=mmap.ACCESS_READ)
+            self._mapped_len = length
+        return self._mmap
+
+    def __getitem__(self, i: int) -> tuple[float, float]:
+        if i < 0:
+            i += self._len
+        if not 0 <= i < self._len:
+            raise IndexError(i)
+        with self._lock:
+            return RECORD.unpack_from(self._map(), i * RECORD.size)
+
+    def prepare(self, timestamp: float, degree: float) -> Optional[bytes]:
+        """
+        去重并编码一条记录: 电量和上一条 (包括已经 prepare 但还没有写入的) 相同时返回 None,
+        否则返回编码后的记录, 调用方需要之后按顺序 write.
+        """
+        record = RECORD.pack(timestamp, degree)
+        timestamp, degree = RECORD.unpack(record)  # 按 float32 精度比较.
+        if self._last is not None and self._last[1] == degree:
+            return None
+        self._last = (timestamp, degree)
+        return record
+
+    def write(self, data: bytes | bytearray | memoryview):
+        """写入已经编码好的记录, 写入完成后读取方才能看到这些记录."""
+        self._file.write(data)
+        self._file.flush()
+        self._len += len(data) // RECORD.size
+
+    def sync(self):
+        """把已经写入的记录同步到磁盘."""
+        os.fsync(self._file.fileno())
+
+    def append(self, timestamp: float, degree: float) -> bool:
+        """追加一条记录, 返回是否真正写入 (电量和上一条相同时不写入)."""
+        record = self.prepare(timestamp, degree)
+        if record is None:
+            return False
+        self.write(record)
+        return True
+
+    def extend_raw(self, data: bytes | bytearray | memoryview):
+        """直接追加若干条已经编码好的记录 (例如从服务端收到的), 不做去重."""
+        if len(data) % RECORD.size:
+            raise ValueError(f"data length {len(data)} is not a multiple of {RECORD.size}")
+        if not len(data):
+            return
+        self.write(data)
+        self._last = RECORD.unpack_from(data, len(data) - RECORD.size)
+
+    def truncate(self, n: int):
+        """只保留前 n 条记录, 用于丢弃没有通过校验的记录, 和 write 一样只能在写入的线程中调用."""
+        if not 0 <= n <= self._len:
+            raise ValueError(f"cannot truncate {self._len} records to {n}")
+        with self._lock:
+            self._close_map()
+            self._file.truncate(n * RECORD.size)
+            self._len = n
+        self._last = self[-1] if n else None
+
+    def bisect(self, timestamp: float, right: bool = False) -> int:
+        """第一条时间戳不小于 (right 为 True 时为大于) timestamp 的记录下标."""
+        lo, hi = 0, self._len
+        if not hi:
+            return 0
+        with self._lock:
+            m = self._map()
+            while lo < hi:
+                mid = (lo + hi) // 2
+                t = RECORD.unpack_from(m, mid * RECORD.size)[0]
+                if t < timestamp or right and t == timestamp:
+                    lo = mid + 1
+                else:
+                    hi = mid
+        return lo
+
+    def read_bytes(self, start: int, stop: int) -> bytes:
+        """下标 [start, stop) 的记录的原始字节."""
+        start, stop, _ = slice(start, stop).indices(self._len)
+        if start >= stop:
+            return b""
+        with self._lock:
+            return self._map()[start * RECORD.size:stop * RECORD.size]
+
+    def slice(self, start: int, stop: int) -> list[tuple[float, float]]:
+        return list(RECORD.iter_unpack(self.read_bytes(start, stop)))
+
+    def range(self, start: Optional[float] = None, end: Optional[float] = None) -> list[tuple[float, float]]:
+        """时间戳在 [start, end) 内的记录."""
+        lo = 0 if start is None else self.bisect(start)
+        hi = self._len if end is None else self.bisect(end)
+        return self.slice(lo, hi)
+
+    def tail(self, n: int) -> list[tuple[float, float]]:
+        return self.slice(max(self._len - n, 0), self._len)
+
+    def checksum(self, stop: Optional[int] = None, chunk: int = 1 << 16) -> int:
+        """前 stop 条记录 (默认全部) 原始字节的 CRC32, 分块计算, 内存占用不随记录数增长."""
+        stop = self._len if stop is None else min(stop, self._len)
+        crc = 0
+        for start in range(0, stop, chunk):
+            crc = zlib.crc32(self.read_bytes(start, min(start + chunk, stop)), crc)
+        return crc
+
+    def close(self):
+        with self._lock:
+            self._close_map()
+        self._file.close()
+
+    def _close_map(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+            self._mapped_len = 0
+
+
+def migrate_csv(csv_path: str, path: str):
+    """
+    把旧的 degree.csv 一次性转换为二进制记录, 相邻重复的电量会被去掉.
+
+    无法解析的行 (例如旧版本写到一半就退出留下的最后一行) 记录警告后跳过.
+    转换完成后 csv 文件重命名为 `*.bak`, 之后不会再次转换.
+    """
+    tmp = path + ".tmp"
+    if os.path.exists(tmp):
+        os.remove(tmp)
+    store = DegreeStore(tmp)
+    skipped = 0
+    try:
+        with open(csv_path, "r") as f:
+            for lineno, line in enumerate(f, 1):
+                if line.isspace():
+                    continue
+                try:
+                    timestamp, degree_ = line.split(",")
+                    store.append(float(timestamp), float(degree_))
+                except ValueError:
+                    logging.warning(f"{csv_path}:{lineno}: skipping malformed line {line.strip()!r}.")
+                    skipped += 1
+        count = len(store)
+    finally:
+        store.close()
+    os.replace(tmp, path)
+    os.replace(csv_path, csv_path + ".bak")
+    logging.info(f"migrated {csv_path} to {path}: {count} records, {skipped} malformed lines skipped.")
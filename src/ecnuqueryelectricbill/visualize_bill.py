@@ -2,99 +2,93 @@
 可视化电量变化.
 """
 
+import argparse
 import asyncio
-import math
 import os
+import time
 from datetime import datetime
+from typing import Optional
 
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-import csv
-
-from ecnuqueryelectricbill import SERVER_PORT
+from ecnuqueryelectricbill import SERVER_PORT, DEFAULT_ROOM, chdir_project
 from ecnuqueryelectricbill.client import GuardClient, load_config
+from ecnuqueryelectricbill.downsample import LTTB, METHODS, downsample
+from ecnuqueryelectricbill.store import DegreeStore
 from websockets.asyncio.client import connect
+from websockets.exceptions import WebSocketException
 
-DEGREE_CSV_FILE = "out/degree.csv"
-
-# 解决中文显示的问题.
-mpl.rcParams["font.family"] = "SimHei"
-plt.rcParams["axes.unicode_minus"] = False  # 步骤二 (解决坐标轴负数的负号显示问题)
+CACHE_FILE = "out/degree.bin"  # 本地缓存的电量记录, 每次运行只下载比缓存更新的部分.
 
 
-async def download_data():
-    os.makedirs(os.path.dirname(DEGREE_CSV_FILE), exist_ok=True)
-    server_address = load_config()["server_address"]
+async def sync_cache() -> int:
+    """把服务端上比 CACHE_FILE 中最后一条更新的记录追加到缓存, 返回新增的记录数."""
+    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+    config = load_config()
+    server_address = config["server_address"]
     async with connect(f"ws://{server_address}:{SERVER_PORT}/") as client:
-        gc = GuardClient(client)
-        await gc.fetch_degree_file(DEGREE_CSV_FILE)
+        gc = GuardClient(client, config.get("room", DEFAULT_ROOM))
+        await gc.hello()
+        return await gc.stream_degree_file(CACHE_FILE, by_time=True)
+
+
+def load_data(
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    max_points: int = 2000,
+    method: str = LTTB,
+):
+    """从缓存中读取时间范围 [start, end) 内的记录, 降采样到不超过 max_points 个点."""
+    if not os.path.exists(CACHE_FILE):
+        return [], []
+    store = DegreeStore(CACHE_FILE)
+    try:
+        records = store.range(start, end)
+    finally:
+        store.close()
+    return downsample(
+        [record[0] for record in records], [record[1] for record in records], max_points, method
+    )
 
 
-def load_data():
-    timestamp = []
-    degree = []
-    try:
-        with open(DEGREE_CSV_FILE, "r") as f:
-            prev_degree_str = None
-            for row in csv.reader(f):
-                if prev_degree_str == row[1]:
-                    continue
-                prev_degree_str = row[1]
-                timestamp.append(float(row[0]))
-                degree.append(float(row[1]))
-    except FileNotFoundError:
-        pass
-    return timestamp, degree
-
-
-def smooth(timestamp, data, alpha=0.9, k=0.6):
-    """
-    数据平滑, 但是要解决非相同时间间隔的数据影响.
-
-    # 符号解释
-
-    - alpha 为保留系数, 越大数据变动越慢.
-    - a 为保留系数实例, 经过 alpha 与间隔时间比例相乘得到, 远的数据保留系数实例 a 越小, 近的数据(高频)保留系数实例 a 越大.
-    - k 为距离促动速度, 越大则同距离时数据对变动速度影响越大.
-
-    alpha = 0, k = 0 时, 函数输出的数据和原始数据相同.
-    """
-    assert len(data) == len(timestamp)
-    if not data:
-        return []
-    max_delta_time = 0
-    for i in range(len(timestamp) - 1):
-        max_delta_time = max(max_delta_time, timestamp[i + 1] - timestamp[i])
-    r = data[0]
-    rst = []
-    for i in range(len(data)):
-        if i == 0:
-            delta_time = 0
-        else:
-            delta_time = timestamp[i] - timestamp[i - 1]
-        a = alpha * math.exp(-k * (delta_time / max_delta_time))
-        r = r * a + data[i] * (1 - a)
-        rst.append(r)
-    return rst
-
-
-def consuming_speed(timestamp, degree):
-    t, s = [], []  # 消耗速度时间戳和消耗速度, 单位: 度/天.
-    for i in range(len(timestamp) - 1):
-        delta_time = timestamp[i + 1] - timestamp[i]
-        t.append(delta_time / 2 + timestamp[i])
-        s.append(max(degree[i] - degree[i + 1], 0) / delta_time * 3600 * 24)
-    s = smooth(t, s)
-    return t, s
+def parse_args():
+    parser = argparse.ArgumentParser(description="可视化电量变化.")
+    parser.add_argument("--days", type=float, help="只显示最近若干天, 默认显示全部记录.")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="起始时间, 如 2025-10-01 或 2025-10-01T08:00.")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="结束时间, 格式同 --start.")
+    parser.add_argument("--points", type=int, default=2000, help="最多显示的点数, 默认 2000.")
+    parser.add_argument("--method", choices=METHODS, default=LTTB, help="降采样方法, 默认 lttb.")
+    parser.add_argument("--offline", action="store_true", help="不连接服务端, 只使用本地缓存.")
+    return parser.parse_args()
 
 
 def main():
-    # 已经在项目根目录见 __init__.py
-    asyncio.run(download_data())
-    timestamp, degree = load_data()
+    chdir_project()
+    args = parse_args()
+    start = args.start.timestamp() if args.start else None
+    end = args.end.timestamp() if args.end else None
+    if start is None and args.days is not None:
+        start = (end or time.time()) - args.days * 3600 * 24
+    if not args.offline:
+        try:
+            print(f"synced {asyncio.run(sync_cache())} new records.")
+        except (OSError, ValueError, WebSocketException) as e:
+            print(f"sync failed, using local cache: {e!r}")
+    timestamp, degree = load_data(start, end, args.points, args.method)
     if not timestamp:
         print("no data")
         return
+    plot(timestamp, degree)
+
+
+def plot(timestamp: list[float], degree: list[float]):
+    """画出电量和消耗速度, matplotlib 只在这里才导入, 同步缓存时不需要加载."""
+    import matplotlib.pyplot as plt
+    import matplotlib as mpl
+
+    from ecnuqueryelectricbill.analytics import consuming_speed
+
+    # 解决中文显示的问题.
+    mpl.rcParams["font.family"] = "SimHei"
+    plt.rcParams["axes.unicode_minus"] = False  # 步骤二 (解决坐标轴负数的负号显示问题)
     start_date = datetime.fromtimestamp(timestamp[0])
     day_stamp = list(map(lambda x: (x - start_date.timestamp()) / 3600 / 24, timestamp))
     fig, ax = plt.subplots()